@@ -1,53 +1,25 @@
-from mlx_lm import load, generate
-import re
+import functools
 import os
-import requests
-import streamlit as st
 
-google_maps_key = os.getenv("GOOGLE_MAPS_API_KEY")
+from mlx_agent import Agent
+from model_registry import BackgroundLoader, registry
+from backends import BACKENDS, benchmark_report
+from react_loop import LazyBot, stream_query
+from budget import QueryBudget
+from answer_cache import answers
+from router import router
+from taste_engine import coffee_taste
+from maps_client import iter_nearby_coffee_shops, MAX_SHOPS, cache_stats
+from observation_format import default_formatter
+from tracing import maybe_start_metrics_server
+import streamlit as st
 
-class Agent:
-    def __init__(self, system=""):
-        self.model, self.tokenizer = load("mlx-community/Mistral-Nemo-Instruct-2407-4bit")
-        self.system = system
-        self.messages = []
-        if self.system:
-            self.messages.append({"role": "system", "content": system})
-            
-    def __call__(self, message):
-        self.messages.append({"role": "user", "content": message})
-        result = self.execute()
-        self.messages.append({"role": "assistant", "content": result}) 
-        return result
-
-    
-    def execute(self):
-        if self.system:
-            prompt = f"System: {self.system}\n\n"
-        else:
-            prompt = ""
-        for msg in self.messages:
-            if msg["role"] == "user":
-                prompt += f"User: {msg['content']}\n"
-            elif msg["role"] == "assistant":
-                prompt += f"Assistant: {msg['content']}\n"
-
-        prompt += "Assistant: " 
-        
-        response = generate(
-            self.model,
-            self.tokenizer,
-            prompt=prompt,
-            verbose=False  
-        )
-        
-        return response.strip()
-    
 prompt = """
 You run in a loop of Thought, Action, PAUSE, Observation.
 At the end of the loop you output an Answer
 Use Thought to describe your thoughts about the question you have been asked.
 Use Action to run one of the actions available to you - then return PAUSE.
+If the question needs more than one action, write one Action line for each before PAUSE.
 Observation will be the result of running those actions.
 
 Your available actions are:
@@ -78,78 +50,12 @@ Answer: A list of coffee shops in Boston, MA
 """.strip()
 
 
-def coffee_taste(taste_preferences):
-    # List of possible taste preference keywords
-    taste_keywords = [
-        'strong', 'bold', 'intense', 'mild', 'creamy', 'smooth',
-        'frothy', 'balanced', 'rich', 'diluted', 'chocolatey',
-        'less acidic', 'full-bodied', 'robust', 'clean', 'bright',
-        'aromatic', 'thick'
-    ]
-    # Normalize the sentence to lower case and split into words
-    words = taste_preferences.lower().split()
-    # Extract keywords present in the sentence
-    taste_preferences = [word for word in words if word in taste_keywords]
-    
-    coffee_profiles = [
-        {'name': 'Espresso', 'notes': ['strong', 'bold', 'intense']},
-        {'name': 'Latte', 'notes': ['mild', 'creamy', 'smooth']},
-        {'name': 'Cappuccino', 'notes': ['frothy', 'balanced', 'rich']},
-        {'name': 'Americano', 'notes': ['smooth', 'diluted', 'bold']},
-        {'name': 'Cold Brew', 'notes': ['smooth', 'chocolatey', 'less acidic']},
-        {'name': 'French Press', 'notes': ['rich', 'full-bodied', 'robust']},
-        {'name': 'Pour Over', 'notes': ['clean', 'bright', 'aromatic']},
-        {'name': 'Turkish Coffee', 'notes': ['strong', 'thick', 'intense']},
-    ]
-    recommendations = []
-    for coffee in coffee_profiles:
-        if any(pref.lower() in coffee['notes'] for pref in taste_preferences):
-            recommendations.append(coffee['name'])
-    return recommendations
-
-def find_nearby_coffee_shops(city, radius=1000):
-    geocode_url = 'https://maps.googleapis.com/maps/api/geocode/json'
-    geocode_params = {
-        'address': city,
-        'key': google_maps_key
-    }
-    geocode_response = requests.get(geocode_url, params=geocode_params)
-    geocode_data = geocode_response.json()
-    
-    if not geocode_data['results']:
-        print(f"Could not geocode city: {city}")
-        return []
-    
-    location = geocode_data['results'][0]['geometry']['location']
-    latitude = location['lat']
-    longitude = location['lng']
-
-
-    url = 'https://maps.googleapis.com/maps/api/place/nearbysearch/json'
-    params = {
-        'key': google_maps_key,
-        'location': f'{latitude},{longitude}',
-        'radius': radius,
-        'keyword': 'coffee shop',
-        'type': 'cafe'
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
-    coffee_shops = []
-    for place in data.get('results', []):
-        name = place.get('name')
-        address = place.get('vicinity')
-        location = place['geometry']['location']
-        shop_lat = location['lat']
-        shop_lng = location['lng']
-        coffee_shops.append({
-            'name': name,
-            'address': address,
-         #   'latitude': shop_lat,
-         #   'longitude': shop_lng
-        })
-    
-    return coffee_shops
+# No more shops than the observation or a routed answer shows
+SHOWN_SHOPS = min(MAX_SHOPS, max(default_formatter.top_k, router.max_shops))
+
+
+def find_nearby_coffee_shops(city, radius=1000, max_results=SHOWN_SHOPS):
+    return list(iter_nearby_coffee_shops(city, radius, max_results))
 
 
 known_actions = {
@@ -172,44 +78,21 @@ if 'conversation_history' not in st.session_state:
 if 'user_input' not in st.session_state:
     st.session_state.user_input = ""
 
-action_re = re.compile(r'^Action: (\w+): (.*)$')
+# Index of the first message shown; None shows the latest page of history
+if 'history_start' not in st.session_state:
+    st.session_state.history_start = None
 
-def process_query(user_input, max_turns=10):
-    bot = Agent(prompt)
-    next_prompt = user_input
-    final_response = ""
-    i = 0
-    
-    while i < max_turns:
-        i += 1
-        result = bot(next_prompt)
-        
-        actions = [
-            action_re.match(a) 
-            for a in result.split('\n') 
-            if action_re.match(a)
-        ]
-        
-        if actions:
-            action, action_input = actions[0].groups()
-            if action not in known_actions:
-                raise Exception(f"Unknown action: {action}: {action_input}")
-            
-            observation = known_actions[action](action_input)
-            next_prompt = f"Observation: {observation}"
-            final_response = result
-        else:
-            final_response = result
-            break
-            
-    return final_response
+# Questions sent while the model is still loading, answered once it is ready
+if 'pending' not in st.session_state:
+    st.session_state.pending = []
 
-def main():
-    st.title('AgentCoffee, at your service! ☕')
-    st.write("Ask me anything about your taste preferences and I'll recommend ways to enjoy coffee!")
+# Messages shown before older ones are paged away
+HISTORY_LIMIT = int(os.getenv("AGENT_COFFEE_HISTORY_LIMIT", "20"))
 
-    # Custom CSS for styling
-    st.markdown("""
+# Streamlit 1.37+ reruns a fragment on its own; older versions rerun the whole script
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
+
+CHAT_CSS = """
         <style>
             /* Container styling */
             .chat-message {
@@ -258,30 +141,112 @@ def main():
                 line-height: 1.5;
             }
         </style>
-    """, unsafe_allow_html=True)
+"""
+
+@st.cache_resource
+def model_loader():
+    # One loader per server process, started by the first page load; the
+    # weights, warmup and system-prompt snapshot are ready before the first question
+    return BackgroundLoader(lambda: Agent(prompt, warmup=True), name="agent").start()
+
+def model_loading():
+    # A failed load is not waited on; the next question retries it and reports the error
+    return model_loader().status()["state"] == "loading"
+
+def needs_model(question):
+    # Cached and routed questions are answered without the model, so they need
+    # not wait for it to load (a routed city with no shops still falls back)
+    if st.session_state.get("use_answer_cache", True) and answers.has(question):
+        return False
+    return not (st.session_state.get("use_router", True) and router.route(question) is not None)
+
+def bubble_html(role, content):
+    css_class, label = ("user-message", "You") if role == "user" else ("assistant-message", "Assistant")
+    return f"""
+        <div class="chat-message {css_class}">
+            <div><strong>{label}:</strong></div>
+            <div>{content}</div>
+        </div>
+    """
+
+@functools.lru_cache(maxsize=1024)
+def message_html(role, content):
+    # Each finished message's HTML is built once and reused on every rerun; the
+    # bubble being streamed changes with every token and uses bubble_html
+    return bubble_html(role, content)
+
+def stream_process_query(user_input, max_turns=10, use_cache=True, use_router=True, budget=None):
+    # The Agent (and with it the model) is only built if the question reaches the loop
+    bot = LazyBot(lambda: Agent(prompt))
+    return stream_query(bot, user_input, known_actions, max_turns, answers=answers if use_cache else None,
+                        router=router if use_router else None, budget=budget or QueryBudget())
+
+def process_query(user_input, max_turns=10, use_cache=True, use_router=True, budget=None):
+    final_response = ""
+    for kind, payload in stream_process_query(user_input, max_turns, use_cache, use_router, budget):
+        if kind == "answer":
+            final_response = payload
+    return final_response
 
-    # Create a container for chat history with scrolling
-    with st.expander("Chat History", expanded=True):
-        # Display chat history
-        for message in st.session_state.conversation_history:
-            role = message["role"]
-            content = message["content"]
-            
-            # Style based on role
-            if role == "user":
-                st.markdown(f"""
-                    <div class="chat-message user-message">
-                        <div><strong>You:</strong></div>
-                        <div>{content}</div>
-                    </div>
-                """, unsafe_allow_html=True)
+def render_stream(user_input, placeholder, use_cache=True, use_router=True):
+    # Renders Thought/Action/Observation/Answer text into the assistant bubble as it arrives
+    transcript = ""
+    final_response = ""
+    # Clear Chat cancels it; so does leaving the page, which stops this run mid-stream
+    budget = st.session_state.active_budget = QueryBudget()
+    try:
+        for kind, payload in stream_process_query(user_input, use_cache=use_cache, use_router=use_router,
+                                                  budget=budget):
+            if kind == "token":
+                transcript += payload
+            elif kind == "turn":
+                transcript += "\n"
+            elif kind == "observation":
+                transcript += payload + "\n"
+            elif kind == "trace":
+                st.session_state.last_trace = payload
+                continue
+            elif kind == "answer":
+                final_response = payload
+                continue
             else:
-                st.markdown(f"""
-                    <div class="chat-message assistant-message">
-                        <div><strong>Assistant:</strong></div>
-                        <div>{content}</div>
-                    </div>
-                """, unsafe_allow_html=True)
+                continue
+            placeholder.markdown(bubble_html("assistant", transcript), unsafe_allow_html=True)
+    finally:
+        # Stops generation and tool calls still running for an abandoned query
+        budget.cancel("abandoned")
+        st.session_state.active_budget = None
+    return final_response
+
+def rerun_chat():
+    # scope="fragment" is only allowed while Streamlit reruns the fragment itself;
+    # when chat() runs as part of the whole app (e.g. once the model has loaded),
+    # the whole app reruns
+    if hasattr(st, "fragment") and not st.session_state.get("full_run"):
+        st.rerun(scope="fragment")
+    else:
+        st.rerun()
+
+def render_history():
+    # Only the newest HISTORY_LIMIT messages are sent to the browser; older ones
+    # are paged in on request, a page at a time, as one markdown block
+    history = st.session_state.conversation_history
+    start = st.session_state.history_start
+    if start is None:
+        start = max(len(history) - HISTORY_LIMIT, 0)
+    if start > 0 and st.button(f"Show earlier messages ({start} hidden)", key="show_earlier"):
+        st.session_state.history_start = max(start - HISTORY_LIMIT, 0)
+        rerun_chat()
+    if history[start:]:
+        st.markdown("".join(message_html(m["role"], m["content"]) for m in history[start:]),
+                    unsafe_allow_html=True)
+
+@fragment
+def chat():
+    # The chat reruns on its own when a message is sent, so the title, styles
+    # and sidebar are not rebuilt for every question
+    with st.expander("Chat History", expanded=True):
+        render_history()
 
     # Create input container
     with st.container():
@@ -302,42 +267,111 @@ def main():
 
     # Process input when send button is clicked
     if send_button and user_input:
-        # Add user message to history
+        # Add user message to history; it is answered below, or queued while the model loads
         st.session_state.conversation_history.append({
             "role": "user",
             "content": user_input
         })
-        
-        # Show processing status
+        st.session_state.pending.append(user_input)
+        st.session_state.user_input = ""
+        st.session_state.history_start = None
+        if model_loading():
+            rerun_chat()
+
+    pending = st.session_state.pending
+    ready = len(pending)
+    if pending and model_loading():
+        # Questions are answered in order, so only the ones ahead of the first
+        # that needs the model go now
+        ready = next((i for i, question in enumerate(pending) if needs_model(question)), ready)
+        if ready < len(pending):
+            st.caption(f"{len(pending) - ready} question(s) queued until the model has loaded")
+    if ready:
+        # Stream each response into an assistant bubble
         status = st.empty()
-        status.text("Processing...")
         
         try:
-            # Get response from bot
-            response = process_query(user_input)
-            
-            # Add bot response to history
-            st.session_state.conversation_history.append({
-                "role": "assistant",
-                "content": response
-            })
-            
-            # Clear status and input
-            status.empty()
-            st.session_state.user_input = ""
-            st.rerun()
+            for _ in range(ready):
+                question = pending.pop(0)
+                response = render_stream(question, status, st.session_state.get("use_answer_cache", True),
+                                         st.session_state.get("use_router", True))
+                
+                # Add bot response to history
+                st.session_state.conversation_history.append({
+                    "role": "assistant",
+                    "content": response
+                })
             
         except Exception as e:
             status.error(f"Error: {str(e)}")
+        else:
+            # Clear status; new messages go back to showing the latest page
+            status.empty()
+            st.session_state.history_start = None
+            rerun_chat()
 
     # Clear chat button
     if st.button('Clear Chat', key='clear_chat'):
+        if st.session_state.get("active_budget") is not None:
+            st.session_state.active_budget.cancel()
         st.session_state.conversation_history = []
+        st.session_state.pending = []
         st.session_state.user_input = ""
+        st.session_state.history_start = None
+        rerun_chat()
+
+def readiness():
+    # Sidebar model status; once loading ends, a full rerun answers any queued questions
+    status = model_loader().status()
+    if status["state"] == "loading":
+        st.info(f"Loading model... {status['seconds']:.0f}s")
+    elif status["state"] == "failed":
+        st.error(f"Model failed to load: {status['error']}")
+    else:
+        st.success(f"Model ready (loaded in {status['seconds']:.1f}s)")
+    return status["state"]
+
+def loading_indicator():
+    # Polls once a second while the model loads; Streamlit without run_every
+    # fragments waits here when questions are queued instead
+    if hasattr(st, "fragment"):
+        @st.fragment(run_every=1)
+        def poll():
+            if readiness() != "loading":
+                st.rerun()
+        poll()
+    elif readiness() == "loading" and st.session_state.pending:
+        with st.spinner("Waiting for the model to answer queued questions..."):
+            try:
+                model_loader().wait()
+            except Exception:
+                pass
         st.rerun()
 
+def main():
+    maybe_start_metrics_server()
+    # Starts loading the model before anything is drawn, so the page is usable right away
+    loading = model_loading()
+    st.title('AgentCoffee, at your service! ☕')
+    st.write("Ask me anything about your taste preferences and I'll recommend ways to enjoy coffee!")
+
+    # Custom CSS for styling; chat() reruns leave it in place
+    st.markdown(CHAT_CSS, unsafe_allow_html=True)
+
+    # Fragment reruns call chat() without main(), so this tells rerun_chat which rerun it is in
+    st.session_state.full_run = True
+    try:
+        chat()
+    finally:
+        st.session_state.full_run = False
+
     # Sidebar information
     with st.sidebar:
+        if loading:
+            loading_indicator()
+        else:
+            readiness()
+
         st.subheader("About AgentCoffee")
         st.write("""
         AgentCoffee can:
@@ -346,9 +380,43 @@ def main():
         - Help you discover new coffee experiences
         """)
 
+        # Shared model registry status
+        stats = registry.stats()
+        for backend in BACKENDS.values():
+            for model in backend.registry.stats()["models"]:
+                st.caption(f"Model {model['model_id']} ({backend.name}) loaded in {model['load_seconds']}s")
+        for r in benchmark_report():
+            if r.get("decode_tokens_per_second"):
+                st.caption(f"{r['backend']}: {r['decode_tokens_per_second']} tok/s decode")
+        if stats["active_memory_bytes"] is not None:
+            st.caption(f"Model memory: {stats['active_memory_bytes'] / 2**30:.2f} GiB "
+                       f"(peak {stats['peak_memory_bytes'] / 2**30:.2f} GiB)")
+        for cache in cache_stats():
+            st.caption(f"{cache['namespace']} cache: {cache['hits']} hits, {cache['misses']} misses, "
+                       f"{cache['coalesced']} coalesced")
+
+        st.checkbox("Use answer cache", value=True, key="use_answer_cache",
+                    help="Reuse answers to questions asked before while their Maps data is fresh")
+        stats = answers.stats()
+        st.caption(f"Answer cache: {stats['hits']} hits, {stats['misses']} misses "
+                   f"({stats['hit_rate']:.0%}), {stats['seconds_saved']:.1f}s saved")
+        st.checkbox("Answer simple questions directly", value=True, key="use_router",
+                    help="Skip the model for plain 'coffee near <city>' and taste-only questions")
+        stats = router.stats()
+        if stats["routed"] + stats["fallback"]:
+            routed_ms = f"{stats['routed_mean_seconds'] * 1000:.0f} ms" if stats["routed"] else "-"
+            fallback_ms = f"{stats['fallback_mean_seconds'] * 1000:.0f} ms" if stats["fallback"] else "-"
+            st.caption(f"Router: {stats['routed']} answered directly ({routed_ms} avg), "
+                       f"{stats['fallback']} by the agent ({fallback_ms} avg)")
+
+        # Where the last query's time went
+        trace = st.session_state.get("last_trace")
+        if trace and st.checkbox("Show timings", key="show_timings"):
+            st.caption(f"Last query: {trace['duration'] * 1000:.0f} ms")
+            for s in trace["spans"]:
+                tokens = ", ".join(f"{v} {k.replace('_tokens', '')}" for k, v in s["attrs"].items()
+                                   if k.endswith("_tokens"))
+                st.caption(f"{s['name']}: {s['duration'] * 1000:.0f} ms" + (f" ({tokens})" if tokens else ""))
+
 if __name__ == "__main__":
     main()
-
-
-#TODO: Depending on the order of the questions asked the both tools may not run.
-
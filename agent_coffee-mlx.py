@@ -1,52 +1,24 @@
-from mlx_lm import load, generate
-import re
+import argparse
 import os
-import requests
-
-google_maps_key = os.getenv("GOOGLE_MAPS_API_KEY")
-
-class Agent:
-    def __init__(self, system=""):
-        self.model, self.tokenizer = load("mlx-community/Mistral-Nemo-Instruct-2407-4bit")
-        self.system = system
-        self.messages = []
-        if self.system:
-            self.messages.append({"role": "system", "content": system})
-            
-    def __call__(self, message):
-        self.messages.append({"role": "user", "content": message})
-        result = self.execute()
-        self.messages.append({"role": "assistant", "content": result}) 
-        return result
-
-    
-    def execute(self):
-        if self.system:
-            prompt = f"System: {self.system}\n\n"
-        else:
-            prompt = ""
-        for msg in self.messages:
-            if msg["role"] == "user":
-                prompt += f"User: {msg['content']}\n"
-            elif msg["role"] == "assistant":
-                prompt += f"Assistant: {msg['content']}\n"
-
-        prompt += "Assistant: " 
-        
-        response = generate(
-            self.model,
-            self.tokenizer,
-            prompt=prompt,
-            verbose=False  
-        )
-        
-        return response.strip()
-    
+import sys
+import backends
+from mlx_agent import Agent
+from tracing import maybe_start_metrics_server
+from batch_runner import run_batch_mlx, run_batch_threads, read_questions, open_questions, write_jsonl
+from react_loop import LazyBot, print_query
+from budget import QueryBudget, DEADLINE, MAX_TOOL_CALLS
+from answer_cache import answers
+from router import router
+from taste_engine import coffee_taste
+from maps_client import iter_nearby_coffee_shops, MAX_SHOPS
+from observation_format import default_formatter
+
 prompt = """
 You run in a loop of Thought, Action, PAUSE, Observation.
 At the end of the loop you output an Answer
 Use Thought to describe your thoughts about the question you have been asked.
 Use Action to run one of the actions available to you - then return PAUSE.
+If the question needs more than one action, write one Action line for each before PAUSE.
 Observation will be the result of running those actions.
 
 Your available actions are:
@@ -77,103 +49,38 @@ Answer: A list of coffee shops in Boston, MA
 """.strip()
 
 
-def coffee_taste(taste_preferences):
-    # List of possible taste preference keywords
-    taste_keywords = [
-        'strong', 'bold', 'intense', 'mild', 'creamy', 'smooth',
-        'frothy', 'balanced', 'rich', 'diluted', 'chocolatey',
-        'less acidic', 'full-bodied', 'robust', 'clean', 'bright',
-        'aromatic', 'thick'
-    ]
-    # Normalize the sentence to lower case and split into words
-    words = taste_preferences.lower().split()
-    # Extract keywords present in the sentence
-    taste_preferences = [word for word in words if word in taste_keywords]
-    
-    coffee_profiles = [
-        {'name': 'Espresso', 'notes': ['strong', 'bold', 'intense']},
-        {'name': 'Latte', 'notes': ['mild', 'creamy', 'smooth']},
-        {'name': 'Cappuccino', 'notes': ['frothy', 'balanced', 'rich']},
-        {'name': 'Americano', 'notes': ['smooth', 'diluted', 'bold']},
-        {'name': 'Cold Brew', 'notes': ['smooth', 'chocolatey', 'less acidic']},
-        {'name': 'French Press', 'notes': ['rich', 'full-bodied', 'robust']},
-        {'name': 'Pour Over', 'notes': ['clean', 'bright', 'aromatic']},
-        {'name': 'Turkish Coffee', 'notes': ['strong', 'thick', 'intense']},
-    ]
-    recommendations = []
-    for coffee in coffee_profiles:
-        if any(pref.lower() in coffee['notes'] for pref in taste_preferences):
-            recommendations.append(coffee['name'])
-    return recommendations
-
-def find_nearby_coffee_shops(city, radius=1000):
-    geocode_url = 'https://maps.googleapis.com/maps/api/geocode/json'
-    geocode_params = {
-        'address': city,
-        'key': google_maps_key
-    }
-    geocode_response = requests.get(geocode_url, params=geocode_params)
-    geocode_data = geocode_response.json()
-    
-    if not geocode_data['results']:
-        print(f"Could not geocode city: {city}")
-        return []
-    
-    location = geocode_data['results'][0]['geometry']['location']
-    latitude = location['lat']
-    longitude = location['lng']
-
-
-    url = 'https://maps.googleapis.com/maps/api/place/nearbysearch/json'
-    params = {
-        'key': google_maps_key,
-        'location': f'{latitude},{longitude}',
-        'radius': radius,
-        'keyword': 'coffee shop',
-        'type': 'cafe'
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
-    coffee_shops = []
-    for place in data.get('results', []):
-        name = place.get('name')
-        address = place.get('vicinity')
-        location = place['geometry']['location']
-        shop_lat = location['lat']
-        shop_lng = location['lng']
-        coffee_shops.append({
-            'name': name,
-            'address': address,
-            'latitude': shop_lat,
-            'longitude': shop_lng
-        })
-    
-    return coffee_shops
-
-def query(question, max_turns=10):
-    action_re = re.compile(r'^Action: (\w+): (.*)$')
-    i = 0
-    bot = Agent(prompt)
-    next_prompt = question
-    while i < max_turns:
-        i += 1
-        result = bot(next_prompt)
-        print(result)
-        actions = [
-            action_re.match(a) 
-            for a in result.split('\n') 
-            if action_re.match(a)
-        ]
-        if actions:
-            action, action_input = actions[0].groups()
-            if action not in known_actions:
-                raise Exception("Unknown action: {}: {}".format(action, action_input))
-            print(" -- running {} {}".format(action, action_input))
-            observation = known_actions[action](action_input)
-            print("Observation:", observation)
-            next_prompt = "Observation: {}".format(observation)
+# No more shops than the observation or a routed answer shows
+SHOWN_SHOPS = min(MAX_SHOPS, max(default_formatter.top_k, router.max_shops))
+
+
+def find_nearby_coffee_shops(city, radius=1000, max_results=SHOWN_SHOPS):
+    return list(iter_nearby_coffee_shops(city, radius, max_results, coordinates=True))
+
+def print_backend(report):
+    print(f"Using the {backends.select_backend()} backend")
+    for r in report:
+        if "error" in r:
+            print(f"  {r['backend']}: {r['error']}")
         else:
-            return
+            print(f"  {r['backend']}: {r['decode_tokens_per_second']} tok/s decode, "
+                  f"{r['prefill_tokens_per_second']} tok/s prefill ({r['model_id']})")
+
+
+def make_agent():
+    # The first Agent picks the backend (benchmarking them for "auto") and loads
+    # the model, so that waits for a question the cache and router cannot answer
+    reported = bool(backends.benchmark_report())
+    bot = Agent(prompt)
+    report = backends.benchmark_report()
+    if report and not reported:
+        print_backend(report)
+    return bot
+
+
+def query(question, max_turns=10, use_cache=True, use_router=True, budget=None):
+    bot = LazyBot(make_agent)
+    print_query(bot, question, known_actions, max_turns, answers=answers if use_cache else None,
+                router=router if use_router else None, budget=budget or QueryBudget())
 
 
 known_actions = {
@@ -183,7 +90,38 @@ known_actions = {
 
 
 if __name__ == "__main__":
-    
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", metavar="FILE",
+                        help="answer questions from FILE ('-' for stdin), one per line or as JSONL, and write JSONL answers to stdout")
+    parser.add_argument("--batch-size", type=int, default=8, help="conversations decoded together in batch mode")
+    parser.add_argument("--backend", choices=sorted(backends.BACKENDS) + ["auto"],
+                        help="inference backend (default: AGENT_COFFEE_BACKEND or auto)")
+    parser.add_argument("--threads", type=int, help="llama.cpp CPU threads")
+    parser.add_argument("--n-batch", type=int, help="llama.cpp prompt batch size")
+    parser.add_argument("--no-cache", action="store_true", help="always run the agent instead of reusing cached answers")
+    parser.add_argument("--no-router", action="store_true", help="send simple questions through the agent loop too")
+    parser.add_argument("--deadline", type=float, default=DEADLINE,
+                        help="seconds a question may take before the best answer so far is returned")
+    parser.add_argument("--max-tool-calls", type=int, default=MAX_TOOL_CALLS, help="tool calls allowed per question")
+    args = parser.parse_args()
+    maybe_start_metrics_server()
+    if args.backend:
+        os.environ["AGENT_COFFEE_BACKEND"] = args.backend
+    if args.threads:
+        backends.llama_options["n_threads"] = args.threads
+    if args.n_batch:
+        backends.llama_options["n_batch"] = args.n_batch
+
+    if args.batch:
+        questions = read_questions(open_questions(args.batch))
+        if os.getenv("AGENT_COFFEE_BACKEND", "auto") in ("auto", "mlx") and backends.MLXBackend.available():
+            run_batch_mlx(questions, prompt, known_actions, write_jsonl(sys.stdout), batch_size=args.batch_size)
+        else:
+            # Continuous batching needs mlx_lm; other backends answer one question at a time
+            run_batch_threads(questions, lambda: Agent(prompt), known_actions, write_jsonl(sys.stdout),
+                              concurrency=1)
+        sys.exit()
+
     continue_asking = True
     while continue_asking:
         question = input("Enter your question: ")
@@ -191,10 +129,5 @@ if __name__ == "__main__":
             print("Goodbye!")
             continue_asking = False
         else:
-            query(question)
-
-
-
-
-
-
+            query(question, use_cache=not args.no_cache, use_router=not args.no_router,
+                  budget=QueryBudget(args.deadline, max_tool_calls=args.max_tool_calls))
@@ -1,43 +1,380 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import time
+import weakref
 import openai
-import re
 import httpx
-import os
-import requests
+from taste_engine import coffee_taste
+from maps_client import iter_nearby_coffee_shops, afind_nearby_coffee_shops, MAX_SHOPS
+from observation_format import default_formatter
 from dotenv import load_dotenv
 _ = load_dotenv()
 
 from openai import OpenAI
+from openai.types.chat import ChatCompletionChunk
+import budget as query_budget
+from budget import QueryBudget, DEADLINE, MAX_TOOL_CALLS
+from react_loop import LazyBot, print_query, parse_actions
+from answer_cache import answers
+from router import router
+from batch_runner import run_batch_async, run_batch_threads, read_questions, open_questions, write_jsonl
+from stopping import DEFAULT_STOP, TokenBudget, turn_report
+from memory import ConversationMemory
+from tracing import record, maybe_start_metrics_server
+
+# One pooled client per process (and one per event loop for asyncio callers), so
+# turns and questions reuse connections. The SDK retries connection errors, 429
+# and 5xx responses with backoff.
+OPENAI_MODEL = os.getenv("AGENT_COFFEE_OPENAI_MODEL", "gpt-4o")
+OPENAI_TIMEOUT = float(os.getenv("AGENT_COFFEE_OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("AGENT_COFFEE_OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_RETRIES = int(os.getenv("AGENT_COFFEE_OPENAI_RETRIES", "2"))
+OPENAI_POOL_SIZE = 20
+
+
+def client_options():
+    limits = httpx.Limits(max_connections=OPENAI_POOL_SIZE, max_keepalive_connections=OPENAI_POOL_SIZE)
+    return {
+        "timeout": openai.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        "max_retries": OPENAI_RETRIES,
+        "limits": limits,
+    }
+
 
-client = OpenAI()
+def make_client():
+    options = client_options()
+    return OpenAI(http_client=openai.DefaultHttpxClient(limits=options.pop("limits")), **options)
+
+
+client = make_client()
+
+# AsyncOpenAI's connection pool is bound to the event loop it was first used on
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def async_client():
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        options = client_options()
+        _async_clients[loop] = openai.AsyncOpenAI(
+            http_client=openai.DefaultAsyncHttpxClient(limits=options.pop("limits")), **options)
+    return _async_clients[loop]
+
+
+def parse_tool_call(call_id, name, arguments):
+    # Tools take one string, like the text protocol's "Action: name: input"
+    try:
+        parsed = json.loads(arguments or "{}")
+    except json.JSONDecodeError:
+        parsed = arguments
+    if isinstance(parsed, dict):
+        action_input = parsed.get("input", next(iter(parsed.values()), ""))
+    else:
+        action_input = parsed
+    return {"id": call_id, "name": name, "input": str(action_input), "arguments": arguments}
+
+
+# Request parameters that carry the tools; a 400 naming one (e.g. "tools" or
+# "tools[0].function") means the model or server refused the tools
+TOOL_PARAMS = ("tools", "tool_choice", "parallel_tool_calls")
+
+
+def tools_rejected(error):
+    # Whether a 400 was about the tools, not e.g. the context length or another parameter
+    param = (getattr(error, "param", None) or "").split(".")[0].split("[")[0]
+    return param in TOOL_PARAMS
+
+
+def usage_counts(usage):
+    # (prompt, completion, cached) tokens; cached prompt tokens are billed and prefilled at a discount
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    return usage.prompt_tokens, usage.completion_tokens, cached
+
+
+def stream_chunks(response):
+    # Chunks of a streamed completion, read to the end of the body. The sync SDK
+    # stream stops reading at [DONE] and leaves the end of the body unread, so
+    # httpx closes the connection instead of pooling it (the async one drains it)
+    for line in response.iter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            continue
+        chunk = json.loads(data)
+        if chunk.get("error"):
+            error = chunk["error"]
+            message = error.get("message") if isinstance(error, dict) else None
+            raise openai.APIError(message or "An error occurred during streaming", response.http_request, body=error)
+        yield ChatCompletionChunk.model_validate(chunk)
+
+
+class StreamedTurn:
+    # Collects one streamed completion: content, tool call fragments, finish reason and usage
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.ttft = None
+        self.chunks = []
+        self.calls = {}  # index -> [id, name, argument fragments]
+        self.finish_reason = None
+        self.usage = None
+
+    def feed(self, event):
+        # Returns the content delta of event, if any
+        if event.usage:
+            self.usage = event.usage
+        if not event.choices:
+            return None
+        choice = event.choices[0]
+        if choice.finish_reason:
+            self.finish_reason = choice.finish_reason
+        for delta in choice.delta.tool_calls or []:
+            # A call arrives as its id and name, then its arguments in fragments
+            self.first_token()
+            call = self.calls.setdefault(delta.index, [None, "", []])
+            if delta.id:
+                call[0] = delta.id
+            if delta.function and delta.function.name:
+                call[1] += delta.function.name
+            if delta.function and delta.function.arguments:
+                call[2].append(delta.function.arguments)
+        if choice.delta.content:
+            self.first_token()
+            self.chunks.append(choice.delta.content)
+            return choice.delta.content
+        return None
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.start
+
+    def tool_calls(self):
+        return [parse_tool_call(call_id, name, "".join(arguments))
+                for _, (call_id, name, arguments) in sorted(self.calls.items())]
 
-google_maps_key = os.getenv("GOOGLE_MAPS_API_KEY")
 
 class Agent:
-    def __init__(self, system=""):
+    def __init__(self, system="", max_tokens=256, max_query_tokens=None, stop=DEFAULT_STOP, memory=None,
+                 tools=None, text_system=None):
+        # tools are function schemas for native tool calling (see tool_schemas); if the
+        # API rejects them the Agent switches to text_system and the Action-line protocol
         self.system = system
+        self.memory = memory if memory is not None else ConversationMemory()
+        self.stop = stop
+        self.tools = tools
+        self.text_system = text_system
+        self.tool_calls = []
+        self.budget = TokenBudget(max_tokens, max_query_tokens)
+        self.turn_stats = []
+        # Token counts summed over the Agent's turns, i.e. over one query
+        self.usage = {"turns": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
         self.messages = []
         if self.system:
             self.messages.append({"role": "system", "content": system})
             
     def __call__(self, message):
-        self.messages.append({"role": "user", "content": message})
+        if message is not None:
+            self.messages.append({"role": "user", "content": message})
         result = self.execute()
-        self.messages.append({"role": "assistant", "content": result}) 
+        self.messages.append(self.assistant_message(result))
         return result
 
+    def stream(self, message):
+        # Yields content deltas as they arrive; the finished turn is added to messages.
+        # message is None after add_tool_results, whose messages carry the Observation
+        if message is not None:
+            self.messages.append({"role": "user", "content": message})
+        chunks = []
+        for chunk in self.stream_execute():
+            chunks.append(chunk)
+            yield chunk
+        self.messages.append(self.assistant_message("".join(chunks)))
+
+    async def astream(self, message):
+        # asyncio variant of stream on the per-loop AsyncOpenAI client
+        if message is not None:
+            self.messages.append({"role": "user", "content": message})
+        chunks = []
+        async for chunk in self.astream_execute():
+            chunks.append(chunk)
+            yield chunk
+        self.messages.append(self.assistant_message("".join(chunks)))
+
+    def assistant_message(self, content):
+        message = {"role": "assistant", "content": content}
+        if self.tool_calls:
+            message["tool_calls"] = [
+                {"id": call["id"], "type": "function",
+                 "function": {"name": call["name"], "arguments": call["arguments"]}}
+                for call in self.tool_calls
+            ]
+        return message
+
+    def add_tool_results(self, results):
+        # One tool message per call of the last turn, in the same order
+        for call, result in zip(self.tool_calls, results):
+            self.messages.append({"role": "tool", "tool_call_id": call["id"], "content": result})
+
+    def build_messages(self):
+        # The system prompt is always the first message and never changes, and the
+        # tools (which the API places before it) are in a fixed order, so every
+        # request shares that prefix and the API's prompt cache can serve it. The
+        # question is pinned next; only the turns after it vary
+        return self.memory.view(self.messages)
+
+    def request_options(self, limit, **kwargs):
+        self.tool_calls = []
+        options = dict(model=OPENAI_MODEL, temperature=0, stop=self.stop, max_tokens=limit,
+                       messages=self.build_messages(), timeout=self.request_timeout(),
+                       prompt_cache_key=self.prompt_cache_key(), **kwargs)
+        if self.tools:
+            options["tools"] = self.tools
+        return options
+
+    def prompt_cache_key(self):
+        # Requests with the same key are routed to the same prompt cache
+        prefix = json.dumps([self.system, self.tools], sort_keys=True)
+        return "agent_coffee-" + hashlib.sha256(prefix.encode()).hexdigest()[:16]
+
+    def request(self, create, limit, **kwargs):
+        # The chat completion call shared by execute and stream_execute; falls back
+        # to the text protocol once if the model or server does not take tools
+        try:
+            return create(**self.request_options(limit, **kwargs))
+        except openai.BadRequestError as e:
+            if not self.can_fall_back(e):
+                raise
+            self.use_text_protocol(e)
+        return create(**self.request_options(limit, **kwargs))
+
+    async def arequest(self, limit, **kwargs):
+        try:
+            return await async_client().chat.completions.create(**self.request_options(limit, **kwargs))
+        except openai.BadRequestError as e:
+            if not self.can_fall_back(e):
+                raise
+            self.use_text_protocol(e)
+        return await async_client().chat.completions.create(**self.request_options(limit, **kwargs))
+
+    def can_fall_back(self, e):
+        # Only a 400 about the tools themselves, and only before a tool round:
+        # after one, the history holds tool_calls and tool messages that need tools
+        return (bool(self.tools) and tools_rejected(e)
+                and not any(m["role"] == "tool" or m.get("tool_calls") for m in self.messages))
+
+    def use_text_protocol(self, error):
+        print(f"Tool calling unavailable, using the text protocol: {error}", file=sys.stderr)
+        self.tools = None
+        if self.text_system:
+            self.system = self.text_system
+            if self.messages and self.messages[0]["role"] == "system":
+                self.messages[0] = {"role": "system", "content": self.text_system}
+
     
     def execute(self):
-        completion = client.chat.completions.create(
-                        model="gpt-4o",
-                        temperature=0,
-                        messages=self.messages)
-        return completion.choices[0].message.content
+        limit = self.budget.turn_limit()
+        if limit == 0:
+            return ""
+        start = time.perf_counter()
+        completion = self.request(client.chat.completions.create, limit)
+        message = completion.choices[0].message
+        content = message.content or ""
+        self.tool_calls = [parse_tool_call(call.id, call.function.name, call.function.arguments)
+                           for call in message.tool_calls or []]
+        counts = usage_counts(completion.usage)
+        total = time.perf_counter() - start
+        record("llm.turn", total, prompt_tokens=counts[0], generated_tokens=counts[1], cached_tokens=counts[2])
+        self.record_turn(limit, counts, completion.choices[0].finish_reason, content, None, total)
+        return content
+
+    def stream_execute(self):
+        limit = self.budget.turn_limit()
+        if limit == 0:
+            return
+        turn = StreamedTurn()
+        with contextlib.ExitStack() as responses:
+            def open_stream(**options):
+                return responses.enter_context(client.chat.completions.with_streaming_response.create(**options))
+
+            response = self.request(open_stream, limit, stream=True, stream_options={"include_usage": True})
+            for event in stream_chunks(response):
+                stopped = query_budget.exceeded()
+                if stopped is not None:
+                    # Leaving the block closes the response, which stops the server generating for us
+                    turn.finish_reason = stopped
+                    break
+                text = turn.feed(event)
+                if text:
+                    yield text
+        self.finish_turn(limit, turn)
+
+    async def astream_execute(self):
+        limit = self.budget.turn_limit()
+        if limit == 0:
+            return
+        turn = StreamedTurn()
+        stream = await self.arequest(limit, stream=True, stream_options={"include_usage": True})
+        async for event in stream:
+            stopped = query_budget.exceeded()
+            if stopped is not None:
+                await stream.close()
+                turn.finish_reason = stopped
+                break
+            text = turn.feed(event)
+            if text:
+                yield text
+        self.finish_turn(limit, turn)
+
+    def finish_turn(self, limit, turn):
+        total = time.perf_counter() - turn.start
+        content = "".join(turn.chunks)
+        # A turn cut off by the query budget never gets its usage; one delta is about one token
+        counts = usage_counts(turn.usage) if turn.usage is not None else (0, len(turn.chunks), 0)
+        if turn.ttft is not None:
+            # Time to first token stands in for prefill; the API does not report it separately
+            record("llm.prefill", turn.ttft, prompt_tokens=counts[0], cached_tokens=counts[2])
+            record("llm.decode", total - turn.ttft, generated_tokens=counts[1])
+        if turn.finish_reason not in ("cancelled", "deadline"):
+            self.tool_calls = turn.tool_calls()
+        self.record_turn(limit, counts, turn.finish_reason, content, turn.ttft, total)
+
+    def request_timeout(self):
+        # A query with a deadline gives up on the API call when it passes
+        left = query_budget.remaining()
+        return max(left, 0.01) if left is not None else openai.NOT_GIVEN
+
+    def record_turn(self, limit, counts, finish_reason, content, ttft, total):
+        # The API reports "stop" for both a stop sequence and a natural end; a turn
+        # that ends on an Action line can only have been cut at PAUSE/Observation
+        if finish_reason in ("length", "tool_calls", "cancelled", "deadline"):
+            stop_reason = finish_reason
+        elif parse_actions(content):
+            stop_reason = "stop_sequence"
+        else:
+            stop_reason = "eos"
+        prompt_tokens, completion_tokens, cached_tokens = counts
+        self.budget.spend(completion_tokens)
+        query_budget.spend_tokens(completion_tokens)
+        stats = turn_report(limit, completion_tokens, stop_reason)
+        stats.update({"prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens, "ttft": ttft, "total": total})
+        self.turn_stats.append(stats)
+        self.usage["turns"] += 1
+        self.usage["prompt_tokens"] += prompt_tokens
+        self.usage["completion_tokens"] += completion_tokens
+        self.usage["cached_tokens"] += cached_tokens
     
 prompt = """
 You run in a loop of Thought, Action, PAUSE, Observation.
 At the end of the loop you output an Answer
 Use Thought to describe your thoughts about the question you have been asked.
 Use Action to run one of the actions available to you - then return PAUSE.
+If the question needs more than one action, write one Action line for each before PAUSE.
 Observation will be the result of running those actions.
 
 Your available actions are:
@@ -68,78 +405,50 @@ Answer: A list of coffee shops in Boston, MA
 """.strip()
 
 
-def coffee_taste(taste_preferences):
-    # List of possible taste preference keywords
-    taste_keywords = [
-        'strong', 'bold', 'intense', 'mild', 'creamy', 'smooth',
-        'frothy', 'balanced', 'rich', 'diluted', 'chocolatey',
-        'less acidic', 'full-bodied', 'robust', 'clean', 'bright',
-        'aromatic', 'thick'
-    ]
-    # Normalize the sentence to lower case and split into words
-    words = taste_preferences.lower().split()
-    # Extract keywords present in the sentence
-    taste_preferences = [word for word in words if word in taste_keywords]
-    
-    coffee_profiles = [
-        {'name': 'Espresso', 'notes': ['strong', 'bold', 'intense']},
-        {'name': 'Latte', 'notes': ['mild', 'creamy', 'smooth']},
-        {'name': 'Cappuccino', 'notes': ['frothy', 'balanced', 'rich']},
-        {'name': 'Americano', 'notes': ['smooth', 'diluted', 'bold']},
-        {'name': 'Cold Brew', 'notes': ['smooth', 'chocolatey', 'less acidic']},
-        {'name': 'French Press', 'notes': ['rich', 'full-bodied', 'robust']},
-        {'name': 'Pour Over', 'notes': ['clean', 'bright', 'aromatic']},
-        {'name': 'Turkish Coffee', 'notes': ['strong', 'thick', 'intense']},
-    ]
-    recommendations = []
-    for coffee in coffee_profiles:
-        if any(pref.lower() in coffee['notes'] for pref in taste_preferences):
-            recommendations.append(coffee['name'])
-    return recommendations
-
-def find_nearby_coffee_shops(city, radius=1000):
-    geocode_url = 'https://maps.googleapis.com/maps/api/geocode/json'
-    geocode_params = {
-        'address': city,
-        'key': google_maps_key
-    }
-    geocode_response = requests.get(geocode_url, params=geocode_params)
-    geocode_data = geocode_response.json()
-    
-    if not geocode_data['results']:
-        print(f"Could not geocode city: {city}")
-        return []
-    
-    location = geocode_data['results'][0]['geometry']['location']
-    latitude = location['lat']
-    longitude = location['lng']
-
-
-    url = 'https://maps.googleapis.com/maps/api/place/nearbysearch/json'
-    params = {
-        'key': google_maps_key,
-        'location': f'{latitude},{longitude}',
-        'radius': radius,
-        'keyword': 'coffee shop',
-        'type': 'cafe'
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
-    coffee_shops = []
-    for place in data.get('results', []):
-        name = place.get('name')
-        address = place.get('vicinity')
-        location = place['geometry']['location']
-        shop_lat = location['lat']
-        shop_lng = location['lng']
-        coffee_shops.append({
-            'name': name,
-            'address': address,
-         #   'latitude': shop_lat,
-         #   'longitude': shop_lng
+tool_prompt = """
+You answer questions about coffee: where to find it and what to drink.
+Call the tools to look things up. When a question needs more than one lookup,
+call all of the tools you need at once.
+Once you have what you need, reply with a line starting with "Answer:" followed by the answer.
+""".strip()
+
+TOOL_DESCRIPTIONS = {
+    "coffee_location": ("Find coffee shops in and near a city with the Google nearby search API",
+                        "City and state, e.g. Boston, MA"),
+    "coffee_taste": ("List coffee types that match taste preferences",
+                     "The taste preferences, e.g. strong and creamy"),
+}
+
+
+def tool_schemas(actions):
+    # Function schemas for native tool calling; each tool takes the one string
+    # the text protocol would put after "Action: name:"
+    schemas = []
+    for name in actions:
+        description, input_description = TOOL_DESCRIPTIONS.get(name, (name, "Input for " + name))
+        schemas.append({
+            "type": "function",
+            "function": {
+                "name": name,
+                "description": description,
+                "parameters": {
+                    "type": "object",
+                    "properties": {"input": {"type": "string", "description": input_description}},
+                    "required": ["input"],
+                    "additionalProperties": False,
+                },
+            },
         })
-    
-    return coffee_shops
+    return schemas
+
+
+# The compact observation and the routed answer list at most this many shops, so
+# the tool fetches no more (more than a page would also wait on page tokens)
+SHOWN_SHOPS = min(MAX_SHOPS, max(default_formatter.top_k, router.max_shops))
+
+
+def find_nearby_coffee_shops(city, radius=1000, max_results=SHOWN_SHOPS):
+    return list(iter_nearby_coffee_shops(city, radius, max_results))
 
 
     
@@ -149,38 +458,54 @@ known_actions = {
 }
 
 
-action_re = re.compile(r'^Action: (\w+): (.*)$')
-
-def query(question, max_turns=10):
-    i = 0
-    bot = Agent(prompt)
-    next_prompt = question
-    while i < max_turns:
-        i += 1
-        result = bot(next_prompt)
-        print(result)
-        actions = [
-            action_re.match(a) 
-            for a in result.split('\n') 
-            if action_re.match(a)
-        ]
-        if actions:
-            action, action_input = actions[0].groups()
-            if action not in known_actions:
-                raise Exception("Unknown action: {}: {}".format(action, action_input))
-            print(" -- running {} {}".format(action, action_input))
-            observation = known_actions[action](action_input)
-            print("Observation:", observation)
-            next_prompt = "Observation: {}".format(observation)
-        else:
-            return
-
-
-question = input("Enter your question: ")
-
-query(question)
-
+async def afind_coffee_shops(city, radius=1000, max_results=SHOWN_SHOPS):
+    return await afind_nearby_coffee_shops(city, radius, max_results=max_results)
 
 
+# Awaited by the asyncio loop instead of running on a worker thread
+async_actions = {
+    "coffee_location": afind_coffee_shops,
+}
 
 
+def make_agent(tool_calling=False):
+    if tool_calling:
+        return Agent(tool_prompt, tools=tool_schemas(known_actions), text_system=prompt)
+    return Agent(prompt)
+
+
+def query(question, max_turns=10, use_cache=True, use_router=True, budget=None, tool_calling=False):
+    bot = LazyBot(lambda: make_agent(tool_calling))
+    print_query(bot, question, known_actions, max_turns, answers=answers if use_cache else None,
+                router=router if use_router else None, budget=budget or QueryBudget())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", metavar="FILE",
+                        help="answer questions from FILE ('-' for stdin), one per line or as JSONL, and write JSONL answers to stdout")
+    parser.add_argument("--concurrency", type=int, default=8, help="conversations run side by side in batch mode")
+    parser.add_argument("--no-cache", action="store_true", help="always run the agent instead of reusing cached answers")
+    parser.add_argument("--no-router", action="store_true", help="send simple questions through the agent loop too")
+    parser.add_argument("--deadline", type=float, default=DEADLINE,
+                        help="seconds a question may take before the best answer so far is returned")
+    parser.add_argument("--max-tool-calls", type=int, default=MAX_TOOL_CALLS, help="tool calls allowed per question")
+    parser.add_argument("--tool-calling", action="store_true",
+                        help="use the API's native tool calls instead of Action lines in the text")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="run batch conversations as asyncio tasks on the async client instead of threads")
+    args = parser.parse_args()
+    maybe_start_metrics_server()
+
+    if args.batch:
+        questions = read_questions(open_questions(args.batch))
+        batch = run_batch_async if args.use_async else run_batch_threads
+        options = {"async_actions": async_actions} if args.use_async else {}
+        batch(questions, lambda: make_agent(args.tool_calling), known_actions, write_jsonl(sys.stdout),
+              concurrency=args.concurrency, **options)
+        sys.exit()
+
+    question = input("Enter your question: ")
+
+    query(question, use_cache=not args.no_cache, use_router=not args.no_router,
+          budget=QueryBudget(args.deadline, max_tool_calls=args.max_tool_calls), tool_calling=args.tool_calling)
@@ -0,0 +1,164 @@
+'''
+Whole-query answer cache in front of the agent loop.
+
+Questions are keyed after normalizing case, whitespace, punctuation, state names
+and common city nicknames, so "Coffee shops in NYC?" and "coffee shops in new
+york, NY" share an answer. Answers live in the shared SQLite TTLCache (LRU +
+TTL). Each answer remembers the tool cache entries it was built from and is
+dropped as soon as any of them expires or is refetched, so a cached answer is
+never older than the Maps data behind it.
+
+react_loop.stream_query consults the cache when it is given one; pass None to
+bypass it for a single request.
+'''
+
+import os
+import re
+import threading
+import time
+
+import ttl_cache
+from ttl_cache import TTLCache
+
+ANSWER_TTL = float(os.getenv("AGENT_COFFEE_ANSWER_TTL", str(24 * 3600)))
+
+STATES = {
+    "alabama": "al", "alaska": "ak", "arizona": "az", "arkansas": "ar", "california": "ca",
+    "colorado": "co", "connecticut": "ct", "delaware": "de", "florida": "fl", "georgia": "ga",
+    "hawaii": "hi", "idaho": "id", "illinois": "il", "indiana": "in", "iowa": "ia",
+    "kansas": "ks", "kentucky": "ky", "louisiana": "la", "maine": "me", "maryland": "md",
+    "massachusetts": "ma", "michigan": "mi", "minnesota": "mn", "mississippi": "ms",
+    "missouri": "mo", "montana": "mt", "nebraska": "ne", "nevada": "nv", "new hampshire": "nh",
+    "new jersey": "nj", "new mexico": "nm", "new york": "ny", "north carolina": "nc",
+    "north dakota": "nd", "ohio": "oh", "oklahoma": "ok", "oregon": "or", "pennsylvania": "pa",
+    "rhode island": "ri", "south carolina": "sc", "south dakota": "sd", "tennessee": "tn",
+    "texas": "tx", "utah": "ut", "vermont": "vt", "virginia": "va", "washington": "wa",
+    "west virginia": "wv", "wisconsin": "wi", "wyoming": "wy", "district of columbia": "dc",
+}
+
+# Applied after punctuation is stripped, so "Washington, D.C." arrives as "washington d c"
+CITY_ALIASES = {
+    "nyc": "new york ny",
+    "new york city": "new york ny",
+    "the big apple": "new york ny",
+    "sf": "san francisco ca",
+    "san fran": "san francisco ca",
+    "philly": "philadelphia pa",
+    "dc": "washington dc",
+    "washington d c": "washington dc",
+    "nola": "new orleans la",
+    "atx": "austin tx",
+    "chi town": "chicago il",
+    "beantown": "boston ma",
+}
+
+
+def _phrase_re(phrases):
+    # Longest phrase first, so "new york city" wins over "new york"
+    alternatives = sorted(phrases, key=len, reverse=True)
+    return re.compile(r"\b(" + "|".join(re.escape(p) for p in alternatives) + r")\b")
+
+
+# An expansion maps to itself, so a name that is already normalized is matched
+# whole and left alone ("washington dc" must not become "washington washington dc")
+_aliases = dict(CITY_ALIASES, **{name: name for name in CITY_ALIASES.values()})
+_alias_re = _phrase_re(_aliases)
+# A state name is only abbreviated in "City, State" form, so "new york" alone stays a city
+_state_re = re.compile(r",\s*" + _phrase_re(STATES).pattern)
+
+
+def normalize_question(question):
+    text = question.lower().replace("'", "")
+    text = _state_re.sub(lambda m: ", " + STATES[m.group(1)], text)
+    text = re.sub(r"[^\w\s]", " ", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    return _alias_re.sub(lambda m: _aliases[m.group(1)], text)
+
+
+class AnswerCache:
+    def __init__(self, cache=None):
+        self.cache = cache or TTLCache("answers", ttl=ANSWER_TTL, max_entries=1000)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.seconds_saved = 0.0
+        self._sources = {}
+
+    def lookup(self, question):
+        # Returns the cached entry for question, or None; an entry whose tool
+        # data has expired or been refetched is dropped
+        start = time.perf_counter()
+        key = normalize_question(question)
+        entry = self.cache.get(key)
+        if entry is not None and not self._fresh(entry):
+            self.cache.delete(key)
+            entry = None
+            with self.lock:
+                self.invalidated += 1
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.seconds_saved += max(entry["seconds"] - (time.perf_counter() - start), 0.0)
+        return entry
+
+    def has(self, question):
+        # Whether question has an unexpired answer, without counting a lookup;
+        # unlike lookup() it does not check the tool data the answer used
+        expires_at = self.cache.expires_at(normalize_question(question))
+        return expires_at is not None and expires_at > time.time()
+
+    def _fresh(self, entry):
+        now = time.time()
+        for namespace, key, expires_at in entry["depends_on"]:
+            if namespace not in self._sources:
+                self._sources[namespace] = TTLCache(namespace, ttl=0, path=self.cache.path)
+            current = self._sources[namespace].expires_at(key)
+            if current is None or current != expires_at or current <= now:
+                return False
+        return True
+
+    def track(self):
+        # Starts collecting the tool cache entries read by this context (and by
+        # tool threads that copy it); pass the returned list to store()
+        reads = []
+        ttl_cache.reads.set(reads)
+        return reads
+
+    def untrack(self):
+        ttl_cache.reads.set(None)
+
+    def store(self, question, answer, seconds, reads):
+        # Tool data that could not be cached (e.g. a quota error) makes the answer uncacheable
+        if any(expires_at is None for _, _, expires_at in reads):
+            return False
+        depends_on = sorted(set(reads))
+        ttl = self.cache.ttl
+        if depends_on:
+            ttl = min(ttl, min(expires_at for _, _, expires_at in depends_on) - time.time())
+        if ttl <= 0:
+            return False
+        entry = {"question": question, "answer": answer, "seconds": seconds,
+                 "depends_on": [list(d) for d in depends_on]}
+        self.cache.set(normalize_question(question), entry, ttl=ttl)
+        return True
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "namespace": self.cache.namespace,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated,
+                "hit_rate": self.hits / total if total else 0.0,
+                "seconds_saved": round(self.seconds_saved, 3),
+            }
+
+
+answers = AnswerCache()
@@ -0,0 +1,316 @@
+'''
+Local inference backends for mlx_agent.Agent.
+
+A backend owns a loaded model (borrowed from a ModelRegistry) and turns prompt
+tokens into a stream of (text, finish_reason) pairs, one per decoded token:
+finish_reason is None while decoding, "stop" for the end-of-sequence token and
+"length" when max_tokens is reached. After a turn, .generated and .prefilled
+hold the number of tokens decoded and prefilled.
+
+    mlx        mlx_lm on Apple silicon, with the PromptCache KV reuse
+    llama_cpp  GGUF models through llama-cpp-python, on CPU; thread count,
+               batch size and context length come from AGENT_COFFEE_LLAMA_*
+
+AGENT_COFFEE_BACKEND picks one by name. "auto" (the default) times a short
+generation on every backend that is installed and keeps the fastest one for
+the rest of the process; benchmark_report() returns what was measured.
+'''
+
+import codecs
+import importlib.util
+import os
+import threading
+import time
+from contextlib import closing
+
+from model_registry import DEFAULT_MODEL, ModelRegistry, registry
+from prompt_cache import PromptCache, snapshot_path, system_snapshot, write_atomic
+
+DEFAULT_GGUF = os.getenv(
+    "AGENT_COFFEE_GGUF",
+    "bartowski/Mistral-Nemo-Instruct-2407-GGUF:Mistral-Nemo-Instruct-2407-Q4_K_M.gguf")
+
+# None leaves the choice to llama.cpp (threads: physical cores, batch: 512)
+llama_options = {
+    "n_threads": int(os.getenv("AGENT_COFFEE_LLAMA_THREADS", "0")) or None,
+    "n_batch": int(os.getenv("AGENT_COFFEE_LLAMA_BATCH", "0")) or None,
+    "n_ctx": int(os.getenv("AGENT_COFFEE_LLAMA_CTX", "8192")),
+}
+
+BENCH_PROMPT = "Question: Where can I find a coffee shop in Boston, MA?\nThought:"
+BENCH_TOKENS = 32
+
+
+def common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class MLXBackend:
+    name = "mlx"
+    default_model = DEFAULT_MODEL
+    registry = registry
+
+    def __init__(self, model_id=None, warmup=False, prompt_cache=True):
+        self.model_id = model_id or self.default_model
+        self.handle = self.registry.get(self.model_id, warmup=warmup)
+        self.prompt_cache = PromptCache(self.handle.model) if prompt_cache else None
+        self.generated = 0
+        self.prefilled = 0
+
+    @staticmethod
+    def available():
+        return importlib.util.find_spec("mlx_lm") is not None
+
+    def encode(self, text):
+        return self.handle.tokenizer.encode(text)
+
+    def seed(self, text):
+        # Starts the prompt cache from a copy of the snapshot of text (the system
+        # prompt), loaded from disk once per process
+        if self.prompt_cache is None:
+            return None
+        start = time.perf_counter()
+        tokens = self.encode(text)
+        # Only prefilling a new snapshot needs the model; a copy does not wait for a turn
+        cache, source = system_snapshot(self.handle.model, self.model_id, self.handle.tokenizer, tokens,
+                                        lock=self.handle.lock)
+        self.prompt_cache.seed(cache, tokens)
+        return {"source": source, "tokens": len(tokens), "seconds": time.perf_counter() - start}
+
+    def generate(self, prompt_tokens, max_tokens):
+        from mlx_lm import stream_generate
+
+        with self.handle.lock:
+            if self.prompt_cache is not None:
+                # Only the text appended since the previous turn is prefilled
+                new_tokens = self.prompt_cache.prepare(prompt_tokens)
+                kwargs = {"prompt_cache": self.prompt_cache.cache}
+            else:
+                new_tokens = prompt_tokens
+                kwargs = {}
+            self.prefilled = len(new_tokens)
+            generated = []
+            try:
+                for response in stream_generate(self.handle.model, self.handle.tokenizer,
+                                                prompt=new_tokens, max_tokens=max_tokens, **kwargs):
+                    # The closing response repeats the last token unless it is the EOS token
+                    if response.finish_reason is None or response.finish_reason == "stop":
+                        generated.append(response.token)
+                    self.generated = len(generated)
+                    yield response.text, response.finish_reason
+            finally:
+                if self.prompt_cache is not None:
+                    self.prompt_cache.commit(prompt_tokens, generated)
+
+
+def load_llama(model_id):
+    from llama_cpp import Llama
+
+    options = {k: v for k, v in llama_options.items() if v is not None}
+    if "n_threads" in options:
+        options["n_threads_batch"] = options["n_threads"]
+    if os.path.exists(model_id):
+        llm = Llama(model_path=model_id, verbose=False, **options)
+    else:
+        # "repo_id:filename" on the Hugging Face hub
+        repo_id, _, filename = model_id.partition(":")
+        llm = Llama.from_pretrained(repo_id, filename=filename or "*Q4_K_M.gguf", verbose=False, **options)
+    return llm, None
+
+
+def warmup_llama(llm, tokenizer):
+    llm.create_completion("Hello", max_tokens=1)
+
+
+def save_llama_state(f, state):
+    # Plain arrays in an .npz, so loading a snapshot never runs code the way
+    # unpickling one would; bytes fields are stored as uint8 arrays
+    import numpy as np
+
+    arrays = {}
+    for name, value in vars(state).items():
+        if isinstance(value, bytes):
+            arrays["bytes_" + name] = np.frombuffer(value, dtype=np.uint8)
+        elif value is not None:
+            arrays[name] = np.asarray(value)
+    np.savez(f, **arrays)
+
+
+def load_llama_state(path):
+    import numpy as np
+    from llama_cpp import LlamaState
+
+    fields = {}
+    with np.load(path, allow_pickle=False) as data:
+        for name in data.files:
+            value = data[name]
+            if name.startswith("bytes_"):
+                fields[name[len("bytes_"):]] = value.tobytes()
+            else:
+                fields[name] = value.item() if value.ndim == 0 else value
+    return LlamaState(**fields)
+
+
+class LlamaCppBackend:
+    name = "llama_cpp"
+    default_model = DEFAULT_GGUF
+    registry = ModelRegistry(loader=load_llama, warmer=warmup_llama, memory=None)
+    # Snapshot path -> LlamaState, so each snapshot is read from disk once per process
+    states = {}
+    states_lock = threading.Lock()
+
+    def __init__(self, model_id=None, warmup=False, prompt_cache=True):
+        self.model_id = model_id or self.default_model
+        self.handle = self.registry.get(self.model_id, warmup=warmup)
+        self.llm = self.handle.model
+        # llama.cpp keeps one KV cache per loaded model and reuses the longest
+        # matching prefix on its own; turning the cache off resets it every turn
+        self.prompt_cache = prompt_cache
+        self.generated = 0
+        self.prefilled = 0
+
+    @staticmethod
+    def available():
+        return importlib.util.find_spec("llama_cpp") is not None
+
+    def encode(self, text):
+        return self.llm.tokenize(text.encode(), add_bos=True)
+
+    def seed(self, text):
+        # The loaded model has a single KV cache; a fresh one is filled from the
+        # snapshot of text (in memory, else on disk), one that already starts
+        # with text is left alone
+        if not self.prompt_cache:
+            return None
+        start = time.perf_counter()
+        llm = self.llm
+        tokens = self.encode(text)
+        with self.handle.lock:
+            if common_prefix(llm.input_ids[:llm.n_tokens].tolist(), tokens) == len(tokens):
+                source = "memory"
+            else:
+                path = snapshot_path(self.name, self.model_id, f"{llm.n_vocab()}", tokens, ".llama-state.npz")
+                with self.states_lock:
+                    state = self.states.get(path)
+                if state is not None:
+                    source = "memory"
+                else:
+                    try:
+                        state = load_llama_state(path)
+                        source = "disk"
+                    except (OSError, ValueError, TypeError, KeyError):
+                        # Missing, partial or from another llama-cpp-python version
+                        llm.reset()
+                        llm.eval(tokens)
+                        state = llm.save_state()
+
+                        def write(tmp):
+                            with open(tmp, "wb") as f:
+                                save_llama_state(f, state)
+                        write_atomic(path, write)
+                        source = "computed"
+                    with self.states_lock:
+                        self.states[path] = state
+                if source != "computed":
+                    llm.load_state(state)
+        return {"source": source, "tokens": len(tokens), "seconds": time.perf_counter() - start}
+
+    def generate(self, prompt_tokens, max_tokens):
+        llm = self.llm
+        with self.handle.lock:
+            if not self.prompt_cache:
+                llm.reset()
+            cached = common_prefix(llm.input_ids[:llm.n_tokens].tolist(), prompt_tokens)
+            self.prefilled = len(prompt_tokens) - min(cached, len(prompt_tokens) - 1)
+            self.generated = 0
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            eos = llm.token_eos()
+            previous = list(prompt_tokens)
+            for token in llm.generate(prompt_tokens, temp=0.0, reset=True):
+                self.generated += 1
+                if token == eos:
+                    yield decoder.decode(b"", final=True), "stop"
+                    return
+                text = decoder.decode(llm.detokenize([token], prev_tokens=previous))
+                previous.append(token)
+                if self.generated >= max_tokens:
+                    yield text + decoder.decode(b"", final=True), "length"
+                    return
+                yield text, None
+
+
+BACKENDS = {backend.name: backend for backend in (MLXBackend, LlamaCppBackend)}
+
+_selected = None
+_report = []
+_select_lock = threading.Lock()
+
+
+def measure(backend_class, model_id=None, tokens=BENCH_TOKENS):
+    # Times prefill and decode of one short greedy generation; loading and
+    # warmup happen first and are reported separately
+    backend = backend_class(model_id, warmup=True, prompt_cache=False)
+    prompt_tokens = backend.encode(BENCH_PROMPT)
+    start = time.perf_counter()
+    first = None
+    turn = backend.generate(prompt_tokens, tokens)
+    with closing(turn):
+        for _ in turn:
+            if first is None:
+                first = time.perf_counter()
+    end = time.perf_counter()
+    decoded = max(backend.generated - 1, 0)
+    return {
+        "backend": backend_class.name,
+        "model_id": backend.model_id,
+        "load_seconds": round(backend.handle.load_seconds, 3),
+        "prefill_tokens_per_second": round(len(prompt_tokens) / (first - start), 1) if first else None,
+        "decode_tokens_per_second": round(decoded / (end - first), 1) if first and decoded else None,
+    }
+
+
+def select_backend(model_ids=None):
+    # Benchmarks every installed backend once per process and returns the fastest name;
+    # model_ids maps backend names to the model to time instead of the default
+    global _selected
+    with _select_lock:
+        if _selected is None:
+            model_ids = model_ids or {}
+            for name, backend_class in BACKENDS.items():
+                if not backend_class.available():
+                    _report.append({"backend": name, "error": "not installed"})
+                    continue
+                try:
+                    _report.append(measure(backend_class, model_ids.get(name)))
+                except Exception as e:
+                    _report.append({"backend": name, "error": f"{type(e).__name__}: {e}"})
+            timed = [r for r in _report if r.get("decode_tokens_per_second")]
+            if not timed:
+                raise RuntimeError(f"no usable inference backend: {_report}")
+            _selected = max(timed, key=lambda r: r["decode_tokens_per_second"])["backend"]
+            # Keep only the winner's weights in memory
+            for r in timed:
+                if r["backend"] != _selected:
+                    BACKENDS[r["backend"]].registry.unload(r["model_id"])
+        return _selected
+
+
+def benchmark_report():
+    with _select_lock:
+        return list(_report)
+
+
+def make_backend(name=None, model_id=None, warmup=False, prompt_cache=True):
+    name = name or os.getenv("AGENT_COFFEE_BACKEND", "auto")
+    if name == "auto":
+        # The benchmark runs each backend's default model; a model_id given here
+        # is then loaded on the winner, so name the backend when passing one
+        name = select_backend()
+    if name not in BACKENDS:
+        raise ValueError(f"unknown backend {name!r}; expected one of {sorted(BACKENDS)} or 'auto'")
+    return BACKENDS[name](model_id, warmup=warmup, prompt_cache=prompt_cache)
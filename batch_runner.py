@@ -0,0 +1,152 @@
+'''
+Batch question mode: JSONL questions in, JSONL answers out.
+
+Input lines are either plain questions or {"id": ..., "question": ...} objects.
+run_batch_mlx feeds them to a scheduler.BatchScheduler, which keeps up to
+batch_size ReAct conversations in flight and decodes their pending turns
+together; a conversation leaves the batch while its tools run or once it has an
+answer, and queued questions take the free slots. run_batch_threads is the
+equivalent for remote backends, where each conversation runs on its own thread;
+run_batch_async runs them as asyncio tasks on one event loop instead.
+'''
+
+import asyncio
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from budget import QueryBudget
+from react_loop import astream_query, stream_query
+from scheduler import BatchScheduler, error_row
+
+
+def read_questions(fp):
+    for i, line in enumerate(fp):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            item = json.loads(line)
+            yield item.get("id", i), item["question"]
+        else:
+            yield i, line
+
+
+def write_jsonl(fp):
+    def write(row):
+        fp.write(json.dumps(row) + "\n")
+        fp.flush()
+    return write
+
+
+def report(count, tokens, elapsed, out=sys.stderr):
+    elapsed = max(elapsed, 1e-9)
+    print(f"{count} questions in {elapsed:.2f}s: {count / elapsed:.2f} questions/sec, "
+          f"{tokens / elapsed:.1f} tokens/sec", file=out)
+
+
+def run_batch_mlx(questions, system, known_actions, write, batch_size=8, max_turns=10, **agent_kwargs):
+    count = tokens = 0
+    start = time.perf_counter()
+    lock = threading.Lock()
+
+    def on_event(kind, payload):
+        nonlocal count, tokens
+        if kind == "done":
+            with lock:
+                count += 1
+                tokens += payload["generated_tokens"]
+                write(payload)
+
+    scheduler = BatchScheduler(system, known_actions, batch_size, max_turns,
+                               max_queue=batch_size, **agent_kwargs).start()
+    for qid, question in questions:
+        # Blocks while the scheduler's queue is full; once its worker has failed,
+        # the remaining questions get error rows
+        try:
+            scheduler.submit(qid, question, on_event, block=True, budget=QueryBudget())
+        except RuntimeError as e:
+            on_event("done", error_row(qid, question, str(e)))
+    scheduler.close()
+    report(count, tokens, time.perf_counter() - start)
+
+
+def run_batch_threads(questions, make_bot, known_actions, write, concurrency=8, max_turns=10):
+    def answer(item):
+        qid, question = item
+        start = time.perf_counter()
+        bot = None
+        row = {"id": qid, "question": question, "answer": "", "turns": 0}
+        try:
+            # Inside the try, so a bot that fails to build is one error row, not the batch
+            bot = make_bot()
+            for kind, payload in stream_query(bot, question, known_actions, max_turns, budget=QueryBudget()):
+                if kind == "turn":
+                    row["turns"] += 1
+                elif kind == "budget":
+                    row["stopped"] = payload["reason"]
+                elif kind == "answer":
+                    row["answer"] = payload
+        except Exception as e:
+            row["error"] = str(e)
+        finish_row(row, bot, start)
+        return row
+
+    count = tokens = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for row in pool.map(answer, questions):
+            count += 1
+            tokens += row["generated_tokens"]
+            write(row)
+    report(count, tokens, time.perf_counter() - start)
+
+
+def finish_row(row, bot, start):
+    row["generated_tokens"] = sum(t["generated_tokens"] for t in getattr(bot, "turn_stats", []))
+    if getattr(bot, "usage", None):
+        row["usage"] = dict(bot.usage)
+    row["seconds"] = round(time.perf_counter() - start, 3)
+
+
+def run_batch_async(questions, make_bot, known_actions, write, concurrency=8, max_turns=10, async_actions=None):
+    # make_bot must return a bot with astream(); rows are written in input order
+    async def answer(qid, question, slots):
+        async with slots:
+            start = time.perf_counter()
+            bot = None
+            row = {"id": qid, "question": question, "answer": "", "turns": 0}
+            try:
+                bot = make_bot()
+                async for kind, payload in astream_query(bot, question, known_actions, max_turns,
+                                                         budget=QueryBudget(), async_actions=async_actions):
+                    if kind == "turn":
+                        row["turns"] += 1
+                    elif kind == "budget":
+                        row["stopped"] = payload["reason"]
+                    elif kind == "answer":
+                        row["answer"] = payload
+            except Exception as e:
+                row["error"] = str(e)
+            finish_row(row, bot, start)
+            return row
+
+    async def run():
+        count = tokens = 0
+        start = time.perf_counter()
+        slots = asyncio.Semaphore(concurrency)
+        tasks = [asyncio.ensure_future(answer(qid, question, slots)) for qid, question in questions]
+        for task in tasks:
+            row = await task
+            count += 1
+            tokens += row["generated_tokens"]
+            write(row)
+        report(count, tokens, time.perf_counter() - start)
+
+    asyncio.run(run())
+
+
+def open_questions(path):
+    return sys.stdin if path == "-" else open(path)
@@ -0,0 +1,80 @@
+'''
+Cold start and first-turn latency with and without the system-prompt KV snapshot.
+
+Each run is a fresh process, so model loading and the snapshot load are part
+of the measurement. Three runs share one temporary snapshot directory:
+
+    off       AGENT_COFFEE_KV_SNAPSHOT=0, the system prompt is prefilled in turn one
+    build     the snapshot is computed and saved while the Agent starts
+    disk      the snapshot is loaded from the file the previous run saved
+
+Run from the repository root:
+
+    python -m benchmarks.bench_kv_snapshot --backend mlx
+'''
+
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+QUESTION = "Where can I find a coffee shop in Boston, MA?"
+
+
+def child(args):
+    start = time.perf_counter()
+    from mlx_agent import Agent
+    prompt = importlib.import_module("agent_coffee-mlx").prompt
+    imported = time.perf_counter()
+    bot = Agent(prompt, backend=args.backend, max_tokens=args.max_tokens)
+    ready = time.perf_counter()
+    bot(QUESTION)
+    turn = bot.turn_stats[0]
+    print(json.dumps({
+        "import_seconds": imported - start,
+        "agent_ready_seconds": ready - start,
+        "snapshot": bot.snapshot,
+        "first_turn_ttft": turn["ttft"],
+        "first_turn_prefilled_tokens": turn["prefilled_tokens"],
+        "first_token_seconds": ready - start + turn["ttft"],
+    }))
+
+
+def run(mode, args, kv_dir):
+    env = dict(os.environ, AGENT_COFFEE_KV_DIR=kv_dir, AGENT_COFFEE_KV_SNAPSHOT="0" if mode == "off" else "1")
+    out = subprocess.check_output(
+        [sys.executable, "-m", "benchmarks.bench_kv_snapshot", "--child", "--backend", args.backend,
+         "--max-tokens", str(args.max_tokens)], env=env, text=True)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", default="mlx")
+    parser.add_argument("--max-tokens", type=int, default=16)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    kv_dir = tempfile.mkdtemp(prefix="agent_coffee_kv_")
+    results = {mode: run(mode, args, kv_dir) for mode in ("off", "build", "disk")}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'run':<6} {'agent ready':>11} {'ttft':>8} {'prefilled':>9} {'first token':>11}")
+    for mode, r in results.items():
+        print(f"{mode:<6} {r['agent_ready_seconds']:>10.3f}s {r['first_turn_ttft']:>7.3f}s "
+              f"{r['first_turn_prefilled_tokens']:>9} {r['first_token_seconds']:>10.3f}s")
+    saved = results["off"]["first_token_seconds"] - results["disk"]["first_token_seconds"]
+    print(f"cold start to first token: {saved:+.3f}s saved with the snapshot on disk")
+
+
+if __name__ == "__main__":
+    main()
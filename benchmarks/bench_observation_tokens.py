@@ -0,0 +1,101 @@
+'''
+Prompt tokens per query with the repr and compact Observation formatters.
+
+Replays representative ReAct conversations offline and counts the prompt tokens
+sent on every turn (the whole transcript is re-sent each turn, so an early
+Observation is paid for again on each later turn). Counts use the model's
+tokenizer when transformers is installed, otherwise about four characters per
+token. Run from the repository root:
+
+    python -m benchmarks.bench_observation_tokens
+'''
+
+import argparse
+import os
+
+from model_registry import DEFAULT_MODEL
+from observation_format import formatters, approx_tokens, CompactFormatter
+from react_loop import format_observation
+
+SHOPS = [
+    {"name": f"Coffee Shop {i}", "address": f"{100 + i} Massachusetts Ave, Boston",
+     "latitude": 42.35 + i / 1000, "longitude": -71.06 - i / 1000}
+    for i in range(20)
+]
+TASTES = ["Espresso", "Turkish Coffee", "Flat White", "Cortado", "Moka Pot"]
+
+# (question, [(model turn, actions, observations)], final answer)
+SCENARIOS = [
+    ("Where can I find a coffee shop in Boston, MA?",
+     [("Thought: I should look up coffee shops\nAction: coffee_location: Boston, MA",
+       [("coffee_location", "Boston, MA")], [SHOPS])],
+     "Answer: Here are some coffee shops in Boston, MA."),
+    ("I like strong coffee, where can I get some near Boston?",
+     [("Thought: I need both tools\nAction: coffee_taste: strong\nAction: coffee_location: Boston, MA",
+       [("coffee_taste", "strong"), ("coffee_location", "Boston, MA")], [TASTES, SHOPS])],
+     "Answer: Try an espresso at one of these shops."),
+    ("What should I drink if I like it strong?",
+     [("Thought: I should check tastes\nAction: coffee_taste: strong",
+       [("coffee_taste", "strong")], [TASTES]),
+      ("Thought: Let me also find shops\nAction: coffee_location: Cambridge, MA",
+       [("coffee_location", "Cambridge, MA")], [SHOPS])],
+     "Answer: Espresso or Turkish coffee."),
+]
+
+
+def load_prompt():
+    # Read the prompt from the script without importing it (that would need mlx_lm)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    source = open(os.path.join(root, "agent_coffee-mlx.py")).read()
+    return source.split('prompt = """', 1)[1].split('""".strip()', 1)[0].strip()
+
+
+def prompt_tokens(system, scenario, formatter, count):
+    question, turns, answer = scenario
+    transcript = f"System: {system}\n\nUser: {question}\n"
+    total = 0
+    for text, actions, observations in turns:
+        total += count(transcript + "Assistant: ")
+        transcript += f"Assistant: {text}\n"
+        transcript += f"User: {format_observation(actions, observations, formatter)}\n"
+    total += count(transcript + "Assistant: ")
+    return total
+
+
+def token_counter():
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(DEFAULT_MODEL)
+        return lambda text: len(tokenizer.encode(text)), DEFAULT_MODEL
+    except Exception:
+        return approx_tokens, "approx (4 chars/token)"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--max-tokens", type=int, default=200)
+    args = parser.parse_args()
+
+    count, counter_name = token_counter()
+    system = load_prompt()
+    candidates = {
+        "repr": formatters["repr"],
+        "compact": CompactFormatter(top_k=args.top_k, max_tokens=args.max_tokens, count_tokens=count),
+    }
+    print(f"token counter: {counter_name}")
+    print(f"{'scenario':<60} {'repr':>7} {'compact':>8} {'saved':>6}")
+    totals = {name: 0 for name in candidates}
+    for scenario in SCENARIOS:
+        row = {name: prompt_tokens(system, scenario, f, count) for name, f in candidates.items()}
+        for name in row:
+            totals[name] += row[name]
+        saved = 1 - row["compact"] / row["repr"]
+        print(f"{scenario[0][:60]:<60} {row['repr']:>7} {row['compact']:>8} {saved:>6.0%}")
+    n = len(SCENARIOS)
+    print(f"{'mean prompt tokens per query':<60} {totals['repr'] / n:>7.0f} {totals['compact'] / n:>8.0f} "
+          f"{1 - totals['compact'] / totals['repr']:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
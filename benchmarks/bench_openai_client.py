@@ -0,0 +1,122 @@
+'''
+OpenAI client path: time to first token, prompt cache hits and batch throughput.
+
+Runs the OpenAI agent from agent_coffee.py against benchmarks.fake_openai_server
+and benchmarks.fake_maps_server, so no OpenAI or Google key is needed. The fake
+API reports cached prompt tokens like the real prompt cache, for the longest
+prefix shared with an earlier request, so the per-turn table shows how much of
+each prompt the stable prefix (system prompt, tools, earlier turns) saves.
+
+The batch comparison answers the same questions on worker threads sharing the
+pooled sync client (run_batch_threads) and as asyncio tasks on the async client
+(run_batch_async), and counts the TCP connections each opened.
+
+    python -m benchmarks.bench_openai_client
+    python -m benchmarks.bench_openai_client --tool-calling --questions 64 --latency 0.1 --json
+'''
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.bench_tool_calling import SCENARIOS
+
+MULTI_TURN = "What is less acidic, and where can I get it in Austin, TX?"
+
+
+def turn_usage(module, question, tool_calling):
+    # One streamed conversation; returns the Agent's per-turn stats and totals
+    from react_loop import stream_query
+
+    bot = module.make_agent(tool_calling)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in stream_query(bot, question, module.known_actions, speculate=False):
+            pass
+    turns = [{key: t[key] for key in ("prompt_tokens", "cached_tokens", "generated_tokens", "ttft", "total")}
+             for t in bot.turn_stats]
+    return {"turns": turns, "usage": dict(bot.usage)}
+
+
+def batch(module, fake, runner, questions, tool_calling, concurrency, **options):
+    rows = []
+    before = dict(fake.requests)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        runner(questions, lambda: module.make_agent(tool_calling), module.known_actions, rows.append,
+               concurrency=concurrency, **options)
+    elapsed = time.perf_counter() - start
+    usage = [r.get("usage", {}) for r in rows]
+    prompt = sum(u.get("prompt_tokens", 0) for u in usage)
+    return {
+        "questions": len(rows),
+        "errors": sum("error" in r for r in rows),
+        "seconds": elapsed,
+        "questions_per_second": len(rows) / max(elapsed, 1e-9),
+        "round_trips": fake.requests["chat"] - before["chat"],
+        "connections": fake.requests["connections"] - before["connections"],
+        "prompt_tokens": prompt,
+        "cached_tokens": sum(u.get("cached_tokens", 0) for u in usage),
+        "cached_share": sum(u.get("cached_tokens", 0) for u in usage) / max(prompt, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=32, help="questions per batch run")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--tool-calling", action="store_true", help="use native tool calls instead of Action lines")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before each fake API response")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="seconds per streamed chunk")
+    parser.add_argument("--cache-min-tokens", type=int, default=128,
+                        help="shortest prefix the fake API reports as cached (the real API uses 1024)")
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    args = parser.parse_args()
+
+    # agent_coffee builds its OpenAI client at import, so the fakes come first
+    from benchmarks import fake_maps_server, fake_openai_server
+    maps_server, _, maps_url = fake_maps_server.start()
+    api_server, fake, api_url = fake_openai_server.start(
+        scripts={s["question"]: s["plan"] for s in SCENARIOS}, latency=args.latency,
+        token_latency=args.token_latency, cache_min_tokens=args.cache_min_tokens)
+    os.environ["MAPS_BASE_URL"] = maps_url
+    os.environ["OPENAI_BASE_URL"] = api_url
+    os.environ["OPENAI_API_KEY"] = "offline-benchmark"
+    os.environ.setdefault("AGENT_COFFEE_CACHE", os.path.join(tempfile.mkdtemp(), "bench.sqlite3"))
+    module = importlib.import_module("agent_coffee")
+    from batch_runner import run_batch_async, run_batch_threads
+
+    # The first conversation fills the fake prompt cache; the second one reads it
+    results = {
+        "cold": turn_usage(module, MULTI_TURN, args.tool_calling),
+        "warm": turn_usage(module, MULTI_TURN, args.tool_calling),
+    }
+    questions = [(i, SCENARIOS[i % len(SCENARIOS)]["question"]) for i in range(args.questions)]
+    results["threads"] = batch(module, fake, run_batch_threads, questions, args.tool_calling, args.concurrency)
+    results["async"] = batch(module, fake, run_batch_async, questions, args.tool_calling, args.concurrency,
+                             async_actions=module.async_actions)
+    api_server.shutdown()
+    maps_server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'run':<5} {'turn':>4} {'prompt':>7} {'cached':>7} {'output':>7} {'ttft ms':>8} {'total ms':>9}")
+    for run in ("cold", "warm"):
+        for i, t in enumerate(results[run]["turns"], 1):
+            print(f"{run:<5} {i:>4} {t['prompt_tokens']:>7} {t['cached_tokens']:>7} {t['generated_tokens']:>7} "
+                  f"{t['ttft'] * 1000:>8.1f} {t['total'] * 1000:>9.1f}")
+    print()
+    print(f"{'batch':<8} {'q/s':>7} {'seconds':>8} {'trips':>6} {'conns':>6} {'cached':>7} {'errors':>6}")
+    for run in ("threads", "async"):
+        r = results[run]
+        print(f"{run:<8} {r['questions_per_second']:>7.2f} {r['seconds']:>8.2f} {r['round_trips']:>6} "
+              f"{r['connections']:>6} {r['cached_share']:>7.0%} {r['errors']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+'''
+Per-turn time-to-first-token for the MLX Agent with the prompt cache on and off.
+
+Replays a fixed multi-turn ReAct conversation so both runs prefill the same
+transcript. Run from the repository root:
+
+    python -m benchmarks.bench_prompt_cache --turns 10
+'''
+
+import argparse
+import importlib
+import json
+
+from mlx_agent import Agent
+from model_registry import registry, DEFAULT_MODEL
+
+SYSTEM = importlib.import_module("agent_coffee-mlx").prompt
+
+OBSERVATION = "Observation: " + str([
+    {"name": f"Coffee Shop {i}", "address": f"{i} Main St, Boston"} for i in range(20)
+])
+
+
+def run(prompt_cache, turns, max_tokens):
+    bot = Agent(SYSTEM, prompt_cache=prompt_cache, max_tokens=max_tokens, backend="mlx")
+    bot("Where can I find a coffee shop in Boston, MA?")
+    for _ in range(turns - 1):
+        bot(OBSERVATION)
+    return bot.turn_stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--max-tokens", type=int, default=16)
+    parser.add_argument("--json", action="store_true", help="print raw per-turn stats as JSON")
+    args = parser.parse_args()
+
+    registry.get(DEFAULT_MODEL, warmup=True)
+    results = {
+        "cache_off": run(False, args.turns, args.max_tokens),
+        "cache_on": run(True, args.turns, args.max_tokens),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'turn':>4} {'prompt tok':>10} {'prefill off':>11} {'ttft off':>9} {'prefill on':>10} {'ttft on':>8}")
+    for i, (off, on) in enumerate(zip(results["cache_off"], results["cache_on"]), 1):
+        print(f"{i:>4} {off['prompt_tokens']:>10} {off['prefilled_tokens']:>11} {off['ttft']:>8.3f}s "
+              f"{on['prefilled_tokens']:>10} {on['ttft']:>7.3f}s")
+    total_off = sum(t["ttft"] for t in results["cache_off"])
+    total_on = sum(t["ttft"] for t in results["cache_on"])
+    print(f"total ttft: {total_off:.3f}s without cache, {total_on:.3f}s with cache")
+
+
+if __name__ == "__main__":
+    main()
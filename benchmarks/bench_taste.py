@@ -0,0 +1,50 @@
+'''
+coffee_taste latency over a large synthetic catalog.
+
+Builds a catalog of --profiles drinks from the notes in the shipped catalog and
+times ranked lookups. Run from the repository root:
+
+    python -m benchmarks.bench_taste --profiles 5000
+'''
+
+import argparse
+import random
+import time
+
+from taste_engine import TasteIndex, DEFAULT_CATALOG, np
+
+QUERIES = [
+    "I like my coffee strong and creamy",
+    "something less acidic and full bodied",
+    "bright, fruity and aromatic please",
+    "mild smooth milky",
+    "no preference",
+]
+
+
+def synthetic_catalog(size, seed=0):
+    rng = random.Random(seed)
+    notes = sorted(" ".join(note) for note in TasteIndex.load(DEFAULT_CATALOG).postings)
+    return [{"name": f"Blend {i}", "notes": rng.sample(notes, rng.randint(2, 5))} for i in range(size)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = TasteIndex(synthetic_catalog(args.profiles))
+    print(f"indexed {args.profiles} profiles in {(time.perf_counter() - start) * 1000:.1f} ms "
+          f"({'numpy' if np is not None else 'pure python'} scoring)")
+    for query in QUERIES:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            ranked = index.rank(query)
+        per_query = (time.perf_counter() - start) / args.repeat * 1e6
+        print(f"{per_query:8.1f} us  {query!r} -> {[name for name, _ in ranked[:3]]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+'''
+Turns and API round trips per question: Action-line text protocol vs native tool calls.
+
+Runs the OpenAI agent from agent_coffee.py against benchmarks.fake_openai_server
+and benchmarks.fake_maps_server, so no OpenAI or Google key is needed. The
+scenarios include the slips a model makes with free-text actions (an Action
+inside the Thought line, a bolded Action keyword, one action per turn where
+two were needed); with native tool calls the same plans come back as
+structured, parallel calls.
+
+    python -m benchmarks.bench_tool_calling
+    python -m benchmarks.bench_tool_calling --stream --token-latency 0.005 --json
+'''
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import tempfile
+import time
+
+SCENARIOS = [
+    {"name": "location", "question": "Where can I find a coffee shop in Boston, MA?",
+     "plan": [[("coffee_location", "Boston, MA")]]},
+    {"name": "taste_and_location", "question": "Where can I get strong coffee near Cambridge, MA?",
+     "plan": [[("coffee_taste", "strong"), ("coffee_location", "Cambridge, MA")]], "quirk": "one_per_turn"},
+    {"name": "taste_then_location", "question": "What is less acidic, and where can I get it in Austin, TX?",
+     "plan": [[("coffee_taste", "less acidic")], [("coffee_location", "Austin, TX")]]},
+    {"name": "inline_action", "question": "Any good cafes in Denver, CO?",
+     "plan": [[("coffee_location", "Denver, CO")]], "quirk": "inline"},
+    {"name": "markdown_action", "question": "I like my coffee sweet and chocolatey",
+     "plan": [[("coffee_taste", "sweet and chocolatey")]], "quirk": "markdown"},
+    {"name": "direct_answer", "question": "What is a cortado?", "plan": []},
+]
+
+MODES = {"text": False, "tools": True}
+
+
+def run_question(module, fake, question, tool_calling, stream):
+    from react_loop import stream_query
+
+    bot = module.make_agent(tool_calling)
+    before = fake.requests["chat"]
+    tool_calls = 0
+    answer = ""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if stream:
+            events = stream_query(bot, question, module.known_actions, speculate=False)
+        else:
+            # Non-streaming turns through Agent.__call__, the same loop otherwise
+            events = stream_query(NonStreaming(bot), question, module.known_actions, speculate=False)
+        for kind, payload in events:
+            if kind == "action":
+                tool_calls += 1
+            elif kind == "answer":
+                answer = payload
+    return {
+        "seconds": time.perf_counter() - start,
+        "turns": len(bot.turn_stats),
+        "round_trips": fake.requests["chat"] - before,
+        "tool_calls": tool_calls,
+        "answered": "Answer:" in answer,
+    }
+
+
+class NonStreaming:
+    # Presents Agent.__call__ as a one-chunk stream
+    def __init__(self, bot):
+        self.bot = bot
+
+    def __getattr__(self, name):
+        return getattr(self.bot, name)
+
+    def stream(self, message):
+        yield self.bot(message)
+
+
+def summarize(rows):
+    n = len(rows)
+    return {
+        "questions": n,
+        "turns_per_question": sum(r["turns"] for r in rows) / n,
+        "round_trips_per_question": sum(r["round_trips"] for r in rows) / n,
+        "tool_calls_per_question": sum(r["tool_calls"] for r in rows) / n,
+        "answered": sum(r["answered"] for r in rows) / n,
+        "mean_seconds": sum(r["seconds"] for r in rows) / n,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--stream", action="store_true", help="use Agent.stream instead of Agent.__call__")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds before each fake API response")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per streamed chunk")
+    parser.add_argument("--reject-tools", action="store_true", help="make the fake API refuse tools")
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    args = parser.parse_args()
+
+    # agent_coffee builds its OpenAI client at import, so the fakes come first
+    from benchmarks import fake_maps_server, fake_openai_server
+    maps_server, _, maps_url = fake_maps_server.start()
+    api_server, fake, api_url = fake_openai_server.start(
+        scripts={s["question"]: s["plan"] for s in SCENARIOS},
+        quirks={s["question"]: s["quirk"] for s in SCENARIOS if "quirk" in s},
+        latency=args.latency, token_latency=args.token_latency, reject_tools=args.reject_tools)
+    os.environ["MAPS_BASE_URL"] = maps_url
+    os.environ["OPENAI_BASE_URL"] = api_url
+    os.environ["OPENAI_API_KEY"] = "offline-benchmark"
+    os.environ.setdefault("AGENT_COFFEE_CACHE", os.path.join(tempfile.mkdtemp(), "bench.sqlite3"))
+    module = importlib.import_module("agent_coffee")
+
+    results = {}
+    for mode, tool_calling in MODES.items():
+        rows = {s["name"]: [run_question(module, fake, s["question"], tool_calling, args.stream)
+                            for _ in range(args.iterations)]
+                for s in SCENARIOS}
+        results[mode] = {
+            "overall": summarize([r for scenario in rows.values() for r in scenario]),
+            "scenarios": {name: summarize(scenario) for name, scenario in rows.items()},
+        }
+    results["requests"] = dict(fake.requests)
+    api_server.shutdown()
+    maps_server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<6} {'scenario':<20} {'turns':>6} {'trips':>6} {'tools':>6} {'answered':>9} {'ms':>8}")
+    for mode in MODES:
+        rows = list(results[mode]["scenarios"].items()) + [("(all)", results[mode]["overall"])]
+        for name, s in rows:
+            print(f"{mode:<6} {name:<20} {s['turns_per_question']:>6.2f} {s['round_trips_per_question']:>6.2f} "
+                  f"{s['tool_calls_per_question']:>6.2f} {s['answered']:>9.0%} {s['mean_seconds'] * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+'''
+Scripted, deterministic stand-in for the model behind Agent.
+
+ScriptedAgent has the same surface as the real Agent classes (messages,
+stream, __call__, budget, turn_stats), so the real loop, tools and formatters
+run unchanged. Each question maps to a plan: a list of turns, each a list of
+(action, input) pairs; after the last planned turn the agent answers. Time to
+first token grows with the prompt (prefill) and every token costs a fixed
+decode latency.
+'''
+
+import re
+import time
+
+import budget as query_budget
+from observation_format import approx_tokens
+from stopping import TokenBudget, turn_report
+from tracing import record
+
+
+class FakeLLM:
+    def __init__(self, scripts=None, token_latency=0.002, prefill_latency_per_1k=0.02):
+        self.scripts = dict(scripts or {})
+        self.token_latency = token_latency
+        self.prefill_latency_per_1k = prefill_latency_per_1k
+
+    def turn_text(self, question, turn):
+        plan = self.scripts.get(question, [])
+        if turn < len(plan):
+            actions = plan[turn]
+            thought = "Thought: I should use " + " and ".join(name for name, _ in actions)
+            return thought + "\n" + "\n".join(f"Action: {name}: {value}" for name, value in actions) + "\nPAUSE"
+        return f"Answer: Here is what I found about {question.rstrip('?')}."
+
+    def tokens(self, text):
+        return re.findall(r"\S+\s*|\s+", text)
+
+    def agent_class(self):
+        llm = self
+
+        class ScriptedAgent:
+            def __init__(self, system="", max_tokens=256, max_query_tokens=None, **kwargs):
+                self.system = system
+                self.budget = TokenBudget(max_tokens, max_query_tokens)
+                self.turn_stats = []
+                self.messages = []
+                if system:
+                    self.messages.append({"role": "system", "content": system})
+
+            def __call__(self, message):
+                return "".join(self.stream(message)).strip()
+
+            def stream(self, message):
+                self.messages.append({"role": "user", "content": message})
+                question = next(m["content"] for m in self.messages if m["role"] == "user")
+                turn = sum(1 for m in self.messages if m["role"] == "assistant")
+                prompt_tokens = sum(approx_tokens(m["content"]) for m in self.messages)
+                prefill = llm.prefill_latency_per_1k * prompt_tokens / 1000
+                time.sleep(prefill)
+                record("llm.prefill", prefill, prompt_tokens=prompt_tokens)
+
+                text = llm.turn_text(question, turn)
+                # Like a real model with stop sequences, the turn ends at PAUSE
+                emitted = self.tokens_until_pause(text)
+                start = time.perf_counter()
+                for token in emitted:
+                    time.sleep(llm.token_latency)
+                    yield token
+                stats = turn_report(self.budget.turn_limit(), len(emitted),
+                                    "stop_sequence" if "PAUSE" in text else "eos")
+                stats.update({"prompt_tokens": prompt_tokens, "total": time.perf_counter() - start})
+                record("llm.decode", stats["total"], generated_tokens=len(emitted))
+                self.budget.spend(len(emitted))
+                query_budget.spend_tokens(len(emitted))
+                self.turn_stats.append(stats)
+                self.messages.append({"role": "assistant", "content": "".join(emitted).strip()})
+
+            def tokens_until_pause(self, text):
+                return llm.tokens(text.split("PAUSE")[0])
+
+        return ScriptedAgent
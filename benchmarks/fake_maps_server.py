@@ -0,0 +1,135 @@
+'''
+Local stand-in for the Google geocode and nearbysearch endpoints.
+
+Point the tools at it with MAPS_BASE_URL=http://127.0.0.1:<port>. Every address
+geocodes to a deterministic location except ones containing "nowhere", which
+return ZERO_RESULTS. Nearby results come in pages of 20 with a next_page_token
+that, like Google's, is rejected with INVALID_REQUEST until token_delay seconds
+after it was issued. Latency and transient failures can be injected:
+
+    python -m benchmarks.fake_maps_server --port 8765 --latency 0.05 --fail-every 5 --places 60
+'''
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeMaps:
+    def __init__(self, latency=0.0, places=20, fail_every=0, fail_status=503, page_size=20, token_delay=0.0):
+        self.latency = latency
+        self.places = places
+        self.page_size = page_size
+        self.token_delay = token_delay
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.requests = {"geocode": 0, "nearbysearch": 0, "invalid_page_token": 0}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def should_fail(self):
+        with self._lock:
+            self._count += 1
+            return self.fail_every and self._count % self.fail_every == 0
+
+    def geocode(self, params):
+        self.requests["geocode"] += 1
+        address = params.get("address", "")
+        if not address or "nowhere" in address.lower():
+            return {"status": "ZERO_RESULTS", "results": []}
+        digest = hashlib.sha1(address.lower().encode()).digest()
+        lat = digest[0] / 255 * 120 - 60
+        lng = digest[1] / 255 * 360 - 180
+        return {"status": "OK", "results": [{"geometry": {"location": {"lat": lat, "lng": lng}}}]}
+
+    def nearbysearch(self, params):
+        self.requests["nearbysearch"] += 1
+        if "pagetoken" in params:
+            # The token carries the search, the next offset and when it was issued
+            lat, lng, offset, issued = params["pagetoken"].split(":")
+            if time.time() < float(issued) + self.token_delay:
+                self.requests["invalid_page_token"] += 1
+                return {"status": "INVALID_REQUEST", "results": []}
+            lat, lng, offset = float(lat), float(lng), int(offset)
+        else:
+            lat, lng = (float(x) for x in params.get("location", "0,0").split(","))
+            offset = 0
+        end = min(offset + self.page_size, self.places)
+        results = [
+            {
+                "name": f"Fake Coffee {i + 1}",
+                "vicinity": f"{100 + i} Main St",
+                "geometry": {"location": {"lat": lat + i * 0.001, "lng": lng - i * 0.001}},
+            }
+            for i in range(offset, end)
+        ]
+        data = {"status": "OK", "results": results}
+        if end < self.places:
+            data["next_page_token"] = f"{lat}:{lng}:{end}:{time.time()}"
+        return data
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if fake.latency:
+                time.sleep(fake.latency)
+            if url.path.endswith("/geocode/json"):
+                handler = fake.geocode
+            elif url.path.endswith("/nearbysearch/json"):
+                handler = fake.nearbysearch
+            elif url.path == "/stats":
+                handler = lambda params: fake.requests
+            else:
+                return self.reply(404, {"status": "NOT_FOUND"})
+            if url.path != "/stats" and fake.should_fail():
+                return self.reply(fake.fail_status, {"status": "UNKNOWN_ERROR"})
+            self.reply(200, handler(params))
+
+        def reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start(port=0, **options):
+    # Starts the server on a background thread; returns (server, fake, base_url)
+    fake = FakeMaps(**options)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--places", type=int, default=20)
+    parser.add_argument("--fail-every", type=int, default=0)
+    parser.add_argument("--token-delay", type=float, default=2.0, help="seconds before a next_page_token works")
+    args = parser.parse_args()
+    fake = FakeMaps(args.latency, args.places, args.fail_every, token_delay=args.token_delay)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(fake))
+    print(f"Fake Maps server on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
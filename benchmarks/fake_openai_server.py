@@ -0,0 +1,240 @@
+'''
+Local stand-in for the OpenAI chat completions endpoint.
+
+Point the OpenAI client at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+Like benchmarks.fake_llm, each question maps to a plan: a list of turns, each a
+list of (action, input) pairs; after the last planned turn the model answers.
+
+A request with tools gets the turn's actions back as parallel tool calls. A
+request without tools gets them as Thought/Action text, optionally with one of
+the slips a model makes with the free-text protocol (quirks):
+
+    inline        the Action is written inside the Thought line
+    markdown      the Action keyword is wrapped in **bold**
+    one_per_turn  only the first action of each turn is written; the rest follow one per turn
+
+Stop sequences, streaming (with include_usage) and usage counts are honoured.
+Usage reports cached prompt tokens the way the API's prompt cache does: the
+longest prefix (tools, then messages) shared with an earlier request, in steps
+of 128 tokens once it reaches cache_min_tokens. --reject-tools answers
+requests with tools with a 400 to exercise fallbacks.
+
+    python -m benchmarks.fake_openai_server --port 8766 --token-latency 0.005
+'''
+
+import argparse
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from observation_format import approx_tokens
+
+
+class FakeOpenAI:
+    def __init__(self, scripts=None, quirks=None, latency=0.0, token_latency=0.0, reject_tools=False,
+                 cache_min_tokens=1024):
+        self.scripts = dict(scripts or {})
+        self.quirks = dict(quirks or {})
+        self.latency = latency
+        self.token_latency = token_latency
+        self.reject_tools = reject_tools
+        self.cache_min_tokens = cache_min_tokens
+        self.prompts = deque(maxlen=256)
+        self.requests = {"chat": 0, "tools": 0, "text": 0, "rejected": 0, "connections": 0}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def count(self, *keys):
+        with self._lock:
+            for key in keys:
+                self.requests[key] += 1
+
+    def text_turns(self, question):
+        plan = self.scripts.get(question, [])
+        if self.quirks.get(question) == "one_per_turn":
+            return [[action] for turn in plan for action in turn]
+        return plan
+
+    def reply(self, body):
+        # Returns (content, tool_calls, finish_reason) for the next assistant turn
+        messages = body.get("messages", [])
+        question = next((m["content"] for m in messages if m["role"] == "user"), "")
+        turn = sum(1 for m in messages if m["role"] == "assistant")
+        answer = f"Answer: Here is what I found about {question.rstrip('?')}."
+        if body.get("tools"):
+            plan = self.scripts.get(question, [])
+            if turn >= len(plan):
+                return answer, [], "stop"
+            calls = [{"id": f"call_{next(self._ids)}", "name": name, "arguments": json.dumps({"input": value})}
+                     for name, value in plan[turn]]
+            return None, calls, "tool_calls"
+
+        plan = self.text_turns(question)
+        if turn >= len(plan):
+            return answer, [], "stop"
+        names = " and ".join(name for name, _ in plan[turn])
+        quirk = self.quirks.get(question)
+        if quirk == "inline":
+            name, value = plan[turn][0]
+            text = f"Thought: I should look this up, so Action: {name}: {value}\nPAUSE"
+        elif quirk == "markdown":
+            text = f"Thought: I should use {names}\n" + "\n".join(
+                f"**Action:** {name}: {value}" for name, value in plan[turn]) + "\nPAUSE"
+        else:
+            text = f"Thought: I should use {names}\n" + "\n".join(
+                f"Action: {name}: {value}" for name, value in plan[turn]) + "\nPAUSE"
+        stop = body.get("stop") or []
+        hits = [text.find(s) for s in ([stop] if isinstance(stop, str) else stop) if s in text]
+        if hits:
+            text = text[:min(hits)]
+        return text, [], "stop"
+
+    def usage(self, body, content, calls):
+        text = json.dumps(body.get("tools") or []) + "".join(
+            f"{m['role']}: {m.get('content') or ''}\n" for m in body.get("messages", []))
+        with self._lock:
+            shared = max((len(os.path.commonprefix([text, p])) for p in self.prompts), default=0)
+            self.prompts.append(text)
+        cached = approx_tokens(text[:shared]) // 128 * 128
+        prompt = approx_tokens(text)
+        completion = approx_tokens(content or "") + sum(approx_tokens(c["arguments"]) + 2 for c in calls)
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion,
+                "prompt_tokens_details": {"cached_tokens": cached if cached >= self.cache_min_tokens else 0}}
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            # One handler per TCP connection, so this counts connections the clients opened.
+            # Streamed chunks are small writes; without TCP_NODELAY, Nagle holds them on a
+            # reused connection until the client's delayed ACK
+            super().setup()
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            fake.count("connections")
+
+        def handle(self):
+            # A client cut off by its query budget hangs up mid-stream
+            try:
+                super().handle()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                return self.send_json(404, {"error": {"message": "not found"}})
+            if fake.latency:
+                time.sleep(fake.latency)
+            if body.get("tools") and fake.reject_tools:
+                fake.count("chat", "rejected")
+                return self.send_json(400, {"error": {"message": "tools are not supported",
+                                                      "type": "invalid_request_error", "param": "tools"}})
+            fake.count("chat", "tools" if body.get("tools") else "text")
+            content, calls, finish_reason = fake.reply(body)
+            usage = fake.usage(body, content, calls)
+            if body.get("stream"):
+                return self.send_stream(body, content, calls, finish_reason, usage)
+            message = {"role": "assistant", "content": content}
+            if calls:
+                message["tool_calls"] = [{"id": c["id"], "type": "function",
+                                          "function": {"name": c["name"], "arguments": c["arguments"]}}
+                                         for c in calls]
+            self.send_json(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+
+        def do_GET(self):
+            if self.path == "/stats":
+                return self.send_json(200, fake.requests)
+            self.send_json(404, {"error": {"message": "not found"}})
+
+        def send_stream(self, body, content, calls, finish_reason, usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            model = body.get("model", "fake")
+
+            def event(delta=None, finish=None, usage=None):
+                data = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model, "choices": []}
+                if delta is not None:
+                    data["choices"] = [{"index": 0, "delta": delta, "finish_reason": finish}]
+                if usage is not None:
+                    data["usage"] = usage
+                self.send_chunk(f"data: {json.dumps(data)}\n\n")
+
+            event({"role": "assistant", "content": ""})
+            words = content.split(" ") if content else []
+            for i, word in enumerate(words):
+                time.sleep(fake.token_latency)
+                event({"content": word if i == len(words) - 1 else word + " "})
+            for index, call in enumerate(calls):
+                event({"tool_calls": [{"index": index, "id": call["id"], "type": "function",
+                                       "function": {"name": call["name"], "arguments": ""}}]})
+                half = len(call["arguments"]) // 2
+                for fragment in (call["arguments"][:half], call["arguments"][half:]):
+                    time.sleep(fake.token_latency)
+                    event({"tool_calls": [{"index": index, "function": {"arguments": fragment}}]})
+            event({}, finish_reason)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                event(usage=usage)
+            # [DONE] and the last chunk go out together: the SDK stops reading at
+            # [DONE], and a client that closes before the body ends drops the connection
+            self.send_chunk("data: [DONE]\n\n", last=True)
+
+        def send_chunk(self, text, last=False):
+            data = text.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n" + (b"0\r\n\r\n" if last else b""))
+            self.wfile.flush()
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start(port=0, **options):
+    # Starts the server on a background thread; returns (server, fake, base_url)
+    fake = FakeOpenAI(**options)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response starts")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per streamed chunk")
+    parser.add_argument("--reject-tools", action="store_true", help="answer requests with tools with a 400")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024, help="shortest prefix reported as cached")
+    args = parser.parse_args()
+    fake = FakeOpenAI(latency=args.latency, token_latency=args.token_latency, reject_tools=args.reject_tools,
+                      cache_min_tokens=args.cache_min_tokens)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(fake))
+    print(f"Fake OpenAI server on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
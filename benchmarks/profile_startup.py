@@ -0,0 +1,122 @@
+'''
+Import-time and startup profile of the entry points.
+
+Each module is imported in a fresh interpreter under `python -X importtime`, and
+the report lists the total import time and the slowest modules by cumulative
+time (the module plus everything it imported). With --load it also times the
+model start-up phases the Streamlit app runs on its background loader: backend
+selection, weight loading, warmup and the system-prompt KV snapshot.
+
+Run from the repository root:
+
+    python -m benchmarks.profile_startup
+    python -m benchmarks.profile_startup --module agent_coffee-mlx --top 20 --load
+'''
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+MODULES = ["AgentCoffee", "agent_coffee-mlx", "agent_coffee"]
+
+# "import time:   self [us] | cumulative | imported package"
+_line_re = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S.*)$")
+
+
+def import_profile(module):
+    # importlib, since "agent_coffee-mlx" is not a valid module name for an import statement
+    code = f"import importlib; importlib.import_module({module!r})"
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"))
+    wall = time.perf_counter() - start
+    imports = []
+    other = []
+    for line in proc.stderr.splitlines():
+        match = _line_re.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append({"module": name, "self_ms": int(self_us) / 1000,
+                            "cumulative_ms": int(cumulative_us) / 1000, "depth": len(indent) // 2})
+        elif not line.startswith("import time:"):
+            other.append(line)
+    # Top-level imports (depth 0) add up to the whole import, without double counting
+    total = sum(i["cumulative_ms"] for i in imports if i["depth"] == 0)
+    return {
+        "module": module,
+        "ok": proc.returncode == 0,
+        "error": other[-1] if proc.returncode and other else None,
+        "wall_seconds": wall,
+        "import_ms": total,
+        "modules": len(imports),
+        "imports": imports,
+    }
+
+
+def load_profile(backend=None):
+    # Same steps as the app's BackgroundLoader, timed one by one
+    import importlib
+
+    from backends import make_backend, select_backend
+    from mlx_agent import Agent
+
+    phases = {}
+    start = time.perf_counter()
+    prompt = importlib.import_module("agent_coffee-mlx").prompt
+    phases["import"] = time.perf_counter() - start
+    name = backend or os.getenv("AGENT_COFFEE_BACKEND", "auto")
+    if name == "auto":
+        start = time.perf_counter()
+        name = select_backend()
+        phases["select"] = time.perf_counter() - start
+    start = time.perf_counter()
+    instance = make_backend(name)
+    phases["load"] = time.perf_counter() - start
+    start = time.perf_counter()
+    instance.registry.warmup(instance.handle)
+    phases["warmup"] = time.perf_counter() - start
+    # The Agent borrows the model loaded above, so this is the snapshot seed
+    start = time.perf_counter()
+    bot = Agent(prompt, backend=name)
+    phases["snapshot"] = time.perf_counter() - start
+    return {"backend": name, "snapshot": bot.snapshot, "phases": phases}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", action="append", help="entry point to profile (default: all)")
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to list")
+    parser.add_argument("--load", action="store_true", help="also time model loading")
+    parser.add_argument("--backend", help="backend for --load (default: AGENT_COFFEE_BACKEND)")
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    args = parser.parse_args()
+
+    results = [import_profile(module) for module in args.module or MODULES]
+    load = load_profile(args.backend) if args.load else None
+    if args.json:
+        for r in results:
+            r["imports"] = sorted(r["imports"], key=lambda i: -i["cumulative_ms"])[:args.top]
+        print(json.dumps({"imports": results, "load": load}, indent=2))
+        return
+
+    for r in results:
+        status = "" if r["ok"] else f"  (failed: {r['error']})"
+        print(f"{r['module']}: {r['import_ms']:.0f} ms importing {r['modules']} modules, "
+              f"{r['wall_seconds']:.2f}s process{status}")
+        print(f"  {'cumulative':>10} {'self':>8}  module")
+        for i in sorted(r["imports"], key=lambda i: -i["cumulative_ms"])[:args.top]:
+            print(f"  {i['cumulative_ms']:>8.1f}ms {i['self_ms']:>6.1f}ms  {i['module']}")
+    if load:
+        print(f"startup on {load['backend']}: " + ", ".join(
+            f"{phase} {seconds:.2f}s" for phase, seconds in load["phases"].items())
+              + f" = {sum(load['phases'].values()):.2f}s")
+        if load["snapshot"]:
+            print(f"system prompt snapshot: {load['snapshot']['source']}, {load['snapshot']['tokens']} tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+'''
+Offline end-to-end benchmark for the agent loop.
+
+Drives AgentCoffee.process_query and the query() functions of both CLIs
+through representative multi-turn scenarios with the model replaced by
+benchmarks.fake_llm and Google Maps replaced by benchmarks.fake_maps_server,
+so no Apple MLX, OpenAI key or Google key is needed. The real loop, tools,
+formatters, caches and HTTP client all run.
+
+Reports p50/p95/p99 end-to-end latency, turns per query and tool time per
+query, and writes the results as JSON that --compare can diff against a
+previous run:
+
+    python -m benchmarks.run_benchmarks --iterations 20 --output bench.json
+    python -m benchmarks.run_benchmarks --compare bench.json
+'''
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SCHEMA_VERSION = 1
+
+SCENARIOS = [
+    {"name": "location", "question": "Where can I find a coffee shop in Boston, MA?",
+     "plan": [[("coffee_location", "Boston, MA")]]},
+    {"name": "taste", "question": "I like my coffee strong and creamy",
+     "plan": [[("coffee_taste", "strong and creamy")]]},
+    {"name": "taste_and_location", "question": "Where can I get strong coffee near Cambridge, MA?",
+     "plan": [[("coffee_taste", "strong"), ("coffee_location", "Cambridge, MA")]]},
+    {"name": "taste_then_location", "question": "What is less acidic, and where can I get it in Austin, TX?",
+     "plan": [[("coffee_taste", "less acidic")], [("coffee_location", "Austin, TX")]]},
+    {"name": "unknown_city", "question": "Any coffee shops in Nowhere, ZZ?",
+     "plan": [[("coffee_location", "Nowhere, ZZ")]]},
+    {"name": "direct_answer", "question": "What is a cortado?", "plan": []},
+]
+
+# name -> (module, function); the CLIs print, so their output is discarded
+ENTRY_POINTS = {
+    "streamlit.process_query": ("AgentCoffee", "process_query"),
+    "cli.mlx.query": ("agent_coffee-mlx", "query"),
+    "cli.openai.query": ("agent_coffee", "query"),
+}
+
+
+def percentile(values, q):
+    # Linear interpolation between closest ranks
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(samples):
+    latencies = [s["seconds"] for s in samples]
+    n = len(samples)
+    return {
+        "n": n,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mean": sum(latencies) / n if n else None,
+        "turns_per_query": sum(s["turns"] for s in samples) / n if n else None,
+        "tool_seconds_per_query": sum(s["tool_seconds"] for s in samples) / n if n else None,
+    }
+
+
+class ToolTimer:
+    def __init__(self):
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def wrap(self, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.seconds += time.perf_counter() - start
+        return timed
+
+
+def run_entry(name, module_name, function_name, llm, args, maps_client):
+    try:
+        module = importlib.import_module(module_name)
+    except Exception as e:
+        return {"skipped": f"{type(e).__name__}: {e}"}
+
+    agents = []
+    base = llm.agent_class()
+
+    class RecordingAgent(base):
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            agents.append(self)
+
+    timer = ToolTimer()
+    original = (module.Agent, module.known_actions)
+    module.Agent = RecordingAgent
+    module.known_actions = {action: timer.wrap(fn) for action, fn in original[1].items()}
+    entry = getattr(module, function_name)
+
+    scenarios = {}
+    try:
+        for scenario in SCENARIOS:
+            samples = []
+            for i in range(args.warmup + args.iterations):
+                if args.cold_maps:
+                    maps_client.geocode_cache.clear()
+                    maps_client.places_cache.clear()
+                agents.clear()
+                timer.seconds = 0.0
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    entry(scenario["question"], use_cache=args.answer_cache, use_router=args.router)
+                elapsed = time.perf_counter() - start
+                if i >= args.warmup:
+                    samples.append({
+                        "seconds": elapsed,
+                        "turns": sum(len(a.turn_stats) for a in agents),
+                        "tool_seconds": timer.seconds,
+                    })
+            scenarios[scenario["name"]] = samples
+    finally:
+        module.Agent, module.known_actions = original
+
+    return {
+        "overall": summarize([s for samples in scenarios.values() for s in samples]),
+        "scenarios": {scenario: summarize(samples) for scenario, samples in scenarios.items()},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def print_results(results):
+    print(f"{'entry point':<26} {'scenario':<22} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'turns':>6} {'tool ms':>8}")
+    for entry, result in results["entries"].items():
+        if "skipped" in result:
+            print(f"{entry:<26} skipped: {result['skipped']}")
+            continue
+        rows = list(result["scenarios"].items()) + [("(all)", result["overall"])]
+        for scenario, s in rows:
+            print(f"{entry:<26} {scenario:<22} {s['p50'] * 1000:>8.1f} {s['p95'] * 1000:>8.1f} "
+                  f"{s['p99'] * 1000:>8.1f} {s['turns_per_query']:>6.2f} {s['tool_seconds_per_query'] * 1000:>8.1f}")
+
+
+def print_comparison(old, new):
+    print(f"\ncompared with {old['meta'].get('commit')} ({old['meta'].get('timestamp')})")
+    print(f"{'entry point':<26} {'scenario':<22} {'p50 delta':>10} {'p95 delta':>10}")
+    for entry, result in new["entries"].items():
+        before = old["entries"].get(entry, {})
+        if "skipped" in result or "skipped" in before or not before:
+            continue
+        rows = list(result["scenarios"].items()) + [("(all)", result["overall"])]
+        for scenario, s in rows:
+            b = before["overall"] if scenario == "(all)" else before["scenarios"].get(scenario)
+            if not b:
+                continue
+            print(f"{entry:<26} {scenario:<22} {(s['p50'] / b['p50'] - 1):>+10.1%} {(s['p95'] / b['p95'] - 1):>+10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--entry", action="append", choices=sorted(ENTRY_POINTS),
+                        help="entry point to run (repeatable); default all")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="seconds per decoded token")
+    parser.add_argument("--prefill-latency", type=float, default=0.02, help="seconds per 1k prompt tokens")
+    parser.add_argument("--maps-latency", type=float, default=0.03, help="seconds per fake Maps request")
+    parser.add_argument("--cold-maps", action="store_true", help="clear the Maps caches before every query")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="let repeated questions hit the answer cache (off by default, so every query runs the loop)")
+    parser.add_argument("--router", action="store_true", help="let the fast-path router answer simple questions")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args()
+
+    # Everything that reads configuration at import time must see the fakes
+    from benchmarks import fake_maps_server
+    from benchmarks.fake_llm import FakeLLM
+    server, fake_maps, base_url = fake_maps_server.start(latency=args.maps_latency)
+    os.environ["MAPS_BASE_URL"] = base_url
+    os.environ.setdefault("AGENT_COFFEE_CACHE", os.path.join(tempfile.mkdtemp(), "bench.sqlite3"))
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    import maps_client
+
+    llm = FakeLLM({s["question"]: s["plan"] for s in SCENARIOS},
+                  token_latency=args.token_latency, prefill_latency_per_1k=args.prefill_latency)
+    results = {
+        "schema": SCHEMA_VERSION,
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args),
+        },
+        "entries": {},
+    }
+    for name in args.entry or ENTRY_POINTS:
+        module_name, function_name = ENTRY_POINTS[name]
+        results["entries"][name] = run_entry(name, module_name, function_name, llm, args, maps_client)
+    results["meta"]["maps_requests"] = dict(fake_maps.requests)
+    server.shutdown()
+
+    print_results(results)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+'''
+Per-query budget: a wall-clock deadline and a tool call cap, plus cancellation.
+The token allowance is the Agent's (stopping.TokenBudget, max_query_tokens);
+react_loop stops a query that spends it like one whose budget ran out, and
+cancels the budget with reason "tokens". Tokens are still counted here for stats().
+
+react_loop.stream_query makes the budget current for the query (a context
+variable, like the trace), so the Agent's decode loop and the HTTP client check
+it without being handed it; tool threads see it through contextvars.copy_context().
+Checks are cheap enough to run once per decoded token.
+
+When the budget runs out or cancel() is called, generation stops at the next
+token, HTTP retries and page-token waits are cut short, and stream_query
+returns the best answer it has so far.
+'''
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+
+current_budget = contextvars.ContextVar("current_budget", default=None)
+
+DEADLINE = float(os.getenv("AGENT_COFFEE_DEADLINE", "120"))
+MAX_TOOL_CALLS = int(os.getenv("AGENT_COFFEE_MAX_TOOL_CALLS", "20"))
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, reason):
+        super().__init__(f"query stopped: {reason}")
+        self.reason = reason
+
+
+class QueryBudget:
+    # deadline is in seconds from now; None leaves that limit off
+    def __init__(self, deadline=DEADLINE, max_tool_calls=MAX_TOOL_CALLS):
+        self.start = time.monotonic()
+        self.deadline = self.start + deadline if deadline is not None else None
+        self.max_tool_calls = max_tool_calls
+        self.tokens = 0
+        self.tool_calls = 0
+        self.reason = None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def cancel(self, reason="cancelled"):
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def remaining(self):
+        # Seconds left before the deadline, or None without one
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def exceeded(self):
+        # Returns why the query must stop ("cancelled", "deadline", "tool_calls", ...), or None
+        if self._cancelled.is_set():
+            return self.reason
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline")
+        return self.reason if self._cancelled.is_set() else None
+
+    def check(self):
+        reason = self.exceeded()
+        if reason is not None:
+            raise BudgetExceeded(reason)
+
+    def spend_tokens(self, tokens):
+        with self._lock:
+            self.tokens += tokens
+
+    def spend_tool_calls(self, calls):
+        # Claims calls tool calls; returns False (and spends nothing) when that
+        # would go over max_tool_calls
+        with self._lock:
+            if self.max_tool_calls is not None and self.tool_calls + calls > self.max_tool_calls:
+                return False
+            self.tool_calls += calls
+            return True
+
+    def timeout(self, timeout):
+        # Shortens an HTTP timeout (a number or a (connect, read) pair) to the time left
+        left = self.remaining()
+        if left is None:
+            return timeout
+        left = max(left, 0.01)
+        if isinstance(timeout, tuple):
+            return tuple(min(t, left) for t in timeout)
+        return min(timeout, left) if timeout is not None else left
+
+    def sleep(self, seconds):
+        # time.sleep that wakes up on cancel and never outlives the deadline
+        left = self.remaining()
+        if left is not None and seconds >= left:
+            self._cancelled.wait(left)
+            self.cancel("deadline")
+            raise BudgetExceeded(self.reason)
+        if self._cancelled.wait(max(seconds, 0.0)):
+            raise BudgetExceeded(self.reason)
+
+    def stats(self):
+        return {
+            "reason": self.reason,
+            "elapsed": time.monotonic() - self.start,
+            "tokens": self.tokens,
+            "tool_calls": self.tool_calls,
+        }
+
+
+def check():
+    # Raises BudgetExceeded when the current query's budget has run out
+    budget = current_budget.get()
+    if budget is not None:
+        budget.check()
+
+
+def exceeded():
+    budget = current_budget.get()
+    return budget.exceeded() if budget is not None else None
+
+
+def remaining():
+    budget = current_budget.get()
+    return budget.remaining() if budget is not None else None
+
+
+def spend_tokens(tokens):
+    budget = current_budget.get()
+    if budget is not None:
+        budget.spend_tokens(tokens)
+
+
+def sleep(seconds):
+    budget = current_budget.get()
+    if budget is None:
+        time.sleep(seconds)
+    else:
+        budget.sleep(seconds)
+
+
+async def asleep(seconds):
+    # asyncio variant; a cancel is noticed when the sleep ends
+    budget = current_budget.get()
+    if budget is None:
+        await asyncio.sleep(seconds)
+        return
+    left = budget.remaining()
+    await asyncio.sleep(seconds if left is None else min(seconds, left))
+    budget.check()
+
+
+def timeout(value):
+    budget = current_budget.get()
+    return value if budget is None else budget.timeout(value)
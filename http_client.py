@@ -0,0 +1,147 @@
+'''
+Shared HTTP layer for the Google Maps tools.
+
+One pooled keep-alive session (requests for sync callers, httpx for asyncio
+callers) with connect/read timeouts and bounded retries. 429 and 5xx responses
+and connection errors are retried with full-jitter exponential backoff,
+honouring Retry-After when the server sends one.
+
+Each call is one span (default "http.get") whose attributes are the URL path,
+the final status and the number of attempts; query parameters, which carry the
+API key, are never recorded.
+
+Calls made for a query with a budget.QueryBudget stop retrying once it runs
+out or is cancelled, and never wait past its deadline.
+
+requests and httpx are imported on first use, so importing the tools (and the
+Streamlit app) does not pay for them up front.
+'''
+
+import asyncio
+import os
+import random
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import budget
+from tracing import span
+
+CONNECT_TIMEOUT = float(os.getenv("AGENT_COFFEE_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("AGENT_COFFEE_READ_TIMEOUT", "10"))
+MAX_RETRIES = int(os.getenv("AGENT_COFFEE_HTTP_RETRIES", "3"))
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 4.0
+POOL_SIZE = 20
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class HTTPError(Exception):
+    pass
+
+
+def backoff_delay(attempt, retry_after=None):
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), BACKOFF_CAP)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def get_json(url, params=None, timeout=None, retries=MAX_RETRIES, name="http.get"):
+    import requests
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    attempt = 0
+    with span(name, path=urlsplit(url).path) as attrs:
+        while True:
+            attrs["attempts"] = attempt + 1
+            budget.check()
+            try:
+                response = session().get(url, params=params, timeout=budget.timeout(timeout))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                attrs["status"] = type(e).__name__
+                if attempt >= retries:
+                    raise HTTPError(f"GET {url} failed after {attempt + 1} attempts: {e}") from e
+                budget.sleep(backoff_delay(attempt))
+            else:
+                attrs["status"] = response.status_code
+                if response.status_code not in RETRY_STATUS:
+                    if response.status_code >= 400:
+                        raise HTTPError(f"GET {url} returned {response.status_code}")
+                    return response.json()
+                if attempt >= retries:
+                    raise HTTPError(f"GET {url} returned {response.status_code} after {attempt + 1} attempts")
+                budget.sleep(backoff_delay(attempt, response.headers.get("Retry-After")))
+            attempt += 1
+
+
+# httpx.AsyncClient is bound to the event loop it was first used on
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def async_client():
+    import httpx
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def async_timeout(timeout):
+    import httpx
+    if timeout is None and budget.current_budget.get() is None:
+        return httpx.USE_CLIENT_DEFAULT
+    timeout = budget.timeout(timeout or (CONNECT_TIMEOUT, READ_TIMEOUT))
+    if isinstance(timeout, tuple):
+        return httpx.Timeout(timeout[1], connect=timeout[0])
+    return timeout
+
+
+async def aget_json(url, params=None, timeout=None, retries=MAX_RETRIES, name="http.get"):
+    import httpx
+    attempt = 0
+    with span(name, path=urlsplit(url).path) as attrs:
+        while True:
+            attrs["attempts"] = attempt + 1
+            budget.check()
+            try:
+                response = await async_client().get(url, params=params, timeout=async_timeout(timeout))
+            except (httpx.ConnectError, httpx.TimeoutException) as e:
+                attrs["status"] = type(e).__name__
+                if attempt >= retries:
+                    raise HTTPError(f"GET {url} failed after {attempt + 1} attempts: {e}") from e
+                await budget.asleep(backoff_delay(attempt))
+            else:
+                attrs["status"] = response.status_code
+                if response.status_code not in RETRY_STATUS:
+                    if response.status_code >= 400:
+                        raise HTTPError(f"GET {url} returned {response.status_code}")
+                    return response.json()
+                if attempt >= retries:
+                    raise HTTPError(f"GET {url} returned {response.status_code} after {attempt + 1} attempts")
+                await budget.asleep(backoff_delay(attempt, response.headers.get("Retry-After")))
+            attempt += 1
@@ -0,0 +1,236 @@
+'''
+Google Maps geocode and nearby-search lookups used by the coffee_location action.
+
+Geocodes barely change and are cached for a long time; nearby-search results are
+cached briefly. Both caches are keyed by the normalized city string (plus the
+radius for place lists) and shared by every session in the process and on disk.
+HTTP goes through the pooled client in http_client; set MAPS_BASE_URL to point
+the lookups at a local fake server.
+
+iter_nearby_coffee_shops follows next_page_token: it yields the shops of each
+page as soon as the page is parsed while the next page is fetched in the
+background. Google rejects a fresh token for about two seconds, so the prefetch
+waits out PAGE_TOKEN_DELAY (retrying INVALID_REQUEST) while the caller is busy
+with the current page. Callers cap the total with max_results.
+'''
+
+import asyncio
+import contextvars
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import budget
+from budget import BudgetExceeded
+from http_client import get_json, aget_json, HTTPError
+from ttl_cache import TTLCache
+
+MAPS_BASE_URL = os.getenv("MAPS_BASE_URL", "https://maps.googleapis.com").rstrip("/")
+GEOCODE_URL = MAPS_BASE_URL + '/maps/api/geocode/json'
+NEARBY_URL = MAPS_BASE_URL + '/maps/api/place/nearbysearch/json'
+
+geocode_cache = TTLCache("geocode", ttl=30 * 24 * 3600, max_entries=10000)
+places_cache = TTLCache("places", ttl=15 * 60, max_entries=1000)
+
+# Google serves at most three pages of 20. The default cap is the first page:
+# each later page waits PAGE_TOKEN_DELAY for its token, so paging is opt-in
+# (a larger max_results or AGENT_COFFEE_MAX_SHOPS, up to 60)
+MAX_PAGES = 3
+MAX_SHOPS = int(os.getenv("AGENT_COFFEE_MAX_SHOPS", "20"))
+PAGE_TOKEN_DELAY = float(os.getenv("AGENT_COFFEE_PAGE_TOKEN_DELAY", "2.0"))
+PAGE_TOKEN_RETRIES = 5
+PAGE_TOKEN_RETRY_DELAY = 0.5
+
+# Page prefetches mostly sleep, so they get their own threads rather than the tool pool's
+_page_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="maps-page")
+
+
+def api_key():
+    return os.getenv("GOOGLE_MAPS_API_KEY")
+
+
+def normalize_city(city):
+    city = re.sub(r'\s*,\s*', ', ', city.strip().lower())
+    return re.sub(r'\s+', ' ', city).strip(' .')
+
+
+def _cacheable(data):
+    # Only cache answers Google actually gave, not quota or key errors
+    return data.get('status') in ('OK', 'ZERO_RESULTS')
+
+
+def _geocode_params(city):
+    return {'address': city, 'key': api_key()}
+
+
+def _nearby_params(location, radius):
+    return {
+        'key': api_key(),
+        'location': f'{location[0]},{location[1]}',
+        'radius': radius,
+        'keyword': 'coffee shop',
+        'type': 'cafe'
+    }
+
+
+def _page_params(token):
+    return {'key': api_key(), 'pagetoken': token}
+
+
+def _stamped(data):
+    # Remember when the page (and so its next_page_token) was issued
+    data['fetched_at'] = time.time()
+    return data
+
+
+def _location(data):
+    if not data.get('results'):
+        return None
+    location = data['results'][0]['geometry']['location']
+    return location['lat'], location['lng']
+
+
+def geocode(city):
+    # Returns (lat, lng) for a city, or None if Google could not geocode it
+    data = geocode_cache.get_or_compute(
+        normalize_city(city), lambda: get_json(GEOCODE_URL, _geocode_params(city), name="http.geocode"), _cacheable)
+    return _location(data)
+
+
+async def ageocode(city):
+    data = await geocode_cache.aget_or_compute(
+        normalize_city(city), lambda: aget_json(GEOCODE_URL, _geocode_params(city), name="http.geocode"), _cacheable)
+    return _location(data)
+
+
+async def _afirst_page(location, radius):
+    return _stamped(await aget_json(NEARBY_URL, _nearby_params(location, radius), name="http.nearbysearch"))
+
+
+def coffee_shops(places, coordinates=False):
+    shops = []
+    for place in places:
+        shop = {'name': place.get('name'), 'address': place.get('vicinity')}
+        if coordinates:
+            location = place['geometry']['location']
+            shop['latitude'] = location['lat']
+            shop['longitude'] = location['lng']
+        shops.append(shop)
+    return shops
+
+
+def _fetch_page(token, issued_at):
+    # A next_page_token answers INVALID_REQUEST until Google has the page ready
+    budget.sleep(max(0.0, (issued_at or 0) + PAGE_TOKEN_DELAY - time.time()))
+    for attempt in range(PAGE_TOKEN_RETRIES):
+        data = get_json(NEARBY_URL, _page_params(token), name="http.nearbysearch")
+        if data.get('status') != 'INVALID_REQUEST':
+            return _stamped(data)
+        budget.sleep(PAGE_TOKEN_RETRY_DELAY)
+    return data
+
+
+async def _afetch_page(token, issued_at):
+    await budget.asleep(max(0.0, (issued_at or 0) + PAGE_TOKEN_DELAY - time.time()))
+    for attempt in range(PAGE_TOKEN_RETRIES):
+        data = await aget_json(NEARBY_URL, _page_params(token), name="http.nearbysearch")
+        if data.get('status') != 'INVALID_REQUEST':
+            return _stamped(data)
+        await budget.asleep(PAGE_TOKEN_RETRY_DELAY)
+    return data
+
+
+def _prefetch(key, data, page, max_results, count):
+    # Starts fetching the page after data when there is one and the caller may want it
+    token = data.get('next_page_token')
+    if not token or page >= MAX_PAGES or (max_results is not None and count >= max_results):
+        return None
+    page_key = f"{key}|{page + 1}"
+    fetch = lambda: places_cache.get_or_compute(
+        page_key, lambda: _fetch_page(token, data.get('fetched_at')), _cacheable)
+    return _page_pool.submit(contextvars.copy_context().run, fetch)
+
+
+def iter_nearby_coffee_shops(city, radius=1000, max_results=MAX_SHOPS, coordinates=False):
+    # Yields coffee shops near a city page by page, at most max_results (None for
+    # every page); reports and yields nothing if the city could not be geocoded
+    location = geocode(city)
+    if location is None:
+        print(f"Could not geocode city: {city}")
+        return
+    key = f"{normalize_city(city)}|{radius}"
+    data = places_cache.get_or_compute(
+        key, lambda: _stamped(get_json(NEARBY_URL, _nearby_params(location, radius), name="http.nearbysearch")),
+        _cacheable)
+    count = 0
+    page = 1
+    future = None
+    try:
+        while True:
+            results = data.get('results', [])
+            future = _prefetch(key, data, page, max_results, count + len(results))
+            for shop in coffee_shops(results, coordinates):
+                if max_results is not None and count >= max_results:
+                    return
+                yield shop
+                count += 1
+            if future is None:
+                return
+            try:
+                data = future.result()
+            except (HTTPError, BudgetExceeded) as e:
+                # Keep what the earlier pages returned
+                print(f"Stopped paging nearby coffee shops for {city}: {e}")
+                return
+            future = None
+            page += 1
+    finally:
+        if future is not None:
+            future.cancel()
+
+
+async def aiter_nearby_coffee_shops(city, radius=1000, max_results=MAX_SHOPS, coordinates=False):
+    # asyncio variant of iter_nearby_coffee_shops; the next page is a background task
+    location = await ageocode(city)
+    if location is None:
+        print(f"Could not geocode city: {city}")
+        return
+    key = f"{normalize_city(city)}|{radius}"
+    data = await places_cache.aget_or_compute(key, lambda: _afirst_page(location, radius), _cacheable)
+    count = 0
+    page = 1
+    task = None
+    try:
+        while True:
+            results = data.get('results', [])
+            token = data.get('next_page_token')
+            if token and page < MAX_PAGES and (max_results is None or count + len(results) < max_results):
+                fetch = lambda token=token, issued_at=data.get('fetched_at'): _afetch_page(token, issued_at)
+                task = asyncio.ensure_future(places_cache.aget_or_compute(f"{key}|{page + 1}", fetch, _cacheable))
+            for shop in coffee_shops(results, coordinates):
+                if max_results is not None and count >= max_results:
+                    return
+                yield shop
+                count += 1
+            if task is None:
+                return
+            try:
+                data = await task
+            except (HTTPError, BudgetExceeded) as e:
+                print(f"Stopped paging nearby coffee shops for {city}: {e}")
+                return
+            task = None
+            page += 1
+    finally:
+        if task is not None:
+            task.cancel()
+
+
+async def afind_nearby_coffee_shops(city, radius=1000, coordinates=False, max_results=MAX_SHOPS):
+    # asyncio variant of the coffee_location tool
+    return [shop async for shop in aiter_nearby_coffee_shops(city, radius, max_results, coordinates)]
+
+
+def cache_stats():
+    return [geocode_cache.stats(), places_cache.stats()]
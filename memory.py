@@ -0,0 +1,106 @@
+'''
+Bounded conversation memory for Agent.
+
+Agent.messages keeps the full history; ConversationMemory.view returns what is
+actually sent to the model. The system prompt and the original question are
+pinned and the last keep_last exchanges stay verbatim. When the view grows past
+max_tokens, the oldest exchanges are collapsed into short summaries (Thought
+lines dropped, Observations cut to their first line) and, if that is not
+enough, dropped.
+Compaction works in steps down to a low-water mark, so the prefix the model
+sees (and its KV cache) stays the same between compactions.
+
+Hooks are called with a dict describing each compaction, so its effect on
+latency and answer quality can be measured.
+'''
+
+from observation_format import approx_tokens
+
+
+def summarize(message, width=120):
+    content = message["content"]
+    if message["role"] == "assistant":
+        kept = [line for line in content.split("\n") if line.startswith(("Action:", "Answer:"))]
+        content = "\n".join(kept) if kept else content
+    elif content.startswith("Observation:"):
+        first = content.split("\n", 2)
+        content = " ".join(first[:2]) if first[0].strip() == "Observation:" else first[0]
+    if len(content) > width:
+        content = content[:width].rstrip() + " ..."
+    # Keeps tool_calls / tool_call_id, which pair native tool results with their calls
+    return dict(message, content=content)
+
+
+class ConversationMemory:
+    def __init__(self, max_tokens=3000, keep_last=2, low_water=0.75, pin_question=True, count_tokens=approx_tokens):
+        self.max_tokens = max_tokens
+        self.pin_question = pin_question
+        self.keep_last = keep_last
+        self.low_water = low_water
+        self.count_tokens = count_tokens
+        self.hooks = []
+        self.summarized = 0  # leading history messages shown as summaries
+        self.dropped = 0     # leading history messages left out entirely
+        self.compactions = 0
+
+    def tokens(self, messages):
+        return sum(self.count_tokens(m["content"]) for m in messages)
+
+    def _exchange_starts(self, history):
+        # With native tool calling an exchange starts at the assistant turn that made the calls
+        return [i for i, m in enumerate(history) if m["role"] == "user" or m.get("tool_calls")]
+
+    def _render(self, pinned, history):
+        summaries = [summarize(m) for m in history[self.dropped:self.summarized]]
+        return pinned + summaries + history[max(self.summarized, self.dropped):]
+
+    def view(self, messages):
+        pinned = [m for m in messages[:1] if m["role"] == "system"]
+        if self.pin_question and len(messages) > len(pinned) and messages[len(pinned)]["role"] == "user":
+            pinned.append(messages[len(pinned)])
+        history = messages[len(pinned):]
+        if self.summarized > len(history):
+            # History was edited or replaced; start over
+            self.summarized = self.dropped = 0
+
+        result = self._render(pinned, history)
+        before = self.tokens(result)
+        if self.max_tokens is None or before <= self.max_tokens:
+            return result
+
+        # Messages before the last keep_last exchanges may be compacted
+        starts = self._exchange_starts(history)
+        protected = starts[-self.keep_last] if len(starts) >= self.keep_last > 0 else len(history)
+        boundaries = [i for i in starts + [protected] if 0 < i <= protected]
+        target = self.max_tokens * self.low_water
+
+        for boundary in boundaries:
+            if self.tokens(result) <= target:
+                break
+            self.summarized = max(self.summarized, boundary)
+            result = self._render(pinned, history)
+        for boundary in boundaries:
+            if self.tokens(result) <= target:
+                break
+            self.dropped = max(self.dropped, boundary)
+            self.summarized = max(self.summarized, self.dropped)
+            result = self._render(pinned, history)
+
+        self.compactions += 1
+        event = {
+            "before_tokens": before,
+            "after_tokens": self.tokens(result),
+            "summarized": self.summarized - self.dropped,
+            "dropped": self.dropped,
+            "kept": len(history) - self.summarized,
+        }
+        for hook in self.hooks:
+            hook(event)
+        return result
+
+    def stats(self):
+        return {
+            "compactions": self.compactions,
+            "summarized": self.summarized - self.dropped,
+            "dropped": self.dropped,
+        }
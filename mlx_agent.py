@@ -0,0 +1,113 @@
+import os
+import time
+from contextlib import closing
+
+import budget as query_budget
+from backends import make_backend
+from memory import ConversationMemory
+from stopping import DEFAULT_STOP, StopMatcher, TokenBudget, turn_report
+from tracing import record
+
+
+class Agent:
+    def __init__(self, system="", model_id=None, warmup=False, prompt_cache=True,
+                 max_tokens=256, max_query_tokens=None, stop=DEFAULT_STOP, memory=None, backend=None,
+                 kv_snapshot=None):
+        # backend is a name from backends.BACKENDS or "auto"; None reads AGENT_COFFEE_BACKEND.
+        # Either way the Agent borrows the process-wide model instead of loading weights
+        self.backend = make_backend(backend, model_id, warmup=warmup, prompt_cache=prompt_cache)
+        self.handle = self.backend.handle
+        self.model, self.tokenizer = self.handle.model, self.handle.tokenizer
+        self.system = system
+        self.stop = stop
+        self.budget = TokenBudget(max_tokens, max_query_tokens)
+        self.prompt_cache = self.backend.prompt_cache
+        self.memory = memory if memory is not None else ConversationMemory()
+        self.turn_stats = []
+        self.messages = []
+        if self.system:
+            self.messages.append({"role": "system", "content": system})
+        # Start from the saved KV state of the system prompt instead of prefilling it
+        # again; AGENT_COFFEE_KV_SNAPSHOT=0 turns this off
+        if kv_snapshot is None:
+            kv_snapshot = os.getenv("AGENT_COFFEE_KV_SNAPSHOT", "1") != "0"
+        self.snapshot = self.backend.seed(self.system_prefix()) if self.system and kv_snapshot else None
+
+    def __call__(self, message):
+        return "".join(self.stream(message)).strip()
+
+    def stream(self, message):
+        # Yields text chunks as they are decoded; the finished turn is added to messages
+        self.messages.append({"role": "user", "content": message})
+        chunks = []
+        for chunk in self.stream_execute():
+            chunks.append(chunk)
+            yield chunk
+        self.messages.append({"role": "assistant", "content": "".join(chunks).strip()})
+
+    def system_prefix(self):
+        return f"System: {self.system}\n\n" if self.system else ""
+
+    def build_prompt(self):
+        parts = [self.system_prefix()]
+        for msg in self.memory.view(self.messages):
+            if msg["role"] == "user":
+                parts.append(f"User: {msg['content']}\n")
+            elif msg["role"] == "assistant":
+                parts.append(f"Assistant: {msg['content']}\n")
+        parts.append("Assistant: ")
+        return "".join(parts)
+
+    def execute(self):
+        return "".join(self.stream_execute()).strip()
+
+    def stream_execute(self):
+        limit = self.budget.turn_limit()
+        if limit == 0:
+            return
+        prompt_tokens = self.backend.encode(self.build_prompt())
+        matcher = StopMatcher(self.stop)
+        stop_reason = "length"
+        start = time.perf_counter()
+        ttft = None
+        turn = self.backend.generate(prompt_tokens, limit)
+        # Closing the turn releases the model and records what the KV cache holds
+        with closing(turn):
+            for text, finish_reason in turn:
+                # A cancelled or timed-out query stops decoding at the next token
+                stopped = query_budget.exceeded()
+                if stopped is not None:
+                    stop_reason = stopped
+                    break
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                if finish_reason == "stop":
+                    stop_reason = "eos"
+                text = matcher.feed(text)
+                if text:
+                    yield text
+                if matcher.stopped:
+                    # Stop decoding instead of letting the model write its own Observation
+                    stop_reason = "stop_sequence"
+                    break
+            else:
+                text = matcher.flush()
+                if text:
+                    yield text
+
+        generated = self.backend.generated
+        self.budget.spend(generated)
+        query_budget.spend_tokens(generated)
+        stats = turn_report(limit, generated, stop_reason)
+        stats.update({
+            "backend": self.backend.name,
+            "prompt_tokens": len(prompt_tokens),
+            "prefilled_tokens": self.backend.prefilled,
+            "ttft": ttft,
+            "total": time.perf_counter() - start,
+        })
+        self.turn_stats.append(stats)
+        if ttft is not None:
+            record("llm.prefill", ttft, prompt_tokens=len(prompt_tokens), prefilled_tokens=self.backend.prefilled)
+            record("llm.decode", stats["total"] - ttft, generated_tokens=generated,
+                   stop_reason=stop_reason)
@@ -0,0 +1,197 @@
+'''
+Process-wide registry of loaded models.
+
+Each model/tokenizer pair is loaded once per process and handed out to every
+Agent that asks for it, so Streamlit sessions and CLI queries share the weights
+instead of reloading them on every question. BackgroundLoader runs a load on a
+daemon thread so an app can start serving before the weights are in memory.
+'''
+
+import resource
+import sys
+import threading
+import time
+
+from tracing import span
+
+DEFAULT_MODEL = "mlx-community/Mistral-Nemo-Instruct-2407-4bit"
+
+
+def load_mlx(model_id):
+    from mlx_lm import load
+    return load(model_id)
+
+
+def warmup_mlx(model, tokenizer):
+    from mlx_lm import generate
+    generate(model, tokenizer, prompt="Hello", max_tokens=1, verbose=False)
+
+
+def mlx_memory():
+    # Returns (active, peak) bytes held by MLX, or None when MLX is unavailable
+    try:
+        import mlx.core as mx
+    except ImportError:
+        return None
+    get_active = getattr(mx, "get_active_memory", None) or mx.metal.get_active_memory
+    get_peak = getattr(mx, "get_peak_memory", None) or mx.metal.get_peak_memory
+    return get_active(), get_peak()
+
+
+def peak_rss():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+class ModelHandle:
+    def __init__(self, model_id, model, tokenizer, load_seconds, memory_bytes):
+        self.model_id = model_id
+        self.model = model
+        self.tokenizer = tokenizer
+        self.load_seconds = load_seconds
+        self.memory_bytes = memory_bytes
+        self.warmed = False
+        self.borrows = 0
+        # A loaded model is shared by every session, so generation on it is serialized
+        self.lock = threading.RLock()
+
+
+class ModelRegistry:
+    def __init__(self, loader=load_mlx, warmer=warmup_mlx, memory=mlx_memory):
+        self._loader = loader
+        self._warmer = warmer
+        self._memory = memory
+        self._handles = {}
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_id=DEFAULT_MODEL, warmup=False):
+        with self._lock:
+            handle = self._handles.get(model_id)
+            if handle is None:
+                load_lock = self._load_locks.setdefault(model_id, threading.Lock())
+        if handle is None:
+            # Only one thread loads a given model; the others wait and reuse its result
+            with load_lock:
+                with self._lock:
+                    handle = self._handles.get(model_id)
+                if handle is None:
+                    handle = self._load(model_id)
+                    with self._lock:
+                        self._handles[model_id] = handle
+        if warmup:
+            self.warmup(handle)
+        with self._lock:
+            handle.borrows += 1
+        return handle
+
+    def _load(self, model_id):
+        before = self._memory() if self._memory else None
+        start = time.perf_counter()
+        with span("model.load", model_id=model_id):
+            model, tokenizer = self._loader(model_id)
+        load_seconds = time.perf_counter() - start
+        after = self._memory() if self._memory else None
+        memory_bytes = after[0] - before[0] if before and after else None
+        return ModelHandle(model_id, model, tokenizer, load_seconds, memory_bytes)
+
+    def warmup(self, handle):
+        if handle.warmed or self._warmer is None:
+            return
+        with handle.lock:
+            if not handle.warmed:
+                self._warmer(handle.model, handle.tokenizer)
+                handle.warmed = True
+
+    def is_loaded(self, model_id=DEFAULT_MODEL):
+        with self._lock:
+            return model_id in self._handles
+
+    def unload(self, model_id):
+        with self._lock:
+            self._handles.pop(model_id, None)
+            self._load_locks.pop(model_id, None)
+
+    def stats(self):
+        with self._lock:
+            handles = list(self._handles.values())
+        # Nothing to measure before the first load, and mlx_memory would import MLX
+        memory = self._memory() if self._memory and handles else None
+        return {
+            "models": [
+                {
+                    "model_id": h.model_id,
+                    "load_seconds": round(h.load_seconds, 3),
+                    "memory_bytes": h.memory_bytes,
+                    "warmed": h.warmed,
+                    "borrows": h.borrows,
+                }
+                for h in handles
+            ],
+            "active_memory_bytes": memory[0] if memory else None,
+            "peak_memory_bytes": memory[1] if memory else None,
+            "peak_rss_bytes": peak_rss(),
+        }
+
+
+class BackgroundLoader:
+    # Runs load() once on a daemon thread; callers poll status() or wait()
+    def __init__(self, load, name="model"):
+        self._load = load
+        self.name = name
+        self.result = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self.started_at = time.perf_counter()
+                self._thread = threading.Thread(target=self._run, name=f"load-{self.name}", daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            with span("model.background_load", loader=self.name):
+                self.result = self._load()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished_at = time.perf_counter()
+            self._done.set()
+
+    @property
+    def ready(self):
+        return self._done.is_set() and self.error is None
+
+    def wait(self, timeout=None):
+        # Returns the load result; raises the load error, or TimeoutError if still loading
+        self.start()
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.name} is still loading")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def status(self):
+        if self.started_at is None:
+            return {"state": "idle", "seconds": 0.0, "error": None}
+        end = self.finished_at if self._done.is_set() else time.perf_counter()
+        if not self._done.is_set():
+            state = "loading"
+        else:
+            state = "failed" if self.error is not None else "ready"
+        return {
+            "state": state,
+            "seconds": end - self.started_at,
+            "error": f"{type(self.error).__name__}: {self.error}" if self.error is not None else None,
+        }
+
+
+registry = ModelRegistry()
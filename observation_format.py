@@ -0,0 +1,68 @@
+'''
+Formatting of tool results for the Observation message.
+
+The repr of a list of shop dicts repeats 'name':/'address': for every entry and
+is re-sent on every later turn. CompactFormatter writes one line per item with
+only the selected fields, keeps the top_k items, and trims the text to a token
+ceiling. Formatters are plain callables value -> str, so any function can be
+plugged into the loop instead.
+'''
+
+import math
+
+
+def approx_tokens(text):
+    # Roughly four characters per token for English text
+    return math.ceil(len(text) / 4)
+
+
+def repr_formatter(value):
+    return str(value)
+
+
+class CompactFormatter:
+    def __init__(self, top_k=8, fields=("name", "address"), max_tokens=200, count_tokens=approx_tokens):
+        self.top_k = top_k
+        self.fields = fields
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+
+    def __call__(self, value):
+        if isinstance(value, (list, tuple)):
+            if not value:
+                return "none"
+            if all(isinstance(item, dict) for item in value):
+                lines = [self.row(item) for item in value]
+            else:
+                lines = [", ".join(str(item) for item in value)]
+                return self.fit(lines, 0)
+            return self.fit(lines[:self.top_k], len(lines) - min(len(lines), self.top_k))
+        return self.fit([str(value)], 0)
+
+    def row(self, item):
+        fields = self.fields or list(item)
+        return " | ".join(str(item[f]) for f in fields if item.get(f) is not None)
+
+    def fit(self, lines, omitted):
+        # Drop trailing lines until the text fits the ceiling, then shorten the last one
+        while True:
+            text = "\n".join(lines)
+            if omitted:
+                text += f"\n(+{omitted} more)"
+            if self.max_tokens is None or self.count_tokens(text) <= self.max_tokens:
+                return text
+            if len(lines) > 1:
+                lines = lines[:-1]
+                omitted += 1
+            elif lines[0]:
+                lines = [lines[0][:len(lines[0]) * 9 // 10]]
+            else:
+                return text
+
+
+formatters = {
+    "repr": repr_formatter,
+    "compact": CompactFormatter(),
+}
+
+default_formatter = formatters["compact"]
@@ -0,0 +1,196 @@
+'''
+Per-conversation KV cache reuse for the MLX Agent.
+
+The cache remembers which tokens it already holds. Each turn only the part of
+the new prompt that differs from those tokens is prefilled; if the history was
+edited, the cache is trimmed back to the last token both prompts agree on (or
+rebuilt when the cache type cannot be trimmed).
+
+The KV state for the fixed system prompt is computed once and saved under
+AGENT_COFFEE_KV_DIR, in a versioned file named after a hash of the model id, the
+tokenizer and the prompt tokens. Later processes load that snapshot (mx.load
+reads the safetensors file lazily) instead of prefilling the system prompt
+again; within a process it is loaded once and every Agent seeds its cache with
+its own copy.
+'''
+
+import contextlib
+import copy
+import hashlib
+import json
+import os
+import threading
+
+# mlx_lm is imported when a cache is first used, so importing this module (and
+# mlx_agent) works on machines without MLX, e.g. with an offline fake backend
+
+
+def make_prompt_cache(model):
+    from mlx_lm.models.cache import make_prompt_cache
+    return make_prompt_cache(model)
+
+
+def can_trim_prompt_cache(cache):
+    from mlx_lm.models.cache import can_trim_prompt_cache
+    return can_trim_prompt_cache(cache)
+
+
+def trim_prompt_cache(cache, n):
+    from mlx_lm.models.cache import trim_prompt_cache
+    return trim_prompt_cache(cache, n)
+
+
+def save_prompt_cache(path, cache, metadata):
+    from mlx_lm.models.cache import save_prompt_cache
+    save_prompt_cache(path, cache, metadata)
+
+
+def load_prompt_cache(path):
+    from mlx_lm.models.cache import load_prompt_cache
+    return load_prompt_cache(path, return_metadata=True)
+
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DIR = os.getenv("AGENT_COFFEE_KV_DIR",
+                         os.path.join(os.path.expanduser("~"), ".cache", "agent_coffee", "kv"))
+
+
+def tokenizer_id(tokenizer):
+    # Enough to tell tokenizers apart; the prompt tokens are hashed as well
+    inner = getattr(tokenizer, "_tokenizer", tokenizer)
+    return f"{getattr(inner, 'name_or_path', type(inner).__name__)}:{getattr(inner, 'vocab_size', '')}"
+
+
+def snapshot_path(backend, model_id, tokenizer, tokens, suffix):
+    digest = hashlib.sha256(json.dumps(
+        [SNAPSHOT_VERSION, backend, model_id, tokenizer, list(map(int, tokens))]).encode()).hexdigest()
+    return os.path.join(SNAPSHOT_DIR, f"{backend}-v{SNAPSHOT_VERSION}-{digest[:32]}{suffix}")
+
+
+def write_atomic(path, write):
+    # Concurrent starts may build the same snapshot; each writes its own temp file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    root, ext = os.path.splitext(path)
+    tmp = f"{root}.{os.getpid()}.tmp{ext}"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def prefill(model, cache, tokens, step=512):
+    import mlx.core as mx
+    for i in range(0, len(tokens), step):
+        model(mx.array(tokens[i:i + step])[None], cache=cache)
+        mx.eval([c.state for c in cache])
+
+
+def copy_prompt_cache(cache):
+    # KV caches write into their arrays in place (e.g. after a trim), so each copy
+    # gets its own array objects and filling it never changes the original
+    import mlx.core as mx
+
+    copies = []
+    for layer in cache:
+        duplicate = copy.copy(layer)
+        duplicate.state = tuple(mx.array(a) for a in layer.state)
+        copies.append(duplicate)
+    return copies
+
+
+# Snapshot path (it hashes the model and the prompt tokens) -> loaded cache
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def _load_snapshot(path, tokens):
+    # The snapshot saved at path, or None if it is missing, partial or stale
+    if not os.path.exists(path):
+        return None
+    try:
+        cache, metadata = load_prompt_cache(path)
+    except Exception:
+        return None
+    return cache if metadata.get("tokens") == str(len(tokens)) else None
+
+
+def _memory_snapshot(path):
+    with _snapshots_lock:
+        return _snapshots.get(path)
+
+
+def system_snapshot(model, model_id, tokenizer, tokens, lock=None):
+    # Returns (cache holding tokens, "memory", "disk" or "computed"); the cache
+    # is the caller's own copy of the snapshot. lock, the model's, is only held
+    # to prefill a snapshot that is neither in memory nor on disk
+    path = snapshot_path("mlx", model_id, tokenizer_id(tokenizer), tokens, ".safetensors")
+    snapshot, source = _memory_snapshot(path), "memory"
+    if snapshot is None:
+        snapshot, source = _load_snapshot(path, tokens), "disk"
+    if snapshot is None:
+        with lock or contextlib.nullcontext():
+            # Another Agent may have computed it while this one waited for the model
+            snapshot, source = _memory_snapshot(path), "memory"
+            if snapshot is None:
+                snapshot, source = make_prompt_cache(model), "computed"
+                prefill(model, snapshot, tokens)
+                metadata = {"version": str(SNAPSHOT_VERSION), "model_id": model_id, "tokens": str(len(tokens))}
+                write_atomic(path, lambda tmp: save_prompt_cache(tmp, snapshot, metadata))
+    with _snapshots_lock:
+        snapshot = _snapshots.setdefault(path, snapshot)
+    return copy_prompt_cache(snapshot), source
+
+
+class PromptCache:
+    def __init__(self, model):
+        self.model = model
+        self.cache = None
+        self.tokens = []
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+
+    def offset(self):
+        return self.cache[0].offset if self.cache else 0
+
+    def invalidate(self):
+        self.cache = make_prompt_cache(self.model)
+        self.tokens = []
+
+    def seed(self, cache, tokens):
+        # Starts from a cache that already holds tokens, e.g. a system_snapshot
+        self.cache = cache
+        self.tokens = list(tokens)
+
+    def prepare(self, prompt_tokens):
+        # Returns the suffix of prompt_tokens that still has to be prefilled
+        if self.cache is None:
+            self.invalidate()
+        # generate needs at least one new token, so never reuse the whole prompt
+        limit = min(len(self.tokens), len(prompt_tokens) - 1)
+        common = 0
+        while common < limit and self.tokens[common] == prompt_tokens[common]:
+            common += 1
+
+        stale = self.offset() - common
+        if stale > 0:
+            if can_trim_prompt_cache(self.cache):
+                trim_prompt_cache(self.cache, stale)
+            else:
+                self.invalidate()
+                common = 0
+        self.tokens = list(prompt_tokens[:common])
+
+        self.reused_tokens += common
+        self.prefilled_tokens += len(prompt_tokens) - common
+        return prompt_tokens[common:]
+
+    def commit(self, prompt_tokens, generated_tokens):
+        # Record what the cache holds after generation; the final sampled token
+        # may or may not have been fed back through the model
+        tokens = list(prompt_tokens) + list(generated_tokens)
+        offset = self.offset()
+        if offset > len(tokens):
+            if not can_trim_prompt_cache(self.cache):
+                self.invalidate()
+                return
+            trim_prompt_cache(self.cache, offset - len(tokens))
+            offset = len(tokens)
+        self.tokens = tokens[:offset]
@@ -0,0 +1,444 @@
+'''
+The Thought/Action/PAUSE/Observation loop shared by the Streamlit app and the CLIs.
+
+stream_query yields (kind, payload) events as they happen:
+
+    ("token", text)                  a chunk of model output
+    ("turn", result)                 the full text of a finished model turn
+    ("action", (name, input))        an action about to run
+    ("observation", text)            the Observation message fed back to the model
+    ("trace", trace)                 the query's spans and timings (tracing.Trace.to_dict)
+    ("cached", entry)                the answer came from the answer cache; no model turns ran
+    ("routed", (name, input))        the router answered with one tool call; no model turns ran
+    ("speculation", report)          tools started while the turn decoded: used, discarded, saved seconds
+    ("budget", stats)                the query budget ran out or was cancelled (budget.QueryBudget.stats)
+    ("answer", result)               the final turn; always the last event
+
+Given an answer_cache.AnswerCache, stream_query answers repeated questions from
+it and stores finished answers; answers=None bypasses it. Given a
+router.Router, simple questions skip the model and everything else falls
+through to the loop; router=None bypasses it. Building the bot can mean loading
+a model, so pass a LazyBot to build it only for questions that reach the loop.
+
+Given a budget.QueryBudget, the loop stops once its deadline or tool call
+allowance runs out or it is cancelled: generation stops at the next token,
+pending tool calls are abandoned and the answer is the best one so far (the
+last turn if it answered, else what the tools returned). The bot's token
+allowance (stopping.TokenBudget) ends the query the same way, as "tokens".
+
+Actions normally come from "Action: name: input" lines in the turn text. A bot
+with native tool calling instead lists the turn's calls in bot.tool_calls
+({"name", "input"} dicts) and takes their results through
+bot.add_tool_results(); the next turn is then bot.stream(None).
+
+astream_query is the asyncio twin for bots with astream(): tools with an async
+variant are awaited and the rest run on worker threads. It has no answer cache,
+router or speculation.
+'''
+
+import asyncio
+import contextvars
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import closing
+
+from budget import BudgetExceeded, current_budget
+from observation_format import default_formatter
+from tracing import finish_trace, record, span, start_trace
+
+action_re = re.compile(r'^Action: (\w+): (.*)$')
+
+# Shared by every session; tool calls are I/O bound
+tool_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tool")
+
+# How often a query waiting on tools notices that it was cancelled
+POLL_INTERVAL = 0.05
+
+
+def parse_actions(result):
+    return [
+        action_re.match(a)
+        for a in result.split('\n')
+        if action_re.match(a)
+    ]
+
+
+def call_tool(name, fn, action_input):
+    with span(f"tool.{name}", input=action_input):
+        return fn(action_input)
+
+
+def submit_tool(name, fn, action_input):
+    # Runs the tool on the pool inside a copy of the caller's context, so its
+    # spans (and the HTTP spans under it) land in the caller's trace
+    context = contextvars.copy_context()
+    return tool_pool.submit(context.run, call_tool, name, fn, action_input)
+
+
+def collect(futures, budget=None):
+    # Returns the futures' results in order; with a budget, raises BudgetExceeded
+    # (cancelling calls that have not started) as soon as it runs out
+    if budget is not None:
+        pending = set(futures)
+        while True:
+            _, pending = wait(pending, timeout=POLL_INTERVAL)
+            if not pending:
+                break
+            reason = budget.exceeded()
+            if reason is not None:
+                for future in futures:
+                    future.cancel()
+                raise BudgetExceeded(reason)
+    return [future.result() for future in futures]
+
+
+def run_actions(actions, known_actions, budget=None):
+    # Runs every (name, input) pair concurrently and returns the results in order.
+    # A single action goes through the pool too, so the budget can stop the wait
+    futures = [submit_tool(name, known_actions[name], action_input) for name, action_input in actions]
+    return collect(futures, budget)
+
+
+class Speculator:
+    # Starts tools for complete Action lines while the rest of the turn is still
+    # decoding. dispatch() reuses a started call only when the finished turn has
+    # the same (name, input); anything else it started is thrown away
+    def __init__(self, known_actions):
+        self.known_actions = known_actions
+        self.pending = ""
+        self.started = {}   # (name, input) -> (future, start time)
+        self.finished = {}  # (name, input) -> completion time
+        self.calls = []
+        self.turn_end = None
+        self.discarded = 0
+
+    def feed(self, chunk):
+        self.pending += chunk
+        *lines, self.pending = self.pending.split("\n")
+        for line in lines:
+            match = action_re.match(line)
+            if match and match.group(1) in self.known_actions and match.groups() not in self.started:
+                self._submit(match.groups(), speculative=True)
+
+    def _submit(self, key, speculative):
+        name, action_input = key
+        fn = self.known_actions[name]
+
+        def timed(action_input):
+            # Stamped before the future resolves, so report() always sees it
+            try:
+                return fn(action_input)
+            finally:
+                self.finished[key] = time.perf_counter()
+
+        future = submit_tool(name, timed, action_input)
+        if speculative:
+            self.started[key] = (future, time.perf_counter())
+        return future
+
+    def dispatch(self, actions):
+        # Returns one future per action of the finished turn, in order
+        self.turn_end = time.perf_counter()
+        futures = []
+        for key in actions:
+            if key in self.started:
+                future, started = self.started.pop(key)
+                self.calls.append((key, started))
+            else:
+                future = self._submit(key, speculative=False)
+                self.calls.append((key, self.turn_end))
+            futures.append(future)
+        for future, _ in self.started.values():
+            future.cancel()
+            self.discarded += 1
+        self.started = {}
+        return futures
+
+    def report(self):
+        # Call once the dispatched futures are done. Without speculation every tool
+        # would have started at turn_end, so the Observation would be ready at
+        # turn_end plus the slowest tool's duration
+        if not self.calls:
+            return {"used": 0, "discarded": self.discarded, "saved": 0.0}
+        durations = [self.finished[key] - started for key, started in self.calls]
+        ready = max(self.finished[key] for key, _ in self.calls)
+        return {
+            "used": sum(1 for _, started in self.calls if started < self.turn_end),
+            "discarded": self.discarded,
+            "saved": max(self.turn_end + max(durations) - ready, 0.0),
+        }
+
+
+def format_observation(actions, observations, formatter=default_formatter):
+    if len(actions) == 1:
+        return f"Observation: {formatter(observations[0])}"
+    lines = [f"{name}: {action_input} ->\n{formatter(observation)}"
+             for (name, action_input), observation in zip(actions, observations)]
+    return "Observation:\n" + "\n".join(lines)
+
+
+def turn_actions(bot, result):
+    # (name, input) pairs of a finished turn: native tool calls, else Action lines
+    calls = getattr(bot, "tool_calls", None) or []
+    if calls:
+        return calls, [(call["name"], call["input"]) for call in calls]
+    return [], [match.groups() for match in parse_actions(result)]
+
+
+def stop_reason(bot, budget, turns):
+    # Why the query must stop before its next turn, or None; a spent token
+    # allowance also cancels the budget, so its stats give the reason
+    stopped = budget.exceeded() if budget is not None else None
+    token_budget = getattr(bot, "budget", None)
+    if stopped is None and turns and token_budget is not None and token_budget.exhausted():
+        stopped = "tokens"
+        if budget is not None:
+            budget.cancel(stopped)
+    return stopped
+
+
+def partial_answer(result, observation, reason):
+    # The best answer available when the budget stops the loop early
+    if "Answer:" in result:
+        return result
+    if observation:
+        found = observation.removeprefix("Observation:").strip()
+        return f"Answer: I had to stop early ({reason}). Here is what I found so far:\n{found}"
+    return f"Answer: I had to stop early ({reason}) before I could find an answer."
+
+
+class LazyBot:
+    # Stands in for the bot make_bot() returns and builds it on first use, so a
+    # cached or routed question never constructs (or loads) one
+    def __init__(self, make_bot):
+        self.make_bot = make_bot
+        self.bot = None
+
+    def __getattr__(self, name):
+        if self.bot is None:
+            self.bot = self.make_bot()
+        return getattr(self.bot, name)
+
+
+def stream_query(bot, question, known_actions, max_turns=10, formatter=default_formatter, answers=None,
+                 router=None, speculate=True, budget=None):
+    if answers is not None:
+        entry = answers.lookup(question)
+        if entry is not None:
+            yield "cached", entry
+            yield "answer", entry["answer"]
+            return
+        reads = answers.track()
+    start = time.perf_counter()
+    trace = start_trace("query", question=question[:200])
+    # Set even when None, so a budget left behind by an abandoned query does not apply
+    current_budget.set(budget)
+
+    routed = router.route(question) if router is not None else None
+    if routed is not None and routed[0] in known_actions:
+        # Simple question: one tool call and a templated answer, no model turns.
+        # The router declines an empty result, and the question goes to the loop
+        action, action_input = routed
+        stopped = None
+        try:
+            if budget is not None:
+                budget.spend_tool_calls(1)
+            observation = run_actions([routed], known_actions, budget)[0]
+            result = router.answer(action, action_input, observation)
+        except BudgetExceeded as e:
+            stopped = e.reason
+            result = partial_answer("", None, e.reason)
+        if result is not None:
+            yield "routed", routed
+            yield "action", routed
+            if stopped is not None:
+                yield "budget", budget.stats()
+            router.record(action, time.perf_counter() - start)
+            if answers is not None:
+                answers.untrack()
+            yield "trace", finish_trace(trace)
+            yield "answer", result
+            return
+
+    next_prompt = question
+    observation = None
+    result = ""
+    stopped = None
+    i = 0
+    while i < max_turns:
+        stopped = stop_reason(bot, budget, i)
+        if stopped is not None:
+            break
+        i += 1
+        speculator = Speculator(known_actions) if speculate else None
+        chunks = []
+        cut = False
+        # Closing the turn early hands the model back before the generator is collected
+        with closing(bot.stream(next_prompt)) as turn:
+            for chunk in turn:
+                if speculator is not None:
+                    speculator.feed(chunk)
+                chunks.append(chunk)
+                yield "token", chunk
+                if budget is not None and budget.exceeded() is not None:
+                    cut = True
+                    break
+        # A turn cut off here never reached bot.messages
+        result = "".join(chunks).strip() if cut else bot.messages[-1]["content"]
+        yield "turn", result
+
+        calls, actions = turn_actions(bot, result)
+        stopped = budget.exceeded() if budget is not None else None
+        if stopped is None and actions and budget is not None and not budget.spend_tool_calls(len(actions)):
+            budget.cancel("tool_calls")
+            stopped = "tool_calls"
+        if not actions or stopped is not None:
+            if speculator is not None:
+                speculator.dispatch([])
+            break
+        for action, action_input in actions:
+            if action not in known_actions:
+                raise Exception(f"Unknown action: {action}: {action_input}")
+            yield "action", (action, action_input)
+        # Every action of the turn runs at once and comes back as one Observation
+        try:
+            if speculator is not None and speculator.started:
+                observations = collect(speculator.dispatch(actions), budget)
+                report = speculator.report()
+                record("tool.speculation_saved", report["saved"], used=report["used"],
+                       discarded=report["discarded"])
+                yield "speculation", report
+            else:
+                observations = run_actions(actions, known_actions, budget)
+        except BudgetExceeded as e:
+            stopped = e.reason
+            break
+        next_prompt = observation = format_observation(actions, observations, formatter)
+        yield "observation", observation
+        if calls:
+            # Each native call gets its own tool message instead of an Observation turn
+            bot.add_tool_results([formatter(o) for o in observations])
+            next_prompt = None
+    if stopped is not None:
+        result = partial_answer(result, observation, stopped)
+        if budget is not None:
+            yield "budget", budget.stats()
+    if router is not None:
+        router.record("fallback", time.perf_counter() - start)
+    yield "trace", finish_trace(trace)
+    if answers is not None:
+        answers.untrack()
+        # Only finished answers are reused, not turns cut off by the budget or max_turns
+        if "Answer:" in result and stopped is None:
+            answers.store(question, result, time.perf_counter() - start, reads)
+    yield "answer", result
+
+
+async def acall_tool(name, fn, action_input, async_fn=None):
+    with span(f"tool.{name}", input=action_input):
+        if async_fn is not None:
+            return await async_fn(action_input)
+        # to_thread runs fn in a copy of this context, so its spans join the trace
+        return await asyncio.to_thread(fn, action_input)
+
+
+async def astream_query(bot, question, known_actions, max_turns=10, formatter=default_formatter, budget=None,
+                        async_actions=None):
+    # Same events as stream_query; async_actions maps action names to coroutine functions
+    async_actions = async_actions or {}
+    trace = start_trace("query", question=question[:200])
+    current_budget.set(budget)
+    next_prompt = question
+    observation = None
+    result = ""
+    stopped = None
+    for i in range(max_turns):
+        stopped = stop_reason(bot, budget, i)
+        if stopped is not None:
+            break
+        chunks = []
+        cut = False
+        turn = bot.astream(next_prompt)
+        try:
+            async for chunk in turn:
+                chunks.append(chunk)
+                yield "token", chunk
+                if budget is not None and budget.exceeded() is not None:
+                    cut = True
+                    break
+        finally:
+            await turn.aclose()
+        result = "".join(chunks).strip() if cut else bot.messages[-1]["content"]
+        yield "turn", result
+
+        calls, actions = turn_actions(bot, result)
+        stopped = budget.exceeded() if budget is not None else None
+        if stopped is None and actions and budget is not None and not budget.spend_tool_calls(len(actions)):
+            budget.cancel("tool_calls")
+            stopped = "tool_calls"
+        if not actions or stopped is not None:
+            break
+        for action, action_input in actions:
+            if action not in known_actions:
+                raise Exception(f"Unknown action: {action}: {action_input}")
+            yield "action", (action, action_input)
+        try:
+            observations = await asyncio.gather(*(
+                acall_tool(name, known_actions[name], action_input, async_actions.get(name))
+                for name, action_input in actions))
+        except BudgetExceeded as e:
+            stopped = e.reason
+            break
+        next_prompt = observation = format_observation(actions, observations, formatter)
+        yield "observation", observation
+        if calls:
+            bot.add_tool_results([formatter(o) for o in observations])
+            next_prompt = None
+    if stopped is not None:
+        result = partial_answer(result, observation, stopped)
+        if budget is not None:
+            yield "budget", budget.stats()
+    yield "trace", finish_trace(trace)
+    yield "answer", result
+
+
+def print_query(bot, question, known_actions, max_turns=10, formatter=default_formatter, answers=None,
+                router=None, budget=None):
+    # Prints model output token by token, plus the actions and observations in between
+    routed = False
+    stopped = False
+    for kind, payload in stream_query(bot, question, known_actions, max_turns, formatter, answers, router,
+                                      budget=budget):
+        if kind == "token":
+            print(payload, end="", flush=True)
+        elif kind == "turn":
+            print()
+            if getattr(bot, "turn_stats", None):
+                stats = bot.turn_stats[-1]
+                line = " -- {generated_tokens}/{max_tokens} tokens, stop: {stop_reason}, saved: {tokens_saved}"
+                if "cached_tokens" in stats:
+                    line += ", prompt: {prompt_tokens} ({cached_tokens} cached)"
+                print(line.format(**stats))
+        elif kind == "action":
+            print(" -- running {} {}".format(*payload))
+        elif kind == "observation":
+            print(payload)
+        elif kind == "cached":
+            print(payload["answer"])
+            print(" -- cached answer (saved about {:.2f}s)".format(payload["seconds"]))
+        elif kind == "speculation":
+            print(" -- tools started while decoding, {:.0f} ms saved".format(payload["saved"] * 1000))
+        elif kind == "routed":
+            routed = True
+            print(" -- answered by the router with {} {}".format(*payload))
+        elif kind == "budget":
+            stopped = True
+            print(" -- stopped early ({reason}) after {elapsed:.1f}s, {tokens} tokens, "
+                  "{tool_calls} tool calls".format(**payload))
+        elif kind == "answer" and (routed or stopped):
+            print(payload)
+    usage = getattr(bot, "usage", None)
+    if usage and usage["turns"]:
+        print(" -- {prompt_tokens} prompt tokens ({cached_tokens} cached), {completion_tokens} completion "
+              "tokens over {turns} turns".format(**usage))
@@ -0,0 +1,110 @@
+'''
+Rule-based fast path in front of the ReAct loop.
+
+Most questions are a plain "coffee near <city>" or a list of taste words. For
+those the model only picks one tool and paraphrases its result, which costs two
+full generations. Router.route recognises them with anchored patterns and
+answers from the tool result with a template; anything it is not sure about
+(extra clauses, negations, words outside the taste catalog, places like "near
+here" or "in the area") falls through to the agent loop, and so does a question
+whose tool result is empty. Router.stats() compares how often and how fast each path runs.
+'''
+
+import re
+import threading
+
+from taste_engine import index, words
+
+LOCATION_RE = re.compile(r"""
+    ^(?:(?:where|how)\s+(?:can|do|could|should)\s+i\s+(?:find|get|buy)\s+)?
+    (?:find\s+(?:me\s+)?)?
+    (?:(?:a|an|some|any|good|great|nice|the|best|nearby|local)\s+)*
+    (?:coffee|cafe|espresso)(?:\s+(?:shops?|places?|houses?|bars?|spots?|cafes?))?
+    \s+(?:in|near|around|close\s+to)\s+
+    (?P<city>[a-z][a-z.' -]*?(?:,\s*[a-z][a-z. ]*)?)
+    $""", re.VERBOSE)
+
+# Words that may appear in a city name position but signal a compound question
+NOT_A_CITY = {"and", "or", "that", "with", "which", "who", "where", "what", "but", "me", "my", "it"}
+
+# A place starting with one of these is relative to the user or generic ("near
+# here", "in the area", "in town", "near the office"), not a city to geocode
+NOT_A_CITY_START = {
+    "a", "an", "the", "this", "that", "these", "those",
+    "i", "me", "my", "you", "your", "we", "us", "our", "he", "him", "his", "she", "her", "they", "them", "their",
+    "here", "there", "town", "downtown", "area", "nearby", "home", "work",
+}
+
+# Words a pure taste request may contain besides the taste notes themselves
+TASTE_FILLER = set("""
+    i im m like love prefer want enjoy my coffee coffees something that is and or a an the
+    very really with what should do you recommend drink try me suggest for someone who likes
+    taste tastes flavor flavour looking kind of type cup please it
+""".split())
+
+
+def _clean(question):
+    text = re.sub(r"\s+", " ", question.strip().lower())
+    return text.rstrip("?!. ")
+
+
+class Router:
+    def __init__(self, taste_index=index, max_shops=10):
+        self.taste_index = taste_index
+        self.max_shops = max_shops
+        self.lock = threading.Lock()
+        self.counts = {"coffee_location": 0, "coffee_taste": 0, "fallback": 0}
+        self.seconds = {"routed": 0.0, "fallback": 0.0}
+
+    def route(self, question):
+        # Returns (action, input) for a high-confidence simple question, else None
+        text = _clean(question)
+        match = LOCATION_RE.match(text)
+        if match:
+            city = match.group("city").strip(" ,.")
+            names = words(city)
+            if names and names[0] not in NOT_A_CITY_START and not NOT_A_CITY & set(names):
+                # Keep the user's capitalisation for the geocoder and the answer
+                original = re.sub(r"\s+", " ", question.strip())
+                start = match.start("city")
+                if len(original.lower()) == len(original):
+                    city = original[start:start + len(city)]
+                return "coffee_location", city
+        notes = self.taste_index.notes(text)
+        if notes:
+            covered = {w for note in notes for w in note}
+            if all(w in covered or w in TASTE_FILLER for w in words(text)):
+                return "coffee_taste", " and ".join(" ".join(note) for note in notes)
+        return None
+
+    def answer(self, action, action_input, observation):
+        # None when the tool found nothing (or could not geocode the city), so the
+        # agent loop gets a chance instead of a templated "not found"
+        if not observation:
+            return None
+        if action == "coffee_location":
+            shops = [f"- {shop['name']}, {shop['address']}" for shop in observation[:self.max_shops]]
+            return f"Answer: Here are coffee shops in {action_input}:\n" + "\n".join(shops)
+        return f"Answer: For coffee that is {action_input}, try " + ", ".join(observation[:5]) + "."
+
+    def record(self, path, seconds):
+        # path is the routed action name, or "fallback" for the agent loop
+        with self.lock:
+            self.counts[path] += 1
+            self.seconds["fallback" if path == "fallback" else "routed"] += seconds
+
+    def stats(self):
+        with self.lock:
+            routed = self.counts["coffee_location"] + self.counts["coffee_taste"]
+            fallback = self.counts["fallback"]
+            return {
+                "routed": routed,
+                "fallback": fallback,
+                "by_action": {k: v for k, v in self.counts.items() if k != "fallback"},
+                "routed_share": routed / (routed + fallback) if routed + fallback else 0.0,
+                "routed_mean_seconds": self.seconds["routed"] / routed if routed else None,
+                "fallback_mean_seconds": self.seconds["fallback"] / fallback if fallback else None,
+            }
+
+
+router = Router()
@@ -0,0 +1,406 @@
+'''
+Continuous-batching scheduler for the MLX agent.
+
+One worker thread owns the model and runs every in-flight ReAct conversation:
+each step decodes the pending turns of all running conversations together with
+mlx_lm's BatchGenerator. A conversation leaves the batch while its tools run on
+the shared tool pool (so tool I/O never blocks decoding) and once it has an
+answer; queued conversations take the free slots.
+
+submit() is thread-safe and raises queue.Full when the inbox is at capacity,
+which is how callers apply backpressure. Each conversation reports progress to
+its callback with the same events as react_loop.stream_query, followed by
+("done", row) where row summarises the conversation.
+
+A conversation submitted with a budget.QueryBudget is stopped with its best
+answer so far once the budget runs out or is cancelled, at the next decode step
+or while its tools run. If the worker thread fails, every conversation it holds
+or has queued gets an ("error", message) event and its ("done", row), and
+submit() raises RuntimeError from then on.
+'''
+
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from budget import BudgetExceeded, current_budget
+from react_loop import Speculator, parse_actions, format_observation, partial_answer, stop_reason
+from stopping import StopMatcher, cut_at_stop
+from tracing import span
+
+
+# How often submit(block=True) checks that the worker is still alive
+SUBMIT_POLL = 0.1
+
+
+def error_row(qid, question, error):
+    return {"id": qid, "question": question, "answer": "", "turns": 0, "generated_tokens": 0,
+            "seconds": 0.0, "error": error}
+
+
+class Conversation:
+    def __init__(self, qid, question, bot, callback, budget=None):
+        self.qid = qid
+        self.question = question
+        self.bot = bot
+        self.callback = callback
+        self.budget = budget
+        self.turns = 0
+        self.result = ""
+        self.observation = None
+        self.error = None
+        self.stopped = None
+        self.tokens = []
+        self.text = ""
+        self.matcher = None
+        self.speculator = None
+        self.limit = 0
+        self.actions = []
+        self.generated = 0
+        self.start = time.perf_counter()
+        bot.messages.append({"role": "user", "content": question})
+
+    def emit(self, kind, payload):
+        if self.callback is not None:
+            self.callback(kind, payload)
+
+    def exceeded(self):
+        return self.budget.exceeded() if self.budget is not None else None
+
+    def row(self):
+        row = {
+            "id": self.qid,
+            "question": self.question,
+            "answer": self.result,
+            "turns": self.turns,
+            "generated_tokens": self.generated,
+            "seconds": round(time.perf_counter() - self.start, 3),
+        }
+        if self.error:
+            row["error"] = self.error
+        if self.stopped:
+            row["stopped"] = self.stopped
+        return row
+
+
+class BatchScheduler:
+    def __init__(self, system, known_actions, batch_size=8, max_turns=10, max_queue=0, **agent_kwargs):
+        self.system = system
+        self.known_actions = known_actions
+        self.batch_size = batch_size
+        self.max_turns = max_turns
+        self.agent_kwargs = agent_kwargs
+        self.inbox = queue.Queue(maxsize=max_queue)
+        self.waiting = []  # conversations ready for their next turn
+        self.running = {}  # BatchGenerator uid -> conversation
+        self.tools = {}    # conversation -> tool futures
+        self.handle = None
+        self.gen = None
+        self.closed = False
+        self.error = None  # set when the worker thread has failed
+        self.completed = 0
+        self.generated_tokens = 0
+        self.speculation_saved = 0.0
+        self._admitting = None
+        self._thread = None
+
+    # Called from any thread
+
+    def submit(self, qid, question, callback=None, block=False, budget=None):
+        self._check()
+        item = (qid, question, callback, budget)
+        if not block:
+            self.inbox.put_nowait(item)
+        else:
+            # Waits for room, but not on a worker that has died
+            while True:
+                try:
+                    self.inbox.put(item, timeout=SUBMIT_POLL)
+                    break
+                except queue.Full:
+                    self._check()
+        if self.error is not None:
+            # The worker failed while this was being queued; answer it here
+            self._drain()
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError(f"scheduler stopped: {self.error}")
+        if self.closed:
+            raise RuntimeError("scheduler is closed")
+
+    @property
+    def alive(self):
+        return self.error is None and self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="inference", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self, wait_for_drain=True):
+        self.closed = True
+        if self._thread is not None and wait_for_drain:
+            self._thread.join()
+
+    def stats(self):
+        return {
+            "queued": self.inbox.qsize(),
+            "running": len(self.running),
+            "waiting": len(self.waiting),
+            "in_tools": len(self.tools),
+            "completed": self.completed,
+            "generated_tokens": self.generated_tokens,
+            "speculation_saved_seconds": round(self.speculation_saved, 3),
+            "error": self.error,
+        }
+
+    # Worker thread
+
+    def active(self):
+        return len(self.waiting) + len(self.running) + len(self.tools)
+
+    def _admit(self, item):
+        from mlx_agent import Agent
+
+        self._admitting = item
+        qid, question, callback, budget = item
+        # BatchGenerator is mlx_lm's, so batched serving always runs on the MLX backend
+        bot = Agent(self.system, prompt_cache=False, backend="mlx", **self.agent_kwargs)
+        if self.gen is None:
+            from mlx_lm.generate import BatchGenerator
+            self.handle = bot.handle
+            self.gen = BatchGenerator(
+                self.handle.model,
+                stop_tokens=set(self.handle.tokenizer.eos_token_ids),
+                completion_batch_size=self.batch_size,
+            )
+        self.waiting.append(Conversation(qid, question, bot, callback, budget))
+        self._admitting = None
+
+    def _finish(self, conv):
+        self.completed += 1
+        self.generated_tokens += conv.generated
+        if conv.error:
+            conv.emit("error", conv.error)
+        else:
+            conv.emit("answer", conv.result)
+        conv.emit("done", conv.row())
+
+    def _stop(self, conv, reason):
+        # Ends a conversation whose budget ran out with the best answer it has
+        conv.stopped = reason
+        conv.result = partial_answer(conv.result, conv.observation, reason)
+        if conv.budget is not None:
+            conv.emit("budget", conv.budget.stats())
+        self._finish(conv)
+
+    def _cut(self, conv, reason):
+        # Stops a conversation mid-turn; its uid is removed from the generator by the caller
+        result = conv.text.strip()
+        conv.bot.budget.spend(len(conv.tokens))
+        conv.generated += len(conv.tokens)
+        conv.turns += 1
+        conv.result = result
+        conv.emit("turn", result)
+        conv.speculator.dispatch([])
+        self._stop(conv, reason)
+
+    def _end_turn(self, conv, text):
+        # Tools started here run in the conversation's budget, like stream_query's
+        current_budget.set(conv.budget)
+        tail = conv.matcher.flush()
+        if tail:
+            conv.speculator.feed(tail)
+            conv.emit("token", tail)
+        result = text.strip()
+        conv.bot.messages.append({"role": "assistant", "content": result})
+        conv.bot.budget.spend(len(conv.tokens))
+        conv.generated += len(conv.tokens)
+        conv.turns += 1
+        conv.result = result
+        conv.emit("turn", result)
+
+        actions = [match.groups() for match in parse_actions(result)]
+        unknown = [name for name, _ in actions if name not in self.known_actions]
+        if unknown:
+            conv.error = f"Unknown action: {unknown[0]}"
+        elif actions and conv.turns < self.max_turns:
+            if conv.budget is not None and not conv.budget.spend_tool_calls(len(actions)):
+                conv.budget.cancel("tool_calls")
+                conv.speculator.dispatch([])
+                self._stop(conv, "tool_calls")
+                return
+            conv.actions = actions
+            for action in actions:
+                conv.emit("action", action)
+            # Tools whose Action line was decoded earlier in the turn are already running
+            self.tools[conv] = conv.speculator.dispatch(actions)
+            return
+        conv.speculator.dispatch([])
+        self._finish(conv)
+
+    def _rejoin(self):
+        # Conversations whose tools have returned go back into the batch; those
+        # whose budget runs out meanwhile abandon their tools
+        for conv, futures in list(self.tools.items()):
+            reason = conv.exceeded()
+            if reason is not None:
+                del self.tools[conv]
+                for future in futures:
+                    future.cancel()
+                self._stop(conv, reason)
+                continue
+            if not all(f.done() for f in futures):
+                continue
+            del self.tools[conv]
+            try:
+                observations = [f.result() for f in futures]
+            except BudgetExceeded as e:
+                self._stop(conv, e.reason)
+                continue
+            except Exception as e:
+                conv.error = f"Tool failed: {e}"
+                self._finish(conv)
+                continue
+            report = conv.speculator.report()
+            self.speculation_saved += report["saved"]
+            conv.emit("speculation", report)
+            observation = format_observation(conv.actions, observations)
+            conv.observation = observation
+            conv.emit("observation", observation)
+            conv.bot.messages.append({"role": "user", "content": observation})
+            self.waiting.append(conv)
+
+    def _start_turns(self):
+        # Like stream_query, a spent token allowance stops a conversation once its tools return
+        for conv in list(self.waiting):
+            reason = stop_reason(conv.bot, conv.budget, conv.turns)
+            if reason is not None:
+                self.waiting.remove(conv)
+                self._stop(conv, reason)
+        if not self.waiting:
+            return
+        prompts = []
+        for conv in self.waiting:
+            conv.tokens = []
+            conv.text = ""
+            conv.matcher = StopMatcher(conv.bot.stop)
+            conv.speculator = Speculator(self.known_actions)
+            conv.limit = conv.bot.budget.turn_limit()
+            prompts.append(self.handle.tokenizer.encode(conv.bot.build_prompt()))
+        with self.handle.lock:
+            uids = self.gen.insert(prompts, [conv.limit for conv in self.waiting])
+        self.running.update(zip(uids, self.waiting))
+        self.waiting = []
+
+    def _step(self):
+        # One batched decode step for every running conversation
+        with span("llm.batch_step", batch=len(self.running)) as attrs:
+            with self.handle.lock:
+                responses = self.gen.next()
+            attrs["generated_tokens"] = len(responses)
+        cut = []
+        for response in responses:
+            conv = self.running[response.uid]
+            current_budget.set(conv.budget)
+            if response.finish_reason != "stop":
+                conv.tokens.append(response.token)
+                if conv.budget is not None:
+                    conv.budget.spend_tokens(1)
+            text, stopped = cut_at_stop(self.handle.tokenizer.decode(conv.tokens), conv.bot.stop)
+            # Hold back a trailing partial character until the next token completes it
+            if not text.endswith("\ufffd") and len(text) > len(conv.text):
+                chunk = conv.matcher.feed(text[len(conv.text):])
+                conv.text = text
+                if chunk:
+                    conv.speculator.feed(chunk)
+                    conv.emit("token", chunk)
+            if stopped and response.finish_reason is None:
+                cut.append(response.uid)
+            if stopped or response.finish_reason is not None:
+                del self.running[response.uid]
+                self._end_turn(conv, text)
+        for uid, conv in list(self.running.items()):
+            reason = conv.exceeded()
+            if reason is not None:
+                cut.append(uid)
+                del self.running[uid]
+                self._cut(conv, reason)
+        if cut:
+            with self.handle.lock:
+                self.gen.remove(cut)
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as e:
+            # Without this the thread would die silently and its callers wait forever
+            traceback.print_exc()
+            self._fail(f"{type(e).__name__}: {e}")
+        finally:
+            if self.gen is not None:
+                self.gen.close()
+
+    def _fail(self, error):
+        self.error = error
+        self.closed = True
+        for futures in self.tools.values():
+            for future in futures:
+                future.cancel()
+        conversations = self.waiting + list(self.running.values()) + list(self.tools)
+        self.waiting, self.running, self.tools = [], {}, {}
+        for conv in conversations:
+            if conv.speculator is not None:
+                conv.speculator.dispatch([])
+            conv.error = error
+            try:
+                self._finish(conv)
+            except Exception:
+                traceback.print_exc()
+        if self._admitting is not None:
+            self._reject(self._admitting)
+            self._admitting = None
+        self._drain()
+
+    def _drain(self):
+        # Answers everything still queued once the worker has failed
+        while True:
+            try:
+                item = self.inbox.get_nowait()
+            except queue.Empty:
+                return
+            self._reject(item)
+
+    def _reject(self, item):
+        qid, question, callback, _ = item
+        if callback is not None:
+            callback("error", self.error)
+            callback("done", error_row(qid, question, self.error))
+
+    def _run(self):
+        while True:
+            while self.active() < self.batch_size:
+                try:
+                    item = self.inbox.get_nowait()
+                except queue.Empty:
+                    break
+                self._admit(item)
+            self._rejoin()
+            self._start_turns()
+
+            if self.running:
+                self._step()
+            elif self.tools:
+                wait([f for futures in self.tools.values() for f in futures],
+                     timeout=0.05, return_when=FIRST_COMPLETED)
+            elif self.closed and self.inbox.empty():
+                break
+            else:
+                # Idle: sleep until the next submission arrives
+                try:
+                    self._admit(self.inbox.get(timeout=0.1))
+                except queue.Empty:
+                    pass
@@ -0,0 +1,195 @@
+'''
+Asyncio JSON/SSE API for the coffee agent.
+
+    POST /query    {"question": "...", "stream": false}  -> answer row as JSON
+    POST /query    {"question": "...", "stream": true}   -> server-sent events
+    GET  /health
+    GET  /stats
+    GET  /metrics                                        -> Prometheus text
+
+Every query is handed to one scheduler.BatchScheduler worker that owns the
+model and batches decoding across requests; tools run on the tool pool, never
+on the inference thread. When the scheduler's queue is full the request is
+rejected with 429 and Retry-After instead of piling up; if its worker has
+failed, queries and /health answer 503. Each query runs under a
+budget.QueryBudget (--deadline, --max-tool-calls), which is cancelled when the
+client disconnects. Run with:
+
+    python server.py --port 8000 --batch-size 8 --max-queue 32
+'''
+
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import queue
+
+from budget import QueryBudget, DEADLINE, MAX_TOOL_CALLS
+from scheduler import BatchScheduler
+from tracing import metrics
+
+MAX_BODY = 64 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+           429: "Too Many Requests", 503: "Service Unavailable"}
+
+
+async def read_request(reader):
+    line = await reader.readline()
+    method, target, _ = line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY:
+        raise OverflowError(length)
+    body = await reader.readexactly(length) if length else b""
+    return method, target.split("?", 1)[0], headers, body
+
+
+async def respond(writer, status, body, headers=None):
+    # str bodies are sent as plain text, anything else as JSON
+    if isinstance(body, str):
+        data, content_type = body.encode(), "text/plain; version=0.0.4"
+    else:
+        data, content_type = json.dumps(body).encode(), "application/json"
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(data)}",
+            "Connection: close"]
+    head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+    await writer.drain()
+
+
+async def next_event(events, gone):
+    # The scheduler's next event, or ConnectionResetError once the client has hung up
+    get = asyncio.ensure_future(events.get())
+    done, _ = await asyncio.wait({get, gone}, return_when=asyncio.FIRST_COMPLETED)
+    if get in done:
+        return get.result()
+    get.cancel()
+    raise ConnectionResetError("client disconnected")
+
+
+class ApiServer:
+    def __init__(self, scheduler, deadline=DEADLINE, max_tool_calls=MAX_TOOL_CALLS):
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self.max_tool_calls = max_tool_calls
+        self.ids = itertools.count(1)
+        self.accepted = 0
+        self.rejected = 0
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                method, path, headers, body = await read_request(reader)
+            except OverflowError:
+                return await respond(writer, 413, {"error": "request body too large"})
+            except (ValueError, asyncio.IncompleteReadError):
+                return
+            if method == "POST" and path == "/query":
+                await self.query(reader, writer, body)
+            elif method == "GET" and path == "/health":
+                if self.scheduler.alive:
+                    await respond(writer, 200, {"status": "ok"})
+                else:
+                    await respond(writer, 503, {"status": "down", "error": self.scheduler.error})
+            elif method == "GET" and path == "/stats":
+                stats = dict(self.scheduler.stats(), accepted=self.accepted, rejected=self.rejected)
+                await respond(writer, 200, stats)
+            elif method == "GET" and path == "/metrics":
+                await respond(writer, 200, metrics.render())
+            else:
+                await respond(writer, 404, {"error": f"no route for {method} {path}"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def query(self, reader, writer, body):
+        try:
+            request = json.loads(body or b"{}")
+            question = request["question"]
+        except (ValueError, KeyError, TypeError):
+            return await respond(writer, 400, {"error": 'expected a JSON body like {"question": "..."}'})
+
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def callback(kind, payload):
+            # Runs on the inference thread
+            loop.call_soon_threadsafe(events.put_nowait, (kind, payload))
+
+        budget = QueryBudget(self.deadline, max_tool_calls=self.max_tool_calls)
+        try:
+            self.scheduler.submit(request.get("id", next(self.ids)), question, callback, budget=budget)
+        except queue.Full:
+            self.rejected += 1
+            return await respond(writer, 429, {"error": "server busy, retry later"}, {"Retry-After": "1"})
+        except RuntimeError as e:
+            self.rejected += 1
+            return await respond(writer, 503, {"error": str(e)})
+        self.accepted += 1
+
+        # The request has been read in full, so end of input means the client went away
+        gone = asyncio.ensure_future(reader.read(1))
+        done = False
+        try:
+            if not request.get("stream"):
+                while True:
+                    kind, payload = await next_event(events, gone)
+                    if kind == "done":
+                        done = True
+                        return await respond(writer, 200, payload)
+
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            while True:
+                kind, payload = await next_event(events, gone)
+                done = kind == "done"
+                writer.write(f"event: {kind}\ndata: {json.dumps(payload)}\n\n".encode())
+                await writer.drain()
+                if done:
+                    return
+        finally:
+            gone.cancel()
+            if not done:
+                # Frees the batch slot and tool calls of a client that is no longer listening
+                budget.cancel("disconnected")
+
+
+async def serve(api, host, port):
+    server = await asyncio.start_server(api.handle, host, port)
+    print(f"AgentCoffee API on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--batch-size", type=int, default=8, help="conversations decoded together")
+    parser.add_argument("--max-queue", type=int, default=32, help="queued queries before answering 429")
+    parser.add_argument("--max-turns", type=int, default=10)
+    parser.add_argument("--deadline", type=float, default=DEADLINE,
+                        help="seconds a query may take before the best answer so far is returned")
+    parser.add_argument("--max-tool-calls", type=int, default=MAX_TOOL_CALLS, help="tool calls allowed per query")
+    args = parser.parse_args()
+
+    agent = importlib.import_module("agent_coffee-mlx")
+    scheduler = BatchScheduler(agent.prompt, agent.known_actions, args.batch_size, args.max_turns,
+                               max_queue=args.max_queue).start()
+    asyncio.run(serve(ApiServer(scheduler, args.deadline, args.max_tool_calls), args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+'''
+Stop sequences and token budgets for a model turn.
+
+The prompt asks the model to emit PAUSE after an Action; without a stop condition
+it keeps decoding and usually invents its own Observation. StopMatcher cuts a
+stream of text chunks at the first stop sequence, holding back any tail that
+could still grow into one.
+'''
+
+DEFAULT_STOP = ["PAUSE", "\nObservation:"]
+
+
+class StopMatcher:
+    def __init__(self, stop=DEFAULT_STOP):
+        self.stop = [s for s in stop or [] if s]
+        self.buffer = ""
+        self.stopped = False
+
+    def feed(self, chunk):
+        # Returns the text that is safe to emit; sets self.stopped once a stop sequence appears
+        if self.stopped:
+            return ""
+        self.buffer += chunk
+        hits = [i for i in (self.buffer.find(s) for s in self.stop) if i != -1]
+        if hits:
+            self.stopped = True
+            text, self.buffer = self.buffer[:min(hits)], ""
+            return text
+        hold = self._partial_suffix()
+        text = self.buffer[:len(self.buffer) - hold]
+        self.buffer = self.buffer[len(self.buffer) - hold:]
+        return text
+
+    def flush(self):
+        text, self.buffer = self.buffer, ""
+        return text
+
+    def _partial_suffix(self):
+        # Length of the longest buffer suffix that is a proper prefix of a stop sequence
+        longest = 0
+        for s in self.stop:
+            for n in range(min(len(s) - 1, len(self.buffer)), longest, -1):
+                if self.buffer.endswith(s[:n]):
+                    longest = n
+                    break
+        return longest
+
+
+class TokenBudget:
+    def __init__(self, max_tokens_per_turn=256, max_tokens_per_query=None):
+        self.max_tokens_per_turn = max_tokens_per_turn
+        self.max_tokens_per_query = max_tokens_per_query
+        self.used = 0
+
+    def turn_limit(self):
+        if self.max_tokens_per_query is None:
+            return self.max_tokens_per_turn
+        return max(0, min(self.max_tokens_per_turn, self.max_tokens_per_query - self.used))
+
+    def exhausted(self):
+        return self.turn_limit() == 0
+
+    def spend(self, tokens):
+        self.used += tokens
+
+
+def turn_report(limit, generated, stop_reason):
+    # Tokens the turn did not decode because a stop sequence ended it early
+    saved = limit - generated if stop_reason == "stop_sequence" else 0
+    return {
+        "max_tokens": limit,
+        "generated_tokens": generated,
+        "stop_reason": stop_reason,
+        "tokens_saved": saved,
+    }
+
+
+def cut_at_stop(text, stop=DEFAULT_STOP):
+    # Returns (text up to the first stop sequence, whether one was found)
+    hits = [i for i in (text.find(s) for s in stop or [] if s) if i != -1]
+    if hits:
+        return text[:min(hits)], True
+    return text, False
@@ -0,0 +1,98 @@
+'''
+Ranked coffee_taste matcher over a loadable flavor catalog.
+
+The catalog (data/coffee_profiles.json, or the file named by COFFEE_PROFILES) is
+read once at import and compiled into an inverted index from note to profiles.
+Queries are tokenized phrase-aware, so multi-word notes such as "less acidic"
+and "full bodied"/"full-bodied" match, and profiles are ranked by how many of
+the requested notes they share. Scoring is vectorized with numpy when it is
+installed.
+'''
+
+import json
+import os
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "coffee_profiles.json")
+
+_word_re = re.compile(r"[a-z0-9]+")
+
+
+def words(text):
+    # "Full-bodied" and "full bodied" both become ("full", "bodied")
+    return tuple(_word_re.findall(text.lower()))
+
+
+class TasteIndex:
+    def __init__(self, profiles):
+        self.names = [p["name"] for p in profiles]
+        self.sizes = [len(p["notes"]) for p in profiles]
+        postings = {}
+        for i, profile in enumerate(profiles):
+            for note in profile["notes"]:
+                postings.setdefault(words(note), []).append(i)
+        self.max_phrase = max((len(note) for note in postings), default=1)
+        if np is not None:
+            self.postings = {note: np.array(ids, dtype=np.int32) for note, ids in postings.items()}
+            self.size_array = np.array(self.sizes, dtype=np.float64)
+        else:
+            self.postings = postings
+
+    @classmethod
+    def load(cls, path=None):
+        with open(path or os.getenv("COFFEE_PROFILES", DEFAULT_CATALOG)) as f:
+            return cls(json.load(f))
+
+    def notes(self, text):
+        # Longest-first scan over the query words so phrases win over single words
+        tokens = words(text)
+        found = []
+        i = 0
+        while i < len(tokens):
+            for n in range(min(self.max_phrase, len(tokens) - i), 0, -1):
+                phrase = tokens[i:i + n]
+                if phrase in self.postings:
+                    if phrase not in found:
+                        found.append(phrase)
+                    i += n
+                    break
+            else:
+                i += 1
+        return found
+
+    def rank(self, text, top_k=10):
+        # Returns [(name, overlap)] ordered by overlap, then by the share of the
+        # profile's notes that matched, then by catalog order
+        notes = self.notes(text)
+        if not notes:
+            return []
+        if np is not None:
+            scores = np.bincount(np.concatenate([self.postings[n] for n in notes]), minlength=len(self.names))
+            # The matched share is at most 1, so it only breaks ties between equal overlaps
+            key = scores + scores / self.size_array * 0.5
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > top_k:
+                # Keep everything tied with the k-th best so catalog order decides ties
+                kth = np.partition(key[candidates], len(candidates) - top_k)[len(candidates) - top_k]
+                candidates = candidates[key[candidates] >= kth]
+            order = np.lexsort((candidates, -key[candidates]))[:top_k]
+            return [(self.names[i], int(scores[i])) for i in candidates[order]]
+        scores = {}
+        for note in notes:
+            for i in self.postings[note]:
+                scores[i] = scores.get(i, 0) + 1
+        ranked = sorted(scores, key=lambda i: (-scores[i], -scores[i] / self.sizes[i], i))
+        return [(self.names[i], scores[i]) for i in ranked[:top_k]]
+
+
+index = TasteIndex.load()
+
+
+def coffee_taste(taste_preferences, top_k=10):
+    # Returns coffee types matching the taste preferences, best match first
+    return [name for name, _ in index.rank(taste_preferences, top_k)]
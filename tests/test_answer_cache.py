@@ -0,0 +1,18 @@
+from answer_cache import normalize_question
+
+
+def test_washington_dc_variants_share_one_key():
+    variants = [
+        "coffee in washington, dc",
+        "coffee in Washington, D.C.",
+        "Coffee in Washington DC?",
+        "coffee in DC",
+        "coffee in washington, district of columbia",
+    ]
+    assert {normalize_question(q) for q in variants} == {"coffee in washington dc"}
+
+
+def test_normalized_question_is_stable():
+    for question in ["coffee in nyc", "espresso near san fran", "coffee in Washington, D.C.", "cafes in dc"]:
+        key = normalize_question(question)
+        assert normalize_question(key) == key
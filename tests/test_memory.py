@@ -0,0 +1,114 @@
+from memory import ConversationMemory
+
+SYSTEM = {"role": "system", "content": "You answer coffee questions."}
+QUESTION = {"role": "user", "content": "Where can I get low-acid coffee in Austin, TX?"}
+
+
+def text_exchange(n):
+    # One text-protocol exchange: a model turn and the Observation sent back
+    return [
+        {"role": "assistant", "content": f"Thought: step {n} {'x' * 80}\nAction: coffee_location: city {n}\nPAUSE"},
+        {"role": "user", "content": f"Observation: shop {n}\n{'y' * 200}"},
+    ]
+
+
+def tool_exchange(n):
+    # One native tool-calling exchange: the call and its result
+    call = {"id": f"call_{n}", "type": "function", "function": {"name": "coffee_location", "arguments": "{}"}}
+    return [
+        {"role": "assistant", "content": "", "tool_calls": [call]},
+        {"role": "tool", "tool_call_id": f"call_{n}", "content": f"Shop {n} | {n} Main St\n{'z' * 200}"},
+    ]
+
+
+def conversation(exchange, n):
+    messages = [SYSTEM, QUESTION]
+    for i in range(n):
+        messages += exchange(i)
+    return messages
+
+
+def make_memory(**options):
+    return ConversationMemory(**{"max_tokens": 1000, "keep_last": 2, "count_tokens": len, **options})
+
+
+def test_short_conversation_is_sent_unchanged():
+    memory = make_memory()
+    messages = conversation(text_exchange, 2)
+    assert memory.view(messages) == messages
+    assert memory.stats() == {"compactions": 0, "summarized": 0, "dropped": 0}
+
+
+def test_compaction_pins_the_prompt_and_keeps_recent_exchanges():
+    memory = make_memory()
+    messages = conversation(text_exchange, 6)
+    view = memory.view(messages)
+    assert view[:2] == [SYSTEM, QUESTION]
+    assert view[-3:] == messages[-3:]
+    assert memory.tokens(view) <= 1000 * memory.low_water
+    summaries = view[2:len(view) - (len(messages) - 2 - memory.summarized)]
+    assert summaries
+    assert not any("Thought:" in m["content"] or "y" * 50 in m["content"] for m in summaries)
+
+
+def test_prefix_is_stable_until_the_next_compaction():
+    memory = make_memory()
+    messages = conversation(text_exchange, 6)
+    first = memory.view(messages)
+    messages.append({"role": "assistant", "content": "Answer: Shop 5."})
+    second = memory.view(messages)
+    assert memory.stats()["compactions"] == 1
+    assert second[:len(first)] == first
+
+
+def test_summaries_give_way_to_dropped_exchanges():
+    memory = make_memory(max_tokens=1200)
+    messages = conversation(text_exchange, 8)
+    view = memory.view(messages)
+    assert 0 < memory.dropped < memory.summarized
+    assert memory.tokens(view) <= 1200 * memory.low_water
+    assert view[:2] == [SYSTEM, QUESTION]
+    # Only whole exchanges go: what is left starts at an Observation
+    assert view[2]["content"].startswith("Observation:")
+
+
+def test_recent_exchanges_are_kept_even_over_budget():
+    memory = make_memory(max_tokens=500)
+    messages = conversation(text_exchange, 8)
+    view = memory.view(messages)
+    assert memory.tokens(view) > 500
+    assert view == [SYSTEM, QUESTION] + messages[-3:]
+
+
+def test_tool_results_stay_with_their_calls():
+    for max_tokens in (300, 500, 800):
+        memory = make_memory(max_tokens=max_tokens, keep_last=1)
+        view = memory.view(conversation(tool_exchange, 6))
+        called = set()
+        for message in view[2:]:
+            for call in message.get("tool_calls", []):
+                called.add(call["id"])
+            if message["role"] == "tool":
+                assert message["tool_call_id"] in called
+        assert view[2]["role"] == "assistant"
+
+
+def test_edited_history_starts_over():
+    memory = make_memory()
+    memory.view(conversation(text_exchange, 6))
+    assert memory.summarized > 0
+    short = conversation(text_exchange, 1)
+    assert memory.view(short) == short
+    assert memory.summarized == memory.dropped == 0
+
+
+def test_hooks_see_each_compaction():
+    memory = make_memory()
+    events = []
+    memory.hooks.append(events.append)
+    messages = conversation(text_exchange, 6)
+    memory.view(messages)
+    assert len(events) == 1
+    event = events[0]
+    assert event["before_tokens"] > 1000 >= event["after_tokens"]
+    assert event["kept"] == len(messages) - 2 - memory.summarized
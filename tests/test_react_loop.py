@@ -0,0 +1,111 @@
+import threading
+import time
+
+from benchmarks.fake_llm import FakeLLM
+from budget import QueryBudget
+from react_loop import Speculator, stream_query
+
+QUESTION = "Where can I find a slow coffee?"
+
+
+def slow_tool(action_input):
+    time.sleep(1.5)
+    return "Slow Coffee | 1 Main St"
+
+
+def run(budget, actions):
+    plan = {QUESTION: [[("slow", str(i)) for i in range(actions)]]}
+    bot = FakeLLM(plan, token_latency=0).agent_class()()
+    start = time.perf_counter()
+    events = list(stream_query(bot, QUESTION, {"slow": slow_tool}, speculate=False, budget=budget))
+    return events, time.perf_counter() - start
+
+
+def test_single_action_stops_at_deadline():
+    events, elapsed = run(QueryBudget(deadline=0.3), actions=1)
+    assert elapsed < 1.0
+    assert dict(events)["budget"]["reason"] == "deadline"
+    assert events[-1][0] == "answer"
+    assert "stop early (deadline)" in events[-1][1]
+
+
+def test_single_action_stops_on_cancel():
+    budget = QueryBudget(deadline=None)
+    threading.Timer(0.2, budget.cancel).start()
+    events, elapsed = run(budget, actions=1)
+    assert elapsed < 1.0
+    assert dict(events)["budget"]["reason"] == "cancelled"
+
+
+def test_parallel_actions_stop_at_deadline():
+    events, elapsed = run(QueryBudget(deadline=0.3), actions=2)
+    assert elapsed < 1.0
+    assert dict(events)["budget"]["reason"] == "deadline"
+
+
+def test_token_allowance_stops_with_the_budget_reason():
+    plan = {QUESTION: [[("slow", "0")], [("slow", "1")]]}
+    bot = FakeLLM(plan, token_latency=0).agent_class()(max_query_tokens=5)
+    tools = {"slow": lambda action_input: "Slow Coffee | 1 Main St"}
+    events = list(stream_query(bot, QUESTION, tools, speculate=False, budget=QueryBudget(deadline=None)))
+    assert [kind for kind, _ in events].count("turn") == 1
+    assert dict(events)["budget"]["reason"] == "tokens"
+    assert "stop early (tokens)" in events[-1][1]
+    assert "Slow Coffee" in events[-1][1]
+
+
+class Recorder:
+    # A tool that records each call and takes delay seconds
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, action_input):
+        with self.lock:
+            self.calls.append(action_input)
+        time.sleep(self.delay)
+        return f"result for {action_input}"
+
+
+def test_speculator_starts_a_tool_once_its_action_line_is_complete():
+    tool = Recorder()
+    speculator = Speculator({"coffee_location": tool})
+    speculator.feed("Thought: look it up\nAction: coffee_location: Aus")
+    assert not speculator.started
+    speculator.feed("tin, TX\nPAUSE")
+    assert list(speculator.started) == [("coffee_location", "Austin, TX")]
+    futures = speculator.dispatch([("coffee_location", "Austin, TX")])
+    assert [f.result() for f in futures] == ["result for Austin, TX"]
+    assert tool.calls == ["Austin, TX"]
+    assert speculator.report()["used"] == 1
+
+
+def test_speculator_discards_calls_the_finished_turn_does_not_make():
+    tool = Recorder()
+    speculator = Speculator({"coffee_location": tool})
+    speculator.feed("Action: coffee_location: Austin\n")
+    futures = speculator.dispatch([("coffee_location", "Austin, TX")])
+    assert [f.result() for f in futures] == ["result for Austin, TX"]
+    report = speculator.report()
+    assert (report["used"], report["discarded"]) == (0, 1)
+    assert not speculator.started
+
+
+def test_speculator_ignores_unknown_and_repeated_actions():
+    tool = Recorder()
+    speculator = Speculator({"coffee_location": tool})
+    speculator.feed("Action: coffee_taste: bright\nAction: coffee_location: Austin\nAction: coffee_location: Austin\n")
+    assert list(speculator.started) == [("coffee_location", "Austin")]
+    futures = speculator.dispatch([("coffee_location", "Austin")])
+    assert [f.result() for f in futures] == ["result for Austin"]
+    assert tool.calls == ["Austin"]
+
+
+def test_speculator_reports_the_time_saved():
+    speculator = Speculator({"coffee_location": Recorder(delay=0.2)})
+    speculator.feed("Action: coffee_location: Austin\n")
+    time.sleep(0.15)  # the rest of the turn decoding
+    futures = speculator.dispatch([("coffee_location", "Austin")])
+    assert [f.result() for f in futures] == ["result for Austin"]
+    assert speculator.report()["saved"] >= 0.1
@@ -0,0 +1,51 @@
+from stopping import StopMatcher, TokenBudget, cut_at_stop
+
+
+def feed_all(matcher, chunks):
+    out = [matcher.feed(chunk) for chunk in chunks]
+    return out, matcher.stopped
+
+
+def test_stop_sequence_split_across_chunks_is_never_emitted():
+    matcher = StopMatcher()
+    out, stopped = feed_all(matcher, ["Action: coffee_taste: bright\nPA", "US", "E and more"])
+    assert stopped
+    assert "".join(out) == "Action: coffee_taste: bright\n"
+    assert out[1] == ""
+    assert matcher.feed("ignored") == ""
+
+
+def test_held_tail_is_released_when_it_stops_matching():
+    matcher = StopMatcher()
+    assert matcher.feed("Thought: PA") == "Thought: "
+    assert matcher.feed("PER filters") == "PAPER filters"
+    assert not matcher.stopped
+
+
+def test_partial_observation_prefix_is_held_until_it_resolves():
+    matcher = StopMatcher()
+    assert matcher.feed("Action: coffee_location: Austin\nObs") == "Action: coffee_location: Austin"
+    assert matcher.feed("ervation: made up") == ""
+    assert matcher.stopped
+
+
+def test_flush_returns_a_held_tail_at_the_end_of_the_turn():
+    matcher = StopMatcher()
+    assert matcher.feed("Answer: try a PA") == "Answer: try a "
+    assert matcher.flush() == "PA"
+
+
+def test_earliest_stop_sequence_wins():
+    matcher = StopMatcher(["PAUSE", "\nObservation:"])
+    assert matcher.feed("a\nObservation: x PAUSE") == "a"
+    assert cut_at_stop("a PAUSE\nObservation: x") == ("a ", True)
+    assert cut_at_stop("no stop here") == ("no stop here", False)
+
+
+def test_token_budget_caps_turns_at_the_query_allowance():
+    budget = TokenBudget(max_tokens_per_turn=100, max_tokens_per_query=150)
+    assert budget.turn_limit() == 100
+    budget.spend(100)
+    assert budget.turn_limit() == 50
+    budget.spend(50)
+    assert budget.exhausted()
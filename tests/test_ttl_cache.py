@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import ttl_cache
+from budget import BudgetExceeded
+from ttl_cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ttl_cache, "time", clock)
+    return clock
+
+
+def make_cache(tmp_path, **options):
+    return TTLCache("test", path=str(tmp_path / "cache.sqlite3"), **{"ttl": 60, **options})
+
+
+def run_threads(n, target):
+    results = [None] * n
+    errors = [None] * n
+
+    def run(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    return threads, results, errors
+
+
+def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+def test_concurrent_lookups_compute_once(tmp_path):
+    cache = make_cache(tmp_path)
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {"value": 42}
+    threads, results, errors = run_threads(5, lambda: cache.get_or_compute("k", compute))
+    wait_for(lambda: cache.coalesced == 4)
+    release.set()
+    for t in threads:
+        t.join()
+    assert calls == [1]
+    assert results == [{"value": 42}] * 5
+    assert errors == [None] * 5
+    assert cache.get("k") == {"value": 42}
+
+
+def test_waiters_share_the_owners_error_and_nothing_is_cached(tmp_path):
+    cache = make_cache(tmp_path)
+    release = threading.Event()
+
+    def compute():
+        release.wait(5)
+        raise ValueError("quota")
+    threads, results, errors = run_threads(3, lambda: cache.get_or_compute("k", compute))
+    wait_for(lambda: cache.coalesced == 2)
+    release.set()
+    for t in threads:
+        t.join()
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert cache.get_or_compute("k", lambda: "fresh") == "fresh"
+
+
+def test_waiter_recomputes_when_the_owner_runs_out_of_budget(tmp_path):
+    cache = make_cache(tmp_path)
+    release = threading.Event()
+    started = threading.Event()
+
+    def owner_compute():
+        started.set()
+        release.wait(5)
+        raise BudgetExceeded("deadline")
+    owner, _, owner_errors = run_threads(1, lambda: cache.get_or_compute("k", owner_compute))
+    started.wait(5)
+    waiter, waiter_results, waiter_errors = run_threads(1, lambda: cache.get_or_compute("k", lambda: "mine"))
+    wait_for(lambda: cache.coalesced == 1)
+    release.set()
+    for t in owner + waiter:
+        t.join()
+    assert isinstance(owner_errors[0], BudgetExceeded)
+    assert waiter_results == ["mine"]
+    assert waiter_errors == [None]
+
+
+def test_should_cache_false_is_returned_but_not_stored(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get_or_compute("k", lambda: {"status": "OVER_QUERY_LIMIT"}, lambda v: False) == {
+        "status": "OVER_QUERY_LIMIT"}
+    assert cache.get("k") is None
+
+
+def test_entries_expire_after_their_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl=10)
+    cache.set("short", 1, ttl=5)
+    cache.set("default", 2)
+    clock.now += 6
+    assert cache.get("short") is None
+    assert cache.expires_at("short") is None
+    assert cache.get("default") == 2
+    clock.now += 5
+    assert cache.get("default", "gone") == "gone"
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=2)
+    cache.set("a", 1)
+    clock.now += 1
+    cache.set("b", 2)
+    clock.now += 1
+    assert cache.get("a") == 1
+    clock.now += 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+
+def test_eviction_is_per_namespace(tmp_path, clock):
+    small = make_cache(tmp_path, max_entries=1)
+    other = TTLCache("other", ttl=60, path=small.path)
+    other.set("x", 0)
+    small.set("a", 1)
+    clock.now += 1
+    small.set("b", 2)
+    assert small.get("a") is None
+    assert other.get("x") == 0
+
+
+def test_async_lookups_compute_once(tmp_path):
+    cache = make_cache(tmp_path)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(cache.aget_or_compute("k", compute) for _ in range(4)))
+    assert asyncio.run(main()) == ["value"] * 4
+    assert calls == [1]
+    assert cache.coalesced == 3
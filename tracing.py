@@ -0,0 +1,199 @@
+'''
+Per-query tracing and process-wide metrics.
+
+A Trace collects spans (name, start, duration, attributes such as token counts)
+for one query. The current trace lives in a context variable, so the agent
+loop, Agent.execute, the tools and the HTTP client can all add spans without
+passing it around; tool threads get it through contextvars.copy_context().
+
+Every finished span also feeds the process-wide metrics, which render in the
+Prometheus text format for /metrics (server.py, or start_metrics_server for the
+Streamlit app and CLIs). Finished traces are logged as one JSON line each on the
+"agent_coffee.trace" logger; set AGENT_COFFEE_TRACE_LOG to write them to a file.
+'''
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+logger = logging.getLogger("agent_coffee.trace")
+if os.getenv("AGENT_COFFEE_TRACE_LOG"):
+    _handler = logging.FileHandler(os.getenv("AGENT_COFFEE_TRACE_LOG"))
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = {}   # span name -> Histogram of durations
+        self.tokens = {}  # (span name, kind) -> count
+        self.queries = 0
+
+    def record_span(self, span):
+        with self.lock:
+            self.spans.setdefault(span["name"], Histogram()).observe(span["duration"])
+            for kind in ("prompt_tokens", "prefilled_tokens", "generated_tokens", "cached_tokens"):
+                if span["attrs"].get(kind):
+                    key = (span["name"], kind.replace("_tokens", ""))
+                    self.tokens[key] = self.tokens.get(key, 0) + span["attrs"][kind]
+
+    def render(self):
+        lines = [
+            "# HELP agent_coffee_queries_total Queries traced.",
+            "# TYPE agent_coffee_queries_total counter",
+            f"agent_coffee_queries_total {self.queries}",
+            "# HELP agent_coffee_span_seconds Duration of traced spans.",
+            "# TYPE agent_coffee_span_seconds histogram",
+        ]
+        with self.lock:
+            for name, h in sorted(self.spans.items()):
+                for bound, count in zip(BUCKETS, h.counts):
+                    lines.append(f'agent_coffee_span_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+                lines.append(f'agent_coffee_span_seconds_bucket{{span="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'agent_coffee_span_seconds_sum{{span="{name}"}} {h.sum}')
+                lines.append(f'agent_coffee_span_seconds_count{{span="{name}"}} {h.count}')
+            lines += [
+                "# HELP agent_coffee_tokens_total Tokens processed, by span and kind.",
+                "# TYPE agent_coffee_tokens_total counter",
+            ]
+            for (name, kind), count in sorted(self.tokens.items()):
+                lines.append(f'agent_coffee_tokens_total{{span="{name}",kind="{kind}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+recent_traces = deque(maxlen=50)
+
+
+class Trace:
+    def __init__(self, name, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, name, start, duration, attrs):
+        span = {"name": name, "start": round(start - self.start, 6), "duration": duration, "attrs": attrs}
+        with self.lock:
+            self.spans.append(span)
+        metrics.record_span(span)
+
+    def to_dict(self):
+        with self.lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "attrs": self.attrs,
+            "duration": time.time() - self.start,
+            "spans": spans,
+        }
+
+
+def start_trace(name, **attrs):
+    trace = Trace(name, **attrs)
+    current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace):
+    if current_trace.get() is trace:
+        current_trace.set(None)
+    data = trace.to_dict()
+    metrics.record_span({"name": trace.name, "duration": data["duration"], "attrs": {}})
+    with metrics.lock:
+        metrics.queries += 1
+    recent_traces.append(data)
+    logger.info(json.dumps(data))
+    return data
+
+
+@contextmanager
+def span(name, **attrs):
+    # Times the block; attrs can be filled in inside it (e.g. token counts)
+    trace = current_trace.get()
+    start = time.time()
+    try:
+        yield attrs
+    finally:
+        duration = time.time() - start
+        if trace is not None:
+            trace.add(name, start, duration, attrs)
+        else:
+            metrics.record_span({"name": name, "duration": duration, "attrs": attrs})
+
+
+def record(name, duration, **attrs):
+    # Adds a span that was timed elsewhere, ending now
+    trace = current_trace.get()
+    start = time.time() - duration
+    if trace is not None:
+        trace.add(name, start, duration, attrs)
+    else:
+        metrics.record_span({"name": name, "duration": duration, "attrs": attrs})
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    # Imported here: every entry point imports tracing, few serve /metrics
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def maybe_start_metrics_server():
+    # Serves /metrics on AGENT_COFFEE_METRICS_PORT if set; safe to call on every Streamlit rerun
+    global _metrics_server
+    port = os.getenv("AGENT_COFFEE_METRICS_PORT")
+    with _metrics_server_lock:
+        if port and _metrics_server is None:
+            _metrics_server = start_metrics_server(int(port))
+    return _metrics_server
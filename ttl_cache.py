@@ -0,0 +1,214 @@
+'''
+On-disk TTL cache backed by SQLite.
+
+Entries live in one table shared by several namespaces, each with its own TTL
+and size bound. The least recently used entries of a namespace are evicted once
+it holds more than max_entries. get_or_compute coalesces concurrent lookups of
+the same key so only one caller does the expensive work.
+
+While a list is set in the `reads` context variable, every entry that is read
+or written is appended to it as (namespace, key, expires_at); answer_cache uses
+this to tie a cached answer to the tool data it was built from.
+'''
+
+import asyncio
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from budget import BudgetExceeded
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "agent_coffee", "cache.sqlite3")
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+reads = contextvars.ContextVar("ttl_cache_reads", default=None)
+
+
+def _note_read(namespace, key, expires_at):
+    entries = reads.get()
+    if entries is not None:
+        entries.append((namespace, key, expires_at))
+
+
+def _connect(path):
+    # One connection per database file, shared by every namespace in the process
+    with _connections_lock:
+        if path not in _connections:
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            _connections[path] = (conn, threading.Lock())
+        return _connections[path]
+
+
+class TTLCache:
+    def __init__(self, namespace, ttl, max_entries=1000, path=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path or os.getenv("AGENT_COFFEE_CACHE", DEFAULT_PATH)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._inflight = {}
+        self._ainflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def _db(self):
+        return _connect(self.path)
+
+    def get(self, key, default=None):
+        conn, lock = self._db()
+        now = time.time()
+        with lock:
+            row = conn.execute(
+                "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)).fetchone()
+            if row is None or row[1] <= now:
+                if row is not None:
+                    conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+                self.misses += 1
+                return default
+            conn.execute(
+                "UPDATE entries SET last_access = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key))
+            self.hits += 1
+        _note_read(self.namespace, key, row[1])
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        conn, lock = self._db()
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with lock:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), expires_at, now))
+            self._evict(conn)
+        _note_read(self.namespace, key, expires_at)
+
+    def _evict(self, conn):
+        count = conn.execute("SELECT COUNT(*) FROM entries WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+        if count > self.max_entries:
+            conn.execute("""
+                DELETE FROM entries WHERE namespace = ? AND key IN (
+                    SELECT key FROM entries WHERE namespace = ? ORDER BY last_access LIMIT ?
+                )
+            """, (self.namespace, self.namespace, count - self.max_entries))
+
+    def expires_at(self, key):
+        conn, lock = self._db()
+        with lock:
+            row = conn.execute(
+                "SELECT expires_at FROM entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)).fetchone()
+        return row[0] if row else None
+
+    def delete(self, key):
+        conn, lock = self._db()
+        with lock:
+            conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def clear(self):
+        conn, lock = self._db()
+        with lock:
+            conn.execute("DELETE FROM entries WHERE namespace = ?", (self.namespace,))
+
+    def get_or_compute(self, key, compute, should_cache=lambda value: True):
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            # Someone else is already fetching this key; share their result
+            try:
+                value = future.result()
+            except BudgetExceeded:
+                # The owner's query ran out of time, not ours; fetch it ourselves
+                return self.get_or_compute(key, compute, should_cache)
+            _note_read(self.namespace, key, self.expires_at(key))
+            return value
+
+        try:
+            value = compute()
+            if should_cache(value):
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    async def aget_or_compute(self, key, compute, should_cache=lambda value: True):
+        # asyncio flavour of get_or_compute; compute is a coroutine function and
+        # coalescing applies to callers on the same event loop
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+
+        loop = asyncio.get_running_loop()
+        future = self._ainflight.get((loop, key))
+        if future is not None:
+            self.coalesced += 1
+            try:
+                value = await asyncio.shield(future)
+            except BudgetExceeded:
+                return await self.aget_or_compute(key, compute, should_cache)
+            _note_read(self.namespace, key, self.expires_at(key))
+            return value
+        future = self._ainflight[(loop, key)] = loop.create_future()
+        try:
+            value = await compute()
+            if should_cache(value):
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            self._ainflight.pop((loop, key), None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / total if total else 0.0,
+        }